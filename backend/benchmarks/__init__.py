@@ -0,0 +1 @@
+"""性能基准与压测脚本（手动运行，不属于自动化测试）"""
@@ -0,0 +1,410 @@
+"""
+LLM Simulator - 离线的 OpenAI 兼容模拟上游（压测 / 延迟测试用，不消耗供应商额度）
+
+根据 system prompt 的静态前缀识别请求类型（analyze / execute / generate / combined / fanout / vision），
+返回可通过对应 Schema 校验的 JSON；延迟分布、输出速率、流式分块、错误 / 429 注入、
+畸形输出比例均可配置。同一 seed + 相同请求序列的结果完全一致。
+
+两种接入方式（业务代码无需改动）：
+  1. 独立 HTTP 服务：
+       python -m benchmarks.llm_simulator --port 9100 --latency-ms 400 --tokens-per-sec 60
+     然后在 .env 中设置 AI_BASE_URL=http://127.0.0.1:9100/v1（视觉同理 VISION_BASE_URL）
+  2. 进程内 transport：设置 LLM_SIMULATOR=inprocess，llm_pool 构建客户端时改用 SimulatorTransport，
+     请求不经过网络栈（适合基准测试排除本机 TCP 开销）
+
+运行时调整：POST /_sim/config {"error_rate": 0.1, ...}；统计：GET /_sim/stats
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from dataclasses import asdict, dataclass, fields
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+import httpx
+
+from config.styles import REPLY_STYLES, STATIC_PREFIXES
+from models.schemas import IntentType, StrategyType
+
+_CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+_STYLE_KEY_RE = re.compile(r"\b(" + "|".join(map(re.escape, REPLY_STYLES)) + r")\b")
+
+# 视觉 prompt 由 vision_service 构建，不在 STATIC_PREFIXES 中
+_VISION_MARKER = "战术目视"
+
+_SUMMARIES = [
+    "对方在试探你的态度，语气里带着一点期待",
+    "对方情绪有些低落，想要被安慰",
+    "对方在撒娇求关注，希望你主动一点",
+    "对方语气平淡，更像是随口闲聊",
+    "对方有些不满，但还留有余地",
+]
+_REPLIES = [
+    "刚在想你呢，你就来了",
+    "哼，现在才想起我啊",
+    "好啦好啦，我错了还不行嘛",
+    "今晚请你吃好吃的赔罪",
+    "你猜我现在在干嘛",
+    "这么晚还不睡，是在等我吗",
+    "乖，先去休息，明天陪你",
+]
+_KAOMOJI = ["(≧▽≦)ﾉ", "(｡•́︿•̀｡)", "(//∇//)", "(๑•́ ω •̀๑)", "(￣^￣)", "(´・ω・`)"]
+_EMOTIONS = ["撒娇", "生气", "开心", "冷淡", "期待"]
+
+
+@dataclass
+class SimulatorConfig:
+    """模拟参数（环境变量 LLM_SIM_<字段名大写> 覆盖默认值）"""
+    seed: int = 42
+    # 首 token 延迟分布：fixed / uniform (±jitter) / lognormal (sigma=jitter)
+    latency_ms: float = 300.0
+    latency_dist: str = "lognormal"
+    latency_jitter: float = 0.3
+    # 输出速率：非流式响应在首 token 延迟之外再等待 completion_tokens / tokens_per_sec
+    tokens_per_sec: float = 80.0
+    # 流式分块大小（字符）
+    chunk_chars: int = 8
+    # 故障注入比例（0~1）
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    malformed_rate: float = 0.0
+
+    @classmethod
+    def from_env(cls) -> "SimulatorConfig":
+        config = cls()
+        for field in fields(cls):
+            raw = os.getenv(f"LLM_SIM_{field.name.upper()}")
+            if raw is not None:
+                setattr(config, field.name, type(getattr(config, field.name))(raw))
+        return config
+
+    def update(self, values: Dict[str, Any]) -> None:
+        for field in fields(self):
+            if field.name in values:
+                setattr(self, field.name, type(getattr(self, field.name))(values[field.name]))
+
+
+@dataclass
+class SimResponse:
+    """模拟结果：status + headers + (JSON 字典 或 SSE 字节流)"""
+    status: int
+    headers: Dict[str, str]
+    body: Union[Dict[str, Any], AsyncIterator[bytes]]
+
+
+def count_tokens(text: str) -> int:
+    """粗略 token 数：CJK 字符约 0.75，其余约 4 字符 1 token"""
+    cjk = len(_CJK_RE.findall(text))
+    return int(cjk * 0.75 + (len(text) - cjk) / 4) + 1
+
+
+def _message_text(messages: List[Dict[str, Any]]) -> Tuple[str, str]:
+    """返回 (system prompt, 全部消息的文本)，多模态消息只取文本部分"""
+    texts = []
+    for msg in messages:
+        content = msg.get("content", "")
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        texts.append(str(content))
+    system = texts[0] if messages and messages[0].get("role") == "system" else ""
+    return system, "\n".join(texts)
+
+
+def classify(system_prompt: str) -> str:
+    """按静态前缀识别请求类型"""
+    for kind, prefix in STATIC_PREFIXES.items():
+        if system_prompt.startswith(prefix):
+            return kind
+    if _VISION_MARKER in system_prompt:
+        return "vision"
+    return "unknown"
+
+
+class LLMSimulator:
+    """
+    模拟上游核心逻辑（HTTP 服务与进程内 transport 共用）
+
+    - 每个请求的随机数由 seed + 请求内容 + 该内容第几次出现 决定，与并发调度顺序无关
+    - 故障注入顺序：429 -> 5xx -> 畸形输出
+    """
+
+    def __init__(self, config: Optional[SimulatorConfig] = None) -> None:
+        self.config = config or SimulatorConfig.from_env()
+        self._seen: Dict[str, int] = {}
+        self.counts: Dict[str, Dict[str, int]] = {}
+
+    def reset(self) -> None:
+        self._seen.clear()
+        self.counts.clear()
+
+    def _rng(self, key: str) -> random.Random:
+        key = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+        occurrence = self._seen.get(key, 0)
+        self._seen[key] = occurrence + 1
+        digest = hashlib.blake2b(f"{self.config.seed}:{key}:{occurrence}".encode("utf-8"), digest_size=8)
+        return random.Random(int.from_bytes(digest.digest(), "big"))
+
+    def _record(self, kind: str, outcome: str) -> None:
+        counts = self.counts.setdefault(kind, {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+    def _first_token_delay(self, rng: random.Random) -> float:
+        mean = self.config.latency_ms / 1000
+        jitter = self.config.latency_jitter
+        if self.config.latency_dist == "fixed" or jitter <= 0:
+            return mean
+        if self.config.latency_dist == "uniform":
+            return max(0.0, rng.uniform(mean * (1 - jitter), mean * (1 + jitter)))
+        # lognormal：中位数为 latency_ms，长尾由 sigma 控制
+        return mean * rng.lognormvariate(0.0, jitter)
+
+    # ==================== 内容生成 ====================
+
+    @staticmethod
+    def _styles(system_prompt: str, kind: str, rng: random.Random) -> List[str]:
+        """从 prompt 的可变部分按出现顺序提取风格代码，不足时随机补齐"""
+        tail = system_prompt[len(STATIC_PREFIXES.get(kind, "")):]
+        keys: List[str] = []
+        for key in _STYLE_KEY_RE.findall(tail):
+            if key not in keys:
+                keys.append(key)
+        wanted = 1 if kind == "fanout" else 3
+        pool = [key for key in REPLY_STYLES if key not in keys]
+        rng.shuffle(pool)
+        return (keys + pool)[:wanted]
+
+    @staticmethod
+    def _option(key: str, rng: random.Random) -> Dict[str, Any]:
+        return {
+            "style": key,
+            "style_name": REPLY_STYLES[key]["name"],
+            "text": rng.choice(_REPLIES),
+            "kaomoji": rng.choice(_KAOMOJI),
+            "score": rng.randint(-1, 3),
+        }
+
+    @staticmethod
+    def _analysis(rng: random.Random) -> Dict[str, Any]:
+        return {
+            "summary": rng.choice(_SUMMARIES),
+            "emotion_score": rng.randint(-3, 3),
+            "intent": rng.choice([i.value for i in IntentType]),
+            "strategy": rng.choice([s.value for s in StrategyType]),
+            "confidence": round(rng.uniform(0.6, 0.95), 2),
+            "burst_detected": False,
+            "pressure_level": rng.randint(0, 3),
+        }
+
+    def build_content(self, kind: str, system_prompt: str, rng: random.Random) -> Dict[str, Any]:
+        """生成可通过对应 Schema 校验的输出"""
+        if kind == "analyze":
+            return self._analysis(rng)
+        if kind in ("execute", "generate"):
+            options = [self._option(key, rng) for key in self._styles(system_prompt, kind, rng)]
+            return {"analysis": rng.choice(_SUMMARIES), "options": options}
+        if kind == "combined":
+            options = [self._option(key, rng) for key in self._styles(system_prompt, kind, rng)]
+            return {**self._analysis(rng), "options": options}
+        if kind == "fanout":
+            option = self._option(self._styles(system_prompt, kind, rng)[0], rng)
+            return {"analysis": rng.choice(_SUMMARIES), "text": option["text"],
+                    "kaomoji": option["kaomoji"], "score": option["score"]}
+        if kind == "vision":
+            return {
+                "summary": rng.choice(_SUMMARIES),
+                "bubbles": [
+                    {"text": rng.choice(_REPLIES), "is_me": idx % 2 == 1, "confidence": round(rng.uniform(0.8, 0.99), 2)}
+                    for idx in range(rng.randint(2, 5))
+                ],
+                "emotion_detected": rng.choice(_EMOTIONS),
+                "emotion_score": rng.randint(-3, 3),
+                "context_hint": "对方可能在试探你的底线",
+                "tactical_suggestion": "先接住情绪，再轻松转移话题",
+                "confidence": round(rng.uniform(0.7, 0.95), 2),
+            }
+        return {"reply": rng.choice(_REPLIES)}
+
+    @staticmethod
+    def malform(text: str, rng: random.Random) -> str:
+        """常见的模型输出缺陷：围栏 + 说明文字、尾随逗号、被截断、完全不是 JSON"""
+        variant = rng.choice(("prose", "trailing_comma", "truncated", "garbage"))
+        if variant == "prose":
+            return f"好的，以下是分析结果：\n```json\n{text}\n```\n希望对你有帮助！"
+        if variant == "trailing_comma":
+            return text[:-1] + ",}"
+        if variant == "truncated":
+            return text[:max(1, int(len(text) * rng.uniform(0.5, 0.9)))]
+        return "抱歉，我无法完成这个请求。"
+
+    # ==================== 请求处理 ====================
+
+    async def handle_chat(self, body: Dict[str, Any]) -> SimResponse:
+        messages = body.get("messages") or []
+        system_prompt, all_text = _message_text(messages)
+        kind = classify(system_prompt)
+        rng = self._rng(f"{body.get('model')}:{all_text}")
+
+        if rng.random() < self.config.rate_limit_rate:
+            self._record(kind, "rate_limited")
+            return SimResponse(429, {"retry-after": str(self.config.retry_after)},
+                               {"error": {"message": "simulated rate limit", "type": "rate_limit"}})
+        if rng.random() < self.config.error_rate:
+            self._record(kind, "error")
+            await asyncio.sleep(self._first_token_delay(rng))
+            return SimResponse(rng.choice((500, 502, 503)), {},
+                               {"error": {"message": "simulated upstream error", "type": "server_error"}})
+
+        content = json.dumps(self.build_content(kind, system_prompt, rng), ensure_ascii=False)
+        if rng.random() < self.config.malformed_rate:
+            content = self.malform(content, rng)
+            self._record(kind, "malformed")
+        else:
+            self._record(kind, "ok")
+
+        max_tokens = body.get("max_tokens")
+        completion_tokens = count_tokens(content)
+        finish_reason = "stop"
+        if max_tokens and completion_tokens > max_tokens:
+            # 与真实上游一致：超出 max_tokens 的输出被截断
+            content = content[:max(1, int(len(content) * max_tokens / completion_tokens))]
+            completion_tokens = max_tokens
+            finish_reason = "length"
+        usage = {
+            "prompt_tokens": count_tokens(all_text),
+            "completion_tokens": completion_tokens,
+            "total_tokens": count_tokens(all_text) + completion_tokens,
+        }
+        first_token = self._first_token_delay(rng)
+        model = body.get("model", "simulator")
+
+        if body.get("stream"):
+            return SimResponse(200, {"content-type": "text/event-stream"},
+                               self._stream(content, model, first_token, finish_reason, usage))
+
+        await asyncio.sleep(first_token + completion_tokens / self.config.tokens_per_sec)
+        return SimResponse(200, {}, {
+            "id": f"sim-{rng.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }],
+            "usage": usage,
+        })
+
+    async def _stream(
+        self,
+        content: str,
+        model: str,
+        first_token: float,
+        finish_reason: str,
+        usage: Dict[str, int]
+    ) -> AsyncIterator[bytes]:
+        """按 chunk_chars 分块推送，块间间隔由 tokens_per_sec 决定"""
+        def chunk(delta: Dict[str, Any], reason: Optional[str] = None, **extra: Any) -> bytes:
+            data = {
+                "id": "sim-stream", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": reason}], **extra,
+            }
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        await asyncio.sleep(first_token)
+        step = max(1, self.config.chunk_chars)
+        for i in range(0, len(content), step):
+            if i:
+                await asyncio.sleep(count_tokens(content[i:i + step]) / self.config.tokens_per_sec)
+            yield chunk({"content": content[i:i + step]})
+        yield chunk({}, finish_reason, usage=usage)
+        yield b"data: [DONE]\n\n"
+
+    def stats(self) -> Dict[str, Any]:
+        return {"config": asdict(self.config), "requests": self.counts}
+
+
+simulator = LLMSimulator()
+
+
+# ==================== 进程内 transport ====================
+
+class SimulatorTransport(httpx.AsyncBaseTransport):
+    """httpx transport：直接调用 LLMSimulator，流式响应保留真实的分块时序"""
+
+    def __init__(self, sim: Optional[LLMSimulator] = None) -> None:
+        self.sim = sim or simulator
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.endswith("/models"):
+            return httpx.Response(200, json={"object": "list", "data": []})
+        if not path.endswith("/chat/completions"):
+            return httpx.Response(404, json={"error": {"message": f"unknown path {path}"}})
+
+        body = json.loads(await request.aread() or b"{}")
+        result = await self.sim.handle_chat(body)
+        if isinstance(result.body, dict):
+            return httpx.Response(result.status, headers=result.headers, json=result.body)
+        return httpx.Response(result.status, headers=result.headers, content=result.body)
+
+
+# ==================== 独立 HTTP 服务 ====================
+
+def create_app(sim: Optional[LLMSimulator] = None):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    sim = sim or simulator
+    app = FastAPI(title="SDP LLM Simulator")
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": []}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        result = await sim.handle_chat(await request.json())
+        if isinstance(result.body, dict):
+            return JSONResponse(status_code=result.status, content=result.body, headers=result.headers)
+        return StreamingResponse(result.body, status_code=result.status, headers=result.headers,
+                                 media_type="text/event-stream")
+
+    @app.get("/_sim/stats")
+    async def sim_stats():
+        return sim.stats()
+
+    @app.post("/_sim/config")
+    async def sim_config(request: Request):
+        sim.config.update(await request.json())
+        return sim.stats()
+
+    @app.post("/_sim/reset")
+    async def sim_reset():
+        sim.reset()
+        return sim.stats()
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible LLM simulator for offline load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    for field in fields(SimulatorConfig):
+        default = getattr(simulator.config, field.name)
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+    simulator.config.update(vars(args))
+
+    import uvicorn
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
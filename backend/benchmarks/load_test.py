@@ -0,0 +1,397 @@
+"""
+HTTP 压测 / 延迟基准（取代原先仓库根目录的 diagnose_data_flow.py 顺序冒烟脚本）
+
+按并发阶梯驱动 /api/analyze、/api/execute、/api/generate、/api/vision/analyze、/api/selection，
+请求按权重混合，负载模拟真实分布：历史深度、连发输入、不同尺寸的截图。
+输出每个阶段 / 接口的吞吐、p50/p95/p99 延迟、错误率与服务端阶段耗时（JSON，便于对比多次运行）。
+
+服务端阶段耗时来自 Server-Timing 响应头，以及响应体中的 *TimeMs / *_time_ms 字段。
+
+端口说明：README 与 start_server.bat 以 `uvicorn main:app --port 8000` 启动，
+而 `python main.py` 监听 8002；未指定 --base-url 时依次探测两者的 /bridge/health。
+
+Usage (from backend/):
+  python -m benchmarks.load_test --stages 2:20,8:20,16:20 --json report.json
+  python -m benchmarks.load_test --in-process --stages 4:10     # 进程内 + 模拟上游，完全离线
+  python -m benchmarks.load_test --base-url http://127.0.0.1:8002 --mix analyze=1,generate=1
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import re
+import statistics
+import struct
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+DEFAULT_BASE_URLS = ["http://127.0.0.1:8000", "http://127.0.0.1:8002"]
+DEFAULT_MIX = "analyze=3,execute=2,generate=3,vision=1,selection=1"
+
+MESSAGES = [
+    "你昨天为什么一整晚都不回我消息",
+    "今天被老板骂了，心情好差",
+    "周末要不要一起去看电影？",
+    "你是不是觉得我很烦啊",
+    "刚刚路过你们公司楼下，顺便给你带了杯奶茶",
+    "我朋友说你上周和一个女生去吃饭了？",
+    "算了，你忙你的吧",
+    "晚安",
+    "哈哈哈哈哈",
+    "在干嘛呢",
+    "你猜我今天遇到谁了",
+    "我有点想你了，你呢",
+]
+BURST_LINES = ["在吗", "人呢", "？", "说话", "你又不理我", "行吧", "哼", "我生气了"]
+ASSISTANT_LINES = ["在想你呀", "刚忙完，怎么啦", "乖，别生气", "哈哈你好可爱", "我也是"]
+STRATEGIES = ["COMFORT", "PUSH_PULL", "PLAYFUL", "DEFENSIVE_FLIRT", "DIRECT"]
+INTENTS = ["SEEKING_ATTENTION", "CASUAL_CHAT", "COMPLAINING", "TESTING_BOUNDARIES"]
+
+# 响应体中的服务端耗时字段
+_TIMING_KEYS = ("analysisTimeMs", "executionTimeMs", "generationTimeMs", "analysis_time_ms")
+_SERVER_TIMING_RE = re.compile(r"([\w.-]+)(?:;[^,]*?dur=([\d.]+))?")
+
+
+# ==================== 负载生成 ====================
+
+def _png(width: int, height: int, noise_ratio: float, rng: random.Random) -> bytes:
+    """
+    生成 RGB PNG：大部分行是纯色（压缩后很小），noise_ratio 比例的行是随机像素，
+    用来近似真实聊天截图（大面积背景 + 文字 / 头像）的压缩后体积
+    """
+    raw = bytearray()
+    background = bytes([245, 245, 245]) * width
+    for _ in range(height):
+        raw.append(0)  # filter: none
+        raw += rng.randbytes(width * 3) if rng.random() < noise_ratio else background
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(bytes(raw), 6)) + chunk(b"IEND", b""))
+
+
+@dataclass
+class Workload:
+    """请求负载生成器（同一 seed 产生相同的负载序列）"""
+    history_depths: List[int]
+    burst_ratio: float
+    screenshot_sizes: List[Tuple[int, int]]
+    noise_ratio: float = 0.15
+    seed: int = 42
+    rng: random.Random = field(init=False)
+    screenshots: List[str] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.rng = random.Random(self.seed)
+        # 截图预先编码好，避免把客户端编码耗时计入延迟
+        self.screenshots = [
+            base64.b64encode(_png(w, h, self.noise_ratio, self.rng)).decode("ascii")
+            for w, h in self.screenshot_sizes
+        ]
+
+    def message(self) -> str:
+        if self.rng.random() < self.burst_ratio:
+            return "\n".join(self.rng.choice(BURST_LINES) for _ in range(self.rng.randint(3, 6)))
+        # 末尾附加随机编号，避免命中分析缓存 / 请求合并
+        return f"{self.rng.choice(MESSAGES)}{'～' * self.rng.randint(0, 2)} #{self.rng.randint(0, 10**6)}"
+
+    def history(self) -> List[Dict[str, str]]:
+        depth = self.rng.choice(self.history_depths)
+        return [
+            {"role": "user", "content": self.rng.choice(MESSAGES)} if idx % 2 == 0
+            else {"role": "assistant", "content": self.rng.choice(ASSISTANT_LINES)}
+            for idx in range(depth)
+        ]
+
+    def analysis(self) -> Dict[str, Any]:
+        return {
+            "summary": "对方在试探你的态度",
+            "emotion_score": self.rng.randint(-3, 3),
+            "intent": self.rng.choice(INTENTS),
+            "strategy": self.rng.choice(STRATEGIES),
+            "confidence": 0.8,
+            "burst_detected": False,
+            "pressure_level": self.rng.randint(0, 3),
+        }
+
+    def request(self, endpoint: str) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+        """返回 (path, JSON body, 附加标签)"""
+        if endpoint == "analyze":
+            history = self.history()
+            return "/api/analyze", {"user_input": self.message(), "history": history}, {"historyDepth": len(history)}
+        if endpoint == "execute":
+            history = self.history()
+            return "/api/execute", {
+                "user_input": self.message(), "history": history, "analysis_context": self.analysis(),
+            }, {"historyDepth": len(history)}
+        if endpoint == "generate":
+            history = self.history()
+            return "/api/generate", {"text": self.message(), "history": history}, {"historyDepth": len(history)}
+        if endpoint == "vision":
+            idx = self.rng.randrange(len(self.screenshots))
+            w, h = self.screenshot_sizes[idx]
+            return "/api/vision/analyze", {"image_base64": self.screenshots[idx], "hint": "微信聊天记录"}, {
+                "screenshot": f"{w}x{h}", "imageKB": len(self.screenshots[idx]) * 3 // 4 // 1024,
+            }
+        if endpoint == "selection":
+            return "/api/selection", {
+                "sessionId": f"bench-{self.rng.getrandbits(32):08x}", "optionIndex": self.rng.randint(0, 2),
+            }, {}
+        raise ValueError(f"unknown endpoint {endpoint}")
+
+
+# ==================== 结果解析 ====================
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """解析 Server-Timing: analyze;dur=812.3, llm;dur=790 -> {"analyze": 812.3, "llm": 790.0}"""
+    timings: Dict[str, float] = {}
+    for part in (header or "").split(","):
+        match = _SERVER_TIMING_RE.match(part.strip())
+        if match and match.group(2):
+            timings[match.group(1)] = float(match.group(2))
+    return timings
+
+
+def body_timings(body: Any) -> Dict[str, float]:
+    """响应体（及 data 子对象）中的 *TimeMs 字段"""
+    timings: Dict[str, float] = {}
+    for container in (body, body.get("data") if isinstance(body, dict) else None):
+        if isinstance(container, dict):
+            for key in _TIMING_KEYS:
+                if isinstance(container.get(key), (int, float)):
+                    timings[key] = float(container[key])
+    return timings
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """最近秩百分位"""
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[idx], 1)
+
+
+def summarize(samples: List[Dict[str, Any]], duration: float) -> Dict[str, Any]:
+    ok = [s for s in samples if s["ok"]]
+    latencies = sorted(s["ms"] for s in samples)
+    status: Dict[str, int] = {}
+    for s in samples:
+        status[str(s["status"])] = status.get(str(s["status"]), 0) + 1
+    server: Dict[str, List[float]] = {}
+    for s in ok:
+        for name, value in s["serverTimings"].items():
+            server.setdefault(name, []).append(value)
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "errorRate": round((len(samples) - len(ok)) / len(samples), 4) if samples else 0.0,
+        "throughputRps": round(len(samples) / duration, 2) if duration > 0 else 0.0,
+        "goodputRps": round(len(ok) / duration, 2) if duration > 0 else 0.0,
+        "latencyMs": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": round(statistics.mean(latencies), 1) if latencies else None,
+            "max": round(latencies[-1], 1) if latencies else None,
+        },
+        "status": status,
+        "serverTimingsMs": {
+            name: {"mean": round(statistics.mean(values), 1), "p95": percentile(sorted(values), 95)}
+            for name, values in sorted(server.items())
+        },
+    }
+
+
+# ==================== 执行 ====================
+
+async def _send(
+    client: httpx.AsyncClient,
+    workload: Workload,
+    endpoint: str,
+    stage: int
+) -> Dict[str, Any]:
+    path, body, tags = workload.request(endpoint)
+    start = time.perf_counter()
+    status: Any
+    try:
+        response = await client.post(path, json=body)
+        status = response.status_code
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        # 业务错误（success=false）同样计为失败
+        ok = status == 200 and not (isinstance(payload, dict) and payload.get("success") is False)
+        timings = {**body_timings(payload), **parse_server_timing(response.headers.get("server-timing"))}
+    except httpx.HTTPError as exc:
+        status, ok, timings = type(exc).__name__, False, {}
+    return {
+        "endpoint": endpoint,
+        "stage": stage,
+        "status": status,
+        "ok": ok,
+        "ms": (time.perf_counter() - start) * 1000,
+        "serverTimings": timings,
+        **tags,
+    }
+
+
+async def run_stage(
+    client: httpx.AsyncClient,
+    workload: Workload,
+    pick: Callable[[], str],
+    stage: int,
+    concurrency: int,
+    duration: float
+) -> Tuple[List[Dict[str, Any]], float]:
+    """concurrency 个闭环 worker 持续发请求直到阶段结束（已发出的请求等待完成）"""
+    samples: List[Dict[str, Any]] = []
+    start = time.perf_counter()
+    stop_at = start + duration
+
+    async def worker() -> None:
+        while time.perf_counter() < stop_at:
+            samples.append(await _send(client, workload, pick(), stage))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+
+def _parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _parse_stages(text: str) -> List[Tuple[int, float]]:
+    """"2:20,8:20" -> [(并发 2, 20 秒), (并发 8, 20 秒)]"""
+    return [(int(c), float(d)) for c, d in (part.split(":") for part in text.split(","))]
+
+
+def _resolve_base_url(candidates: List[str]) -> str:
+    for url in candidates:
+        try:
+            if httpx.get(f"{url}/bridge/health", timeout=2).status_code == 200:
+                return url
+        except httpx.HTTPError:
+            continue
+    raise SystemExit(
+        f"No backend reachable at {', '.join(candidates)}. "
+        "Start it with `uvicorn main:app --port 8000` (or `python main.py`, which listens on 8002), "
+        "pass --base-url, or use --in-process."
+    )
+
+
+def _in_process_client(timeout: float) -> httpx.AsyncClient:
+    """进程内驱动 main.app，上游由 LLM 模拟器代替（必须在导入 main 之前设置环境变量）"""
+    os.environ.setdefault("LLM_SIMULATOR", "inprocess")
+    os.environ.setdefault("SILICONFLOW_API_KEY", "simulator")
+    os.environ.setdefault("ANALYZE_LABEL_LOG", "false")
+    import main  # noqa: E402
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://in-process", timeout=timeout)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    mix = _parse_mix(args.mix)
+    stages = _parse_stages(args.stages)
+    workload = Workload(
+        history_depths=[int(d) for d in args.history_depths.split(",")],
+        burst_ratio=args.burst_ratio,
+        screenshot_sizes=[tuple(int(v) for v in size.split("x")) for size in args.screenshot_sizes.split(",")],
+        seed=args.seed,
+    )
+    picker = random.Random(args.seed + 1)
+    names, weights = list(mix), list(mix.values())
+
+    def pick() -> str:
+        return picker.choices(names, weights)[0]
+
+    if args.in_process:
+        client, base_url = _in_process_client(args.timeout), "in-process"
+    else:
+        base_url = args.base_url or _resolve_base_url(DEFAULT_BASE_URLS)
+        limits = httpx.Limits(max_connections=max(c for c, _ in stages) * 2)
+        client = httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits)
+    print(f"Target: {base_url} | mix: {mix} | stages: {stages}")
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "baseUrl": base_url,
+            "startedAt": int(time.time() * 1000),
+            "args": vars(args),
+            "screenshotKB": [len(s) * 3 // 4 // 1024 for s in workload.screenshots],
+        },
+        "stages": [],
+    }
+    all_samples: List[Dict[str, Any]] = []
+    total_time = 0.0
+    async with client:
+        for idx, (concurrency, duration) in enumerate(stages):
+            samples, elapsed = await run_stage(client, workload, pick, idx, concurrency, duration)
+            all_samples.extend(samples)
+            total_time += elapsed
+            by_endpoint: Dict[str, List[Dict[str, Any]]] = {}
+            for s in samples:
+                by_endpoint.setdefault(s["endpoint"], []).append(s)
+            stage_report = {
+                "concurrency": concurrency,
+                "durationS": round(elapsed, 2),
+                "overall": summarize(samples, elapsed),
+                "endpoints": {name: summarize(items, elapsed) for name, items in sorted(by_endpoint.items())},
+            }
+            report["stages"].append(stage_report)
+            overall = stage_report["overall"]
+            print(
+                f"[stage {idx}] c={concurrency:<3} {overall['requests']:>5} req "
+                f"{overall['throughputRps']:>7} rps  p50 {overall['latencyMs']['p50']}ms  "
+                f"p95 {overall['latencyMs']['p95']}ms  p99 {overall['latencyMs']['p99']}ms  "
+                f"err {overall['errorRate']:.2%}"
+            )
+
+    by_endpoint_all: Dict[str, List[Dict[str, Any]]] = {}
+    for s in all_samples:
+        by_endpoint_all.setdefault(s["endpoint"], []).append(s)
+    report["overall"] = summarize(all_samples, total_time)
+    report["endpoints"] = {name: summarize(items, total_time) for name, items in sorted(by_endpoint_all.items())}
+    if args.samples:
+        report["samples"] = all_samples
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test / latency benchmark for the SDP backend")
+    parser.add_argument("--base-url", help=f"default: first healthy of {', '.join(DEFAULT_BASE_URLS)}")
+    parser.add_argument("--in-process", action="store_true", help="drive main.app in-process with the LLM simulator")
+    parser.add_argument("--stages", default="2:15,8:15,16:15", help="concurrency:seconds ramp, comma separated")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight, comma separated")
+    parser.add_argument("--history-depths", default="0,0,4,12,24", help="history depth drawn uniformly from this list")
+    parser.add_argument("--burst-ratio", type=float, default=0.2, help="fraction of multi-line burst inputs")
+    parser.add_argument("--screenshot-sizes", default="720x1280,1080x2340", help="WxH, comma separated")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--samples", action="store_true", help="include every request sample in the JSON report")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report["endpoints"], ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
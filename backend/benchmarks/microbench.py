@@ -0,0 +1,334 @@
+"""
+CPU 热路径微基准（每个请求都会执行的纯 Python 代码）
+
+覆盖：config/styles.py 的 Prompt 构建、AIService._build_context_prompt、
+_parse_response / _parse_analysis_response + pydantic 校验、main.format_option、
+create_captcha_image、db_service 的查询（TinyDB / SQLite 两种存储）、ChatRequest.validate_history。
+每个用例在多个合成数据规模下测量单次耗时（timeit 自动校准循环次数，取多轮中位数）
+与内存分配（tracemalloc：单次调用的峰值增量 + 多次调用后的净保留字节）。
+
+与基线对比时，中位耗时超出 --tolerance 的用例标记为 REGRESSION 并以退出码 1 结束，可直接接入 CI。
+
+Usage (from backend/):
+  python -m benchmarks.microbench [--filter prompt] [--json current.json]
+  python -m benchmarks.microbench --compare baseline.json --tolerance 0.25
+"""
+import argparse
+import atexit
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+# 不连接真实上游、不写训练数据
+os.environ.setdefault("LLM_SIMULATOR", "inprocess")
+os.environ.setdefault("SILICONFLOW_API_KEY", "microbench")
+os.environ.setdefault("ANALYZE_LABEL_LOG", "false")
+
+from loguru import logger  # noqa: E402
+
+logger.remove()
+logger.add(sys.stderr, level="WARNING")
+
+import main  # noqa: E402
+from config.styles import (  # noqa: E402
+    build_advisor_prompt,
+    build_analyze_prompt,
+    build_execute_prompt,
+    get_random_styles,
+)
+from models.schemas import ChatRequest  # noqa: E402
+from services.ai_service import ai_service  # noqa: E402
+from services.db_service import DatabaseService  # noqa: E402
+from services.db_storage import TinyDBStorage, migrate_tinydb  # noqa: E402
+
+Setup = Callable[[Any], Callable[[], Any]]
+
+MESSAGES = [
+    "你昨天为什么一整晚都不回我消息",
+    "今天被老板骂了，心情好差，真的不想说话了",
+    "周末要不要一起去看电影？听说新上映的那部还不错",
+    "我朋友说你上周和一个女生去吃饭了？",
+    "算了，你忙你的吧",
+]
+ANALYSIS = {
+    "summary": "对方在试探你的态度", "emotion_score": -1, "intent": "TESTING_BOUNDARIES",
+    "strategy": "PUSH_PULL", "confidence": 0.82, "burst_detected": False, "pressure_level": 2,
+}
+
+
+@dataclass
+class Benchmark:
+    name: str
+    sizes: List[Any]
+    setup: Setup
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def bench(name: str, sizes: List[Any]) -> Callable[[Setup], Setup]:
+    """注册用例：setup(size) 准备好合成数据后返回被测的无参函数"""
+    def decorator(setup: Setup) -> Setup:
+        BENCHMARKS.append(Benchmark(name, sizes, setup))
+        return setup
+    return decorator
+
+
+# ==================== 合成数据 ====================
+
+def make_history(n: int, chars: int = 30) -> List[Dict[str, str]]:
+    rng = random.Random(n)
+    history = []
+    for idx in range(n):
+        text = rng.choice(MESSAGES)
+        history.append({
+            "role": "user" if idx % 2 == 0 else "assistant",
+            "content": (text * (chars // len(text) + 1))[:chars],
+        })
+    return history
+
+
+def make_advisor_output(variant: str) -> str:
+    styles = get_random_styles(3)
+    data = {
+        "analysis": "对方在撒娇求关注，希望你主动一点",
+        "options": [
+            {"style": s["key"], "style_name": s["name"], "text": "刚在想你呢，你就来了",
+             "kaomoji": "(≧▽≦)ﾉ", "score": 2}
+            for s in styles
+        ],
+    }
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if variant == "fenced":
+        return f"好的，结果如下：\n```json\n{text}\n```"
+    if variant == "truncated":
+        # 在 options 数组闭合之前截断（选项都完整，修复后仍可通过校验）
+        return text[:text.rindex("]")]
+    return text
+
+
+# ==================== 用例 ====================
+
+@bench("prompt.analyze", sizes=[0, 8, 32])
+def _prompt_analyze(n: int):
+    history = make_history(n)
+    return lambda: build_analyze_prompt(MESSAGES[0], history)
+
+
+@bench("prompt.execute", sizes=[0, 8, 32])
+def _prompt_execute(n: int):
+    history = make_history(n)
+    styles = get_random_styles(3)
+    return lambda: build_execute_prompt(MESSAGES[0], ANALYSIS, styles, history, "")
+
+
+@bench("prompt.advisor", sizes=[0, 2000, 8000])
+def _prompt_advisor(context_chars: int):
+    styles = get_random_styles(3)
+    context = "历史" * (context_chars // 2)
+    return lambda: build_advisor_prompt(MESSAGES[0], styles, context)
+
+
+@bench("ai._build_context_prompt", sizes=[0, 8, 32])
+def _context_prompt(n: int):
+    # 包含按 token 预算压缩历史（摘要缓存命中后的稳态）
+    history = make_history(n, chars=80)
+    styles = get_random_styles(3)
+    return lambda: ai_service._build_context_prompt(MESSAGES[0], history, styles)
+
+
+@bench("ai._parse_response", sizes=["clean", "fenced", "truncated"])
+def _parse_response(variant: str):
+    raw = make_advisor_output(variant)
+    return lambda: ai_service._parse_response(raw)
+
+
+@bench("ai._parse_analysis_response", sizes=["clean"])
+def _parse_analysis(_: str):
+    raw = json.dumps(ANALYSIS, ensure_ascii=False)
+    return lambda: ai_service._parse_analysis_response(raw)
+
+
+@bench("main.format_option", sizes=[3, 30])
+def _format_option(n: int):
+    options = json.loads(make_advisor_output("clean"))["options"] * (n // 3)
+    return lambda: [main.format_option(idx, opt) for idx, opt in enumerate(options)]
+
+
+@bench("main.create_captcha_image", sizes=[4, 6])
+def _captcha(length: int):
+    text = "A3K9Z7"[:length]
+    return lambda: main.create_captcha_image(text)
+
+
+@bench("schema.ChatRequest.validate_history", sizes=[8, 32])
+def _validate_history(n: int):
+    history = make_history(n)
+    return lambda: ChatRequest(user_input=MESSAGES[0], history=history)
+
+
+def _temp_db(backend: str, sessions: int, selections: int) -> DatabaseService:
+    """临时数据库文件，预先填充 sessions / selections（先写 TinyDB，SQLite 再从中导入）"""
+    def temp_path(suffix: str) -> str:
+        handle, path = tempfile.mkstemp(prefix="sdp-microbench-", suffix=suffix)
+        os.close(handle)
+        for extra in ("", "-wal", "-shm"):
+            atexit.register(lambda p=path + extra: os.path.exists(p) and os.remove(p))
+        return path
+
+    json_path = temp_path(".json")
+    seed = TinyDBStorage(json_path)
+    seed.sessions.insert_multiple(
+        {
+            "id": f"session-{idx}", "userId": f"user-{idx % 50}", "originalText": MESSAGES[idx % len(MESSAGES)],
+            "generatedOptions": [{"id": f"opt-{k}", "style": "TSUNDERE", "text": "哼"} for k in range(1, 4)],
+            "sceneSummary": "", "messages": [], "createdAt": idx, "updatedAt": idx,
+        }
+        for idx in range(sessions)
+    )
+    seed.selections.insert_multiple(
+        {"sessionId": f"session-{idx % max(sessions, 1)}", "selectedOptionId": "opt-1",
+         "userId": f"user-{idx % 50}", "createdAt": idx}
+        for idx in range(selections)
+    )
+    if backend == "tinydb":
+        return DatabaseService(db_path=json_path, backend="tinydb")
+    seed.close()
+    db = DatabaseService(db_path=temp_path(".db"), backend="sqlite")
+    migrate_tinydb(json_path, db.storage)
+    return db
+
+
+def _register_db_benches(backend: str) -> None:
+    @bench(f"db.{backend}.get_session", sizes=[100, 1000, 5000])
+    def _db_get_session(n: int):
+        db = _temp_db(backend, n, 0)
+        target = f"session-{n // 2}"
+        storage = db.storage
+
+        def op():
+            # TinyDB 的查询缓存在每次写入后失效，线上会话表写入频繁，这里测量未命中缓存的路径
+            if isinstance(storage, TinyDBStorage):
+                storage.sessions.clear_cache()
+            return db.get_session(target)
+        return op
+
+    @bench(f"db.{backend}.get_user_top_styles", sizes=[100, 1000])
+    def _db_top_styles(n: int):
+        # 每个用户 n/50 条选择，每条选择对应一个会话
+        db = _temp_db(backend, n, n)
+        return lambda: db.get_user_top_styles("user-7")
+
+    @bench(f"db.{backend}.create_selection", sizes=[1000])
+    def _db_create_selection(n: int):
+        # 写入路径：TinyDB 每次写入重写整个文件，SQLite 只追加一行
+        db = _temp_db(backend, n, n)
+        return lambda: db.create_selection("session-7", "opt-1", "user-7")
+
+
+for _backend in ("tinydb", "sqlite"):
+    _register_db_benches(_backend)
+
+
+# ==================== 测量 ====================
+
+def measure(fn: Callable[[], Any], repeat: int, min_time: float) -> Dict[str, Any]:
+    """耗时：自动校准循环次数，取 repeat 轮的每次耗时；内存：tracemalloc 峰值与净保留"""
+    fn()  # 预热（填充缓存、导入惰性模块）
+    timer = timeit.Timer(fn)
+    loops = 1
+    while True:
+        if timer.timeit(loops) >= min_time / repeat:
+            break
+        loops *= 2
+    per_op = [t / loops * 1e6 for t in timer.repeat(repeat=repeat, number=loops)]
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        alloc_loops = max(1, min(loops, 100))
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(alloc_loops):
+            fn()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(per_op)
+    return {
+        "loops": loops,
+        "medianUs": round(median, 2),
+        "minUs": round(min(per_op), 2),
+        "stdevPct": round(statistics.pstdev(per_op) / median * 100, 1) if median else 0.0,
+        "peakKB": round((peak - base) / 1024, 1),
+        "retainedBytesPerOp": round((after - before) / alloc_loops, 1),
+    }
+
+
+def run(name_filter: Optional[str], repeat: int, min_time: float) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    print(f"{'benchmark':<44}{'loops':>8}{'median µs':>12}{'min µs':>10}{'±%':>7}{'peak KB':>10}{'retained B':>12}")
+    for benchmark in BENCHMARKS:
+        if name_filter and name_filter not in benchmark.name:
+            continue
+        for size in benchmark.sizes:
+            random.seed(0)
+            key = f"{benchmark.name}[{size}]"
+            result = measure(benchmark.setup(size), repeat, min_time)
+            results[key] = result
+            print(
+                f"{key:<44}{result['loops']:>8}{result['medianUs']:>12}{result['minUs']:>10}"
+                f"{result['stdevPct']:>7}{result['peakKB']:>10}{result['retainedBytesPerOp']:>12}"
+            )
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline_path: str, tolerance: float) -> List[str]:
+    """返回中位耗时超出 基线 * (1 + tolerance) 的用例"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f).get("results", {})
+    regressions = []
+    print(f"\nCompared with {baseline_path} (tolerance {tolerance:.0%}):")
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result["medianUs"] / baseline[key]["medianUs"] if baseline[key]["medianUs"] else 1.0
+        flag = "REGRESSION" if ratio > 1 + tolerance else ("faster" if ratio < 1 - tolerance else "")
+        print(f"  {key:<44}{baseline[key]['medianUs']:>12} -> {result['medianUs']:<12} x{ratio:.2f} {flag}")
+        if flag == "REGRESSION":
+            regressions.append(key)
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for CPU-bound backend hot paths")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this substring")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds of timing per benchmark size")
+    parser.add_argument("--json", help="write results to this file (usable as a later --compare baseline)")
+    parser.add_argument("--compare", help="baseline JSON produced by --json")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed median slowdown before flagging")
+    args = parser.parse_args()
+
+    results = run(args.filter, args.repeat, args.min_time)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, ensure_ascii=False, indent=2)
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
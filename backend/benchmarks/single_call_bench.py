@@ -0,0 +1,128 @@
+"""
+单次调用 vs 两次调用（analyze -> execute）的延迟与 token 对比
+
+对同一批输入交替运行两种模式（均跳过缓存与本地快速通道），
+token 数取自上游返回的 usage（chat 路由器的累计值）。
+
+Usage (from backend/):
+  python -m benchmarks.single_call_bench [--rounds 3] [--json report.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+# 压测结果不写入分类器训练数据
+os.environ.setdefault("ANALYZE_LABEL_LOG", "false")
+
+from services.ai_service import ai_service  # noqa: E402
+from services.llm_router import chat_router  # noqa: E402
+
+INPUTS = [
+    "你昨天为什么一整晚都不回我消息",
+    "今天被老板骂了，心情好差\n不想说话",
+    "周末要不要一起去看电影？",
+    "你是不是觉得我很烦啊",
+    "刚刚路过你们公司楼下，顺便给你带了杯奶茶",
+    "我朋友说你上周和一个女生去吃饭了？",
+    "算了，你忙你的吧",
+    "我\n讨\n厌\n你",
+]
+
+HISTORY = [
+    {"role": "user", "content": "在干嘛呢"},
+    {"role": "assistant", "content": "在想你呀"},
+    {"role": "user", "content": "少来，油嘴滑舌"},
+]
+
+
+def _router_totals() -> Dict[str, int]:
+    totals = {"requests": 0, "promptTokens": 0, "completionTokens": 0}
+    for backend in chat_router.stats().values():
+        for key in totals:
+            totals[key] += backend[key]
+    return totals
+
+
+async def _two_call(text: str) -> None:
+    analysis = await ai_service.analyze_situation(text, HISTORY, use_cache=False)
+    await ai_service.execute_tactics(text, analysis, HISTORY)
+
+
+async def _single_call(text: str) -> None:
+    await ai_service.analyze_and_execute(text, HISTORY, use_cache=False)
+
+
+MODES: Dict[str, Callable[[str], Awaitable[None]]] = {
+    "two_call": _two_call,
+    "single_call": _single_call,
+}
+
+
+def _summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ok = [s for s in samples if s["ok"]]
+    latencies = sorted(s["ms"] for s in ok)
+    n = len(ok) or 1
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "p50Ms": round(statistics.median(latencies), 1) if latencies else None,
+        "p95Ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1) if latencies else None,
+        "meanMs": round(statistics.mean(latencies), 1) if latencies else None,
+        "llmCallsPerRequest": round(sum(s["calls"] for s in ok) / n, 2),
+        "promptTokensPerRequest": round(sum(s["promptTokens"] for s in ok) / n, 1),
+        "completionTokensPerRequest": round(sum(s["completionTokens"] for s in ok) / n, 1),
+    }
+
+
+async def run(rounds: int) -> Dict[str, Any]:
+    samples: Dict[str, List[Dict[str, Any]]] = {mode: [] for mode in MODES}
+    for _ in range(rounds):
+        for text in INPUTS:
+            # 两种模式交替运行，减少上游负载漂移带来的偏差
+            for mode, fn in MODES.items():
+                before = _router_totals()
+                start = time.perf_counter()
+                try:
+                    await fn(text)
+                    ok = True
+                except Exception as exc:
+                    print(f"[{mode}] {text[:12]}... failed: {exc}")
+                    ok = False
+                after = _router_totals()
+                samples[mode].append({
+                    "ok": ok,
+                    "ms": (time.perf_counter() - start) * 1000,
+                    "calls": after["requests"] - before["requests"],
+                    "promptTokens": after["promptTokens"] - before["promptTokens"],
+                    "completionTokens": after["completionTokens"] - before["completionTokens"],
+                })
+    return {mode: _summarize(items) for mode, items in samples.items()}
+
+
+def _print_table(report: Dict[str, Any]) -> None:
+    columns = ["requests", "errors", "p50Ms", "p95Ms", "meanMs",
+               "llmCallsPerRequest", "promptTokensPerRequest", "completionTokensPerRequest"]
+    print(f"{'metric':<28}" + "".join(f"{mode:>14}" for mode in report))
+    for column in columns:
+        print(f"{column:<28}" + "".join(f"{str(report[mode][column]):>14}" for mode in report))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-call vs two-call analyze+execute benchmark")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.rounds))
+    _print_table(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,9 @@
 backend/config/styles.py
 Galgame 风格配置与 Prompt 模板管理 - 恋爱军师版
 """
+import itertools
 import random
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 # ==================== 风格定义 ====================
 # 定义新的5种风格池
@@ -38,22 +39,8 @@ REPLY_STYLES = {
 # 3. Task: 先分析，再生成。
 # 4. Output: 强制 JSON 格式，包含 score 评分系统。
 
-ADVISOR_PROMPT_TEMPLATE = """# Role
-You are a high-EQ communication assistant and dating coach (AI恋爱军师).
-Your goal is to help the user reply to a message from another person to achieve specific emotional effects.
-
-# Input - The Other Person's Message
-"{user_input}"
-
-# Task
-1. **Analyze**: Briefly analyze the other person's intent and emotion in the `analysis` field.
-2. **Select Styles**: I have randomly selected 3 styles for you to generate replies for:
-   - Style A: {style1_name} ({style1_desc})
-   - Style B: {style2_name} ({style2_desc})
-   - Style C: {style3_name} ({style3_desc})
-3. **Generate Options**: Generate ONE reply for EACH of the 3 styles.
-
-# Requirements for Each Option
+# 每个回复选项的通用要求（多风格与单风格 Prompt 共用）
+OPTION_REQUIREMENTS = """# Requirements for Each Option
 - **text**: The pure reply text **WITHOUT** Kaomoji. Keep it clean and readable.
 - **kaomoji**: A single, expressive Kaomoji that fits the style (e.g. "(˘³˘)♥" for romantic, "(￣^￣)" for tsundere).
 - **Tone**: Strictly follow the assigned style persona.
@@ -65,36 +52,72 @@ Your goal is to help the user reply to a message from another person to achieve
    - **-2**: Awkward, cringe, or insensitive.
    - **-3**: Disaster, relationship-damaging (e.g. extreme coldness or confusing chunibyo).
 
-# Output Format (JSON Only)
+"""
+
+# 颜文字规则（多风格与单风格 Prompt 共用）
+KAOMOJI_RULES = """=== 🎭 GALGAME EMOTION EXPRESSION RULES ===
+【强制规则】
+1. 【禁用标准Emoji】: 严格禁止使用 😀😭😡 等标准Unicode Emoji表情
+2. 【必用颜文字】: 必须使用日本颜文字(Kaomoji)来表达情感，例如：
+   - 甜蜜: (๑•́ ω •̀๑)、(≧▽≦)ﾉ、(๑˃ᴗ˂)و
+   - 伤心: (｡•́︿•̀｡)、(´；ω；`)、(´；︿；')
+   - 愤怒: (╯°□°）╯︵ ┻━┻、(´・ω・`)っ由紀ヲタ
+   - 害羞: (´▽｀)、(//∇//)、(´°̥̥̥̥̥̥̥̥ω°̥̥̥̥̥̥̥̥｀)
+3. 【保持沉浸】: 回复要完全沉浸在二次元Galgame角色设定中
+
+【示例】✓正确: "等你呢...(´°̥̥̥̥̥̥̥̥ω°̥̥̥̥̥̥̥̥｀)" | ✗错误: "等你呢...😭"
+"""
+
+# 所有请求共享的静态前缀：不含任何随请求变化的内容，保证字节级一致，
+# 便于支持前缀缓存 (prefix / KV cache) 的服务端复用
+ADVISOR_STATIC_PREFIX = """# Role
+You are a high-EQ communication assistant and dating coach (AI恋爱军师).
+Your goal is to help the user reply to a message from another person to achieve specific emotional effects.
+
+# Task
+1. **Analyze**: Briefly analyze the other person's intent and emotion in the `analysis` field.
+2. **Select Styles**: 3 styles have been randomly selected for you, listed under "Selected Styles" below.
+3. **Generate Options**: Generate ONE reply for EACH of the 3 styles, in the order Style A, Style B, Style C.
+
+""" + OPTION_REQUIREMENTS + """# Output Format (JSON Only)
 You must return a valid JSON object:
 ```json
-{{
+{
   "analysis": "Brief analysis of the situation (e.g., '对方在撒娇', '对方有点生气了')...",
   "options": [
-    {{
-      "style": "{style1_key}",
-      "style_name": "{style1_name}",
+    {
+      "style": "<Style A key>",
+      "style_name": "<Style A name>",
       "text": "其实...我也不是特意等你的啦",
       "kaomoji": "(⁄ ⁄•⁄ω⁄•⁄ ⁄)",
       "score": 2
-    }},
-    {{
-      "style": "{style2_key}",
-      "style_name": "{style2_name}",
+    },
+    {
+      "style": "<Style B key>",
+      "style_name": "<Style B name>",
       "text": "Reply text WITHOUT kaomoji",
       "kaomoji": "(˘³˘)♥",
       "score": <integer between -3 and 3>
-    }},
-    {{
-      "style": "{style3_key}",
-      "style_name": "{style3_name}",
+    },
+    {
+      "style": "<Style C key>",
+      "style_name": "<Style C name>",
       "text": "Pure text reply",
       "kaomoji": "(≧∇≦)/",
       "score": <integer>
-    }}
+    }
   ]
-}}
+}
 ```
+
+""" + KAOMOJI_RULES
+
+# 每种风格组合对应的段落（随机风格只有 5×4×3=60 种排列，导入时全部预生成）
+ADVISOR_STYLES_TEMPLATE = """
+# Selected Styles
+   - Style A: {style1_name} ({style1_desc}) -> key: "{style1_key}"
+   - Style B: {style2_name} ({style2_desc}) -> key: "{style2_key}"
+   - Style C: {style3_name} ({style3_desc}) -> key: "{style3_key}"
 """
 
 def get_random_styles(count: int = 3) -> List[Dict[str, str]]:
@@ -114,25 +137,91 @@ def get_random_styles(count: int = 3) -> List[Dict[str, str]]:
         for k in selected_keys
     ]
 
-def build_advisor_prompt(user_input: str, selected_styles: List[Dict[str, str]]) -> str:
+def _format_styles(template: str, keys: Tuple[str, ...]) -> str:
+    """用风格代码元组填充风格段落模板"""
+    fields = {}
+    for idx, key in enumerate(keys, 1):
+        fields[f"style{idx}_key"] = key
+        fields[f"style{idx}_name"] = REPLY_STYLES[key]["name"]
+        fields[f"style{idx}_desc"] = REPLY_STYLES[key]["description"]
+    return template.format(**fields)
+
+# 导入时预生成全部风格排列对应的段落，请求时直接查表
+STYLE_PERMUTATIONS = list(itertools.permutations(REPLY_STYLES.keys(), 3))
+ADVISOR_STYLE_SECTIONS = {keys: _format_styles(ADVISOR_STYLES_TEMPLATE, keys) for keys in STYLE_PERMUTATIONS}
+
+def _style_section(sections: Dict[Tuple[str, ...], str], template: str, selected_styles: List[Dict[str, str]]) -> str:
+    """查表取得预生成的风格段落（非 3 种风格时现场生成）"""
+    keys = tuple(s["key"] for s in selected_styles[:3])
+    section = sections.get(keys)
+    return section if section is not None else _format_styles(template, keys)
+
+def build_advisor_prompt(
+    user_input: str,
+    selected_styles: List[Dict[str, str]],
+    context_section: str = ""
+) -> str:
     """
     构建完整的 Prompt 字符串
+    布局：静态前缀（所有请求一致）-> 风格段落（预生成）-> 历史 + 对方消息（每次不同）
     """
-    # 确保有3个风格，不够的逻辑上应该在调用前处理好，这里直接解包
-    s1, s2, s3 = selected_styles[0], selected_styles[1], selected_styles[2]
-    
-    return ADVISOR_PROMPT_TEMPLATE.format(
-        user_input=user_input,
-        style1_key=s1["key"], style1_name=s1["name"], style1_desc=s1["desc"],
-        style2_key=s2["key"], style2_name=s2["name"], style2_desc=s2["desc"],
-        style3_key=s3["key"], style3_name=s3["name"], style3_desc=s3["desc"],
+    return (
+        ADVISOR_STATIC_PREFIX
+        + _style_section(ADVISOR_STYLE_SECTIONS, ADVISOR_STYLES_TEMPLATE, selected_styles)
+        + context_section
+        + f'\n# Input - The Other Person\'s Message (最新消息)\n"{user_input}"\n'
+    )
+
+
+# 按风格并行生成（fan-out）时每次调用只写一个风格的回复
+SINGLE_STYLE_STATIC_PREFIX = """# Role
+You are a high-EQ communication assistant and dating coach (AI恋爱军师).
+Your goal is to help the user reply to a message from another person to achieve specific emotional effects.
+
+# Task
+1. **Analyze**: Briefly analyze the other person's intent and emotion in the `analysis` field (one sentence).
+2. **Generate ONE Option**: Write exactly ONE reply in the style listed under "Assigned Style" below.
+
+""" + OPTION_REQUIREMENTS + """# Output Format (JSON Only)
+You must return a valid JSON object:
+```json
+{
+  "analysis": "Brief analysis of the situation (e.g., '对方在撒娇')",
+  "text": "Reply text WITHOUT kaomoji",
+  "kaomoji": "(˘³˘)♥",
+  "score": <integer between -3 and 3>
+}
+```
+
+""" + KAOMOJI_RULES
+
+SINGLE_STYLE_TEMPLATE = """
+# Assigned Style
+   - {name} ({desc}) -> key: "{key}"
+"""
+
+SINGLE_STYLE_SECTIONS = {
+    key: SINGLE_STYLE_TEMPLATE.format(key=key, name=style["name"], desc=style["description"])
+    for key, style in REPLY_STYLES.items()
+}
+
+def build_single_style_prompt(user_input: str, style_key: str, context_section: str = "") -> str:
+    """
+    构建单风格 Prompt（fan-out 模式）
+    布局与 build_advisor_prompt 一致：静态前缀 -> 风格段落（预生成）-> 历史 + 对方消息
+    """
+    return (
+        SINGLE_STYLE_STATIC_PREFIX
+        + SINGLE_STYLE_SECTIONS[style_key]
+        + context_section
+        + f'\n# Input - The Other Person\'s Message (最新消息)\n"{user_input}"\n'
     )
 
 
 # ==================== v8.0 指挥官系统 Prompt ====================
 
 # 态势感知 Prompt - 专注于"心理侧写"
-ANALYZE_PROMPT_TEMPLATE = """# Role
+ANALYZE_STATIC_PREFIX = """# Role
 你是一名资深的恋爱战术分析师 (Tactical Romance Analyst)。
 你的任务是对对方发来的消息进行**深度心理侧写**，分析其情绪状态、潜在意图和语境压迫感。
 
@@ -147,15 +236,8 @@ ANALYZE_PROMPT_TEMPLATE = """# Role
 3. **意图推测**: 识别对方的核心诉求
 4. **战术建议**: 基于分析给出最优应对策略
 
-# Input - 对方的消息
-```
-{user_input}
-```
-
-{context_section}
-
 # Task
-分析以上消息，输出 JSON 格式的战术报告。
+分析下方用户消息中对方发来的内容，输出 JSON 格式的战术报告。
 
 # 意图类型 (intent)
 - TESTING_BOUNDARIES: 试探边界
@@ -183,7 +265,7 @@ ANALYZE_PROMPT_TEMPLATE = """# Role
 
 # Output Format (JSON)
 ```json
-{{
+{
   "summary": "对当前局势的1-2句话战术总结",
   "emotion_score": <-3到+3的整数>,
   "intent": "<意图类型>",
@@ -191,14 +273,14 @@ ANALYZE_PROMPT_TEMPLATE = """# Role
   "confidence": <0.0到1.0的浮点数>,
   "burst_detected": <true/false>,
   "pressure_level": <0到5的整数>
-}}
+}
 ```
 
 # 示例
 输入: "我\\n讨\\n厌\\n你"
 输出:
 ```json
-{{
+{
   "summary": "对方连续发送短句，情绪波动强烈，实为撒娇或试探，非真正讨厌。",
   "emotion_score": -1,
   "intent": "TESTING_BOUNDARIES",
@@ -206,54 +288,70 @@ ANALYZE_PROMPT_TEMPLATE = """# Role
   "confidence": 0.85,
   "burst_detected": true,
   "pressure_level": 4
-}}
+}
 ```
 """
 
-# 战术执行 Prompt - 基于确定策略生成回复
-EXECUTE_PROMPT_TEMPLATE = """# Role
-你是一名高情商恋爱军师 (High-EQ Dating Coach)。
-用户已经完成了对方消息的战术分析，现在需要你**基于确定的战术策略**生成 3 个回复选项。
-
-# 战术背景 (Tactical Context)
-- **局势总结**: {summary}
-- **对方情绪**: {emotion_score} (-3=暴怒, 0=中性, +3=心动)
-- **推测意图**: {intent}
-- **采用策略**: {strategy}
-- **连发消息**: {burst_detected}
-- **压迫感等级**: {pressure_level}/5
-
-# 原始消息
+# 随请求变化的部分放在最后
+ANALYZE_VOLATILE_TEMPLATE = """
+{context_section}
+# Input - 对方的消息
 ```
 {user_input}
 ```
+"""
 
-{context_section}
+# 战术执行 Prompt - 基于确定策略生成回复
+EXECUTE_STATIC_PREFIX = """# Role
+你是一名高情商恋爱军师 (High-EQ Dating Coach)。
+用户已经完成了对方消息的战术分析，现在需要你**基于确定的战术策略**生成 3 个回复选项。
 
 # Task
-基于**{strategy}**策略，生成 3 个不同风格的回复选项。
-
-# 可用风格
-{styles_section}
-
-# 策略执行指南
-{strategy_guide}
+基于下方「战术背景」中的**采用策略**，为「原始消息」生成 3 个不同风格的回复选项，「可用风格」中的每种风格各一个。
 
 # Output Format (JSON)
 ```json
-{{
+{
   "analysis": "基于战术分析的简短点评（可直接复用 summary）",
   "options": [
-    {{
+    {
       "style": "<风格代码>",
       "style_name": "<风格名称>",
       "text": "纯净回复文本（不含颜文字）",
       "kaomoji": "<合适的颜文字>",
       "score": <-3到+3的情商评分>
-    }},
+    },
     // ... 共3个选项
   ]
-}}
+}
+```
+"""
+
+EXECUTE_STYLES_TEMPLATE = """
+# 可用风格
+- 风格A: **{style1_name}** ({style1_key}) - {style1_desc}
+- 风格B: **{style2_name}** ({style2_key}) - {style2_desc}
+- 风格C: **{style3_name}** ({style3_key}) - {style3_desc}
+"""
+
+EXECUTE_STYLE_SECTIONS = {keys: _format_styles(EXECUTE_STYLES_TEMPLATE, keys) for keys in STYLE_PERMUTATIONS}
+
+EXECUTE_VOLATILE_TEMPLATE = """
+# 策略执行指南
+{strategy_guide}
+
+# 战术背景 (Tactical Context)
+- **局势总结**: {summary}
+- **对方情绪**: {emotion_score} (-3=暴怒, 0=中性, +3=心动)
+- **推测意图**: {intent}
+- **采用策略**: {strategy}
+- **连发消息**: {burst_detected}
+- **压迫感等级**: {pressure_level}/5
+
+{context_section}
+# 原始消息
+```
+{user_input}
 ```
 """
 
@@ -271,19 +369,78 @@ STRATEGY_GUIDES = {
     "ESCALATE": "推动关系进展，提出见面、约会等实质性建议，果断行动。"
 }
 
-def build_analyze_prompt(user_input: str, history: list = []) -> str:
+# 一次调用完成分析 + 回复生成（跳过人工修改环节的客户端使用）
+# 静态前缀包含全部策略指南：策略由模型自行决定，前缀对所有请求保持一致
+COMBINED_STATIC_PREFIX = """# Role
+你同时担任资深恋爱战术分析师与高情商恋爱军师。
+先对对方的消息做**心理侧写**（情绪、意图、语境压迫感），选定最优应对策略，再**按该策略**生成 3 个不同风格的回复选项。
+
+# 分析要点
+- 输入中的换行符 `\\n` 代表对方连续发送的多条短消息，通常意味着情绪激动或施压
+- 从字面和潜台词中判断真实情绪与核心诉求
+
+# 意图类型 (intent)
+TESTING_BOUNDARIES / SEEKING_ATTENTION / EXPRESSING_AFFECTION / VENTING_EMOTION / CASUAL_CHAT / FLIRTING / COMPLAINING / JEALOUS / COLD_WAR / UNKNOWN
+
+# 策略类型 (strategy) 与执行指南
+""" + "".join(f"- {key}: {guide}\n" for key, guide in STRATEGY_GUIDES.items()) + """
+# Output Format (JSON)
+```json
+{
+  "summary": "对当前局势的1-2句话战术总结",
+  "emotion_score": <-3到+3的整数>,
+  "intent": "<意图类型>",
+  "strategy": "<建议策略>",
+  "confidence": <0.0到1.0的浮点数>,
+  "options": [
+    {
+      "style": "<风格代码>",
+      "style_name": "<风格名称>",
+      "text": "纯净回复文本（不含颜文字）",
+      "kaomoji": "<合适的颜文字>",
+      "score": <-3到+3的情商评分>
+    },
+    // ... 共3个选项，「可用风格」中的每种风格各一个
+  ]
+}
+```
+"""
+
+COMBINED_VOLATILE_TEMPLATE = """
+# 预检测
+- **连发消息**: {burst_detected}
+- **压迫感等级**: {pressure_level}/5
+
+{context_section}
+# 原始消息
+```
+{user_input}
+```
+"""
+
+def format_history_lines(history: list, assistant_label: str, summary: str = "") -> str:
+    """
+    格式化（已按 token 预算压缩的）历史记录
+    summary 为更早轮次的摘要，放在最前面
+    """
+    lines = f"- 更早的对话摘要: {summary}\n" if summary else ""
+    for msg in history:
+        role = "对方" if msg.get("role") == "user" else assistant_label
+        lines += f"- {role}: {msg.get('content', '')}\n"
+    return lines
+
+def build_analyze_prompt(user_input: str, history: list = [], history_summary: str = "") -> str:
     """
     构建 v8.0 态势感知 Prompt
+    history 应先经 prompt_assembler.compact 压缩到预算内
     """
     # 格式化历史记录
     context_section = ""
-    if history:
+    if history or history_summary:
         context_section = "# 对话历史 (Context)\n"
-        for msg in history[-6:]:  # 只取最近6条
-            role = "对方" if msg.get("role") == "user" else "你之前的建议"
-            context_section += f"- {role}: {msg.get('content', '')}\n"
+        context_section += format_history_lines(history, "你之前的建议", history_summary)
     
-    return ANALYZE_PROMPT_TEMPLATE.format(
+    return ANALYZE_STATIC_PREFIX + ANALYZE_VOLATILE_TEMPLATE.format(
         user_input=user_input,
         context_section=context_section
     )
@@ -292,37 +449,73 @@ def build_execute_prompt(
     user_input: str, 
     analysis: dict, 
     selected_styles: List[Dict[str, str]],
-    history: list = []
+    history: list = [],
+    history_summary: str = ""
 ) -> str:
     """
     构建 v8.0 战术执行 Prompt
+    布局：静态前缀 -> 风格段落（预生成）-> 策略指南 / 战术背景 / 历史 / 原始消息
+    history 应先经 prompt_assembler.compact 压缩到预算内
     """
-    # 格式化风格
-    styles_section = ""
-    for i, s in enumerate(selected_styles):
-        styles_section += f"- 风格{chr(65+i)}: **{s['name']}** - {s['desc']}\n"
-    
     # 获取策略指南
     strategy = analysis.get("strategy", "COMFORT")
     strategy_guide = STRATEGY_GUIDES.get(strategy, "根据当前局势灵活应对。")
     
     # 格式化历史
     context_section = ""
-    if history:
+    if history or history_summary:
         context_section = "# 对话历史\n"
-        for msg in history[-4:]:
-            role = "对方" if msg.get("role") == "user" else "你的建议"
-            context_section += f"- {role}: {msg.get('content', '')}\n"
+        context_section += format_history_lines(history, "你的建议", history_summary)
     
-    return EXECUTE_PROMPT_TEMPLATE.format(
-        user_input=user_input,
-        summary=analysis.get("summary", ""),
-        emotion_score=analysis.get("emotion_score", 0),
-        intent=analysis.get("intent", "UNKNOWN"),
-        strategy=strategy,
-        burst_detected="是" if analysis.get("burst_detected") else "否",
-        pressure_level=analysis.get("pressure_level", 0),
-        context_section=context_section,
-        styles_section=styles_section,
-        strategy_guide=strategy_guide
+    return (
+        EXECUTE_STATIC_PREFIX
+        + _style_section(EXECUTE_STYLE_SECTIONS, EXECUTE_STYLES_TEMPLATE, selected_styles)
+        + EXECUTE_VOLATILE_TEMPLATE.format(
+            user_input=user_input,
+            summary=analysis.get("summary", ""),
+            emotion_score=analysis.get("emotion_score", 0),
+            intent=analysis.get("intent", "UNKNOWN"),
+            strategy=strategy,
+            burst_detected="是" if analysis.get("burst_detected") else "否",
+            pressure_level=analysis.get("pressure_level", 0),
+            context_section=context_section,
+            strategy_guide=strategy_guide
+        )
     )
+
+def build_combined_prompt(
+    user_input: str,
+    selected_styles: List[Dict[str, str]],
+    history: list = [],
+    history_summary: str = "",
+    burst_detected: bool = False,
+    pressure_level: int = 0
+) -> str:
+    """
+    构建一次调用完成分析 + 执行的 Prompt
+    布局：静态前缀 -> 风格段落（复用执行阶段的预生成段落）-> 预检测 / 历史 / 原始消息
+    """
+    context_section = ""
+    if history or history_summary:
+        context_section = "# 对话历史\n"
+        context_section += format_history_lines(history, "你的建议", history_summary)
+
+    return (
+        COMBINED_STATIC_PREFIX
+        + _style_section(EXECUTE_STYLE_SECTIONS, EXECUTE_STYLES_TEMPLATE, selected_styles)
+        + COMBINED_VOLATILE_TEMPLATE.format(
+            user_input=user_input,
+            burst_detected="是" if burst_detected else "否",
+            pressure_level=pressure_level,
+            context_section=context_section
+        )
+    )
+
+# 各类 Prompt 的静态前缀（用于统计跨请求共享的前缀字节数）
+STATIC_PREFIXES = {
+    "analyze": ANALYZE_STATIC_PREFIX,
+    "execute": EXECUTE_STATIC_PREFIX,
+    "generate": ADVISOR_STATIC_PREFIX,
+    "combined": COMBINED_STATIC_PREFIX,
+    "fanout": SINGLE_STYLE_STATIC_PREFIX,
+}
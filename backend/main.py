@@ -1,16 +1,18 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from loguru import logger
 import uvicorn
+import asyncio
 import time
 import os
+import json
 import uuid
 import base64
 import io
 import random
 import string
-from typing import Dict, Tuple
+from typing import Any, Dict, Optional, Tuple
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
@@ -27,29 +29,75 @@ LOG_FILE = os.path.join(LOG_DIR, "love_advisor.log")
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
 
-# 配置 loguru 写入文件：10MB 滚动，保留 7 天
+# 配置 loguru 写入文件：10MB 滚动，保留 7 天；enqueue 由后台线程写文件，不阻塞事件循环
 logger.add(
     LOG_FILE,
     rotation="10 MB",
     retention="7 days",
     encoding="utf-8",
+    enqueue=True,
     format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}"
 )
 
+from services.admission import (
+    AdmissionRejected, PRIORITY_INTERACTIVE, PRIORITY_VISION, request_priority, upstream_limiter
+)
+from services.retry_policy import DeadlineExceeded, deadline_scope, llm_retry
+from services.llm_client import llm_pool
+from services.llm_router import chat_router, vision_router
 from services.ai_service import ai_service
 from services.db_service import db_service
 from services.vision_service import vision_service  # v10.0 视觉智能
+from services.pipeline_service import pipeline_service
+from services.batch_service import batch_service
+from services.intent_classifier import intent_classifier
+from services.json_repair import json_repair_stats
+from services.local_analyzer import local_analyzer
+from services.loop_monitor import loop_monitor
+from services.metrics import http_duration, http_in_flight, http_requests, registry
+from services.profiler import ProfilerBusy, profiler
+from services.prompt_assembler import prompt_assembler
+from services.request_trace import current_trace, make_request_id, start_trace
+from services.token_usage import BudgetExceeded, token_usage, usage_endpoint, usage_user
 from models.schemas import (
     ChatRequest, AdvisorResponse, FeedbackRequest, LegacyGenerateRequest, SelectionRequest,
     AnalyzeRequest, AnalyzeResponse, ExecuteRequest, ExecuteResponse, SituationAnalysis,
-    VisionAnalyzeRequest, VisionAnalyzeResponse, VisionExecuteRequest  # v10.0 视觉模型
+    VisionAnalyzeRequest, VisionAnalyzeResponse, VisionExecuteRequest,  # v10.0 视觉模型
+    PipelineRequest, PipelineExecuteRequest, AnalyzeBatchRequest, ExecuteBatchRequest
 )
 
+async def bind_usage_endpoint(request: Request) -> None:
+    """
+    token 用量按路由模板归属（/api/pipeline/{pipeline_id}/execute 而不是每个 ID 一个键）
+    中间件执行时尚未完成路由匹配，因此放在全局依赖中；async 依赖与接口函数在同一上下文中执行，设置对接口可见
+    """
+    route = request.scope.get("route")
+    usage_endpoint.set(getattr(route, "path", "other"))
+
+
 # 初始化 App
-app = FastAPI(title="Love Advisor Backend - Commander System v10.0")
+app = FastAPI(
+    title="Love Advisor Backend - Commander System v10.0",
+    dependencies=[Depends(bind_usage_endpoint)],
+)
 
 logger.info("🚀 [FastAPI] Commander System v10.0 starting...")
 
+
+@app.on_event("startup")
+async def on_startup():
+    """预热 LLM 连接池，开始监听 .env 变化，并启动事件循环延迟监控"""
+    loop_monitor.register_routes(app.routes)
+    loop_monitor.start()
+    await llm_pool.warm_up()
+    llm_pool.start_watching(float(os.getenv("AI_CONFIG_WATCH_INTERVAL", "5")))
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await loop_monitor.stop()
+    await llm_pool.aclose()
+
 # ==========================================
 # 🔐 验证码系统 (Captcha)
 # ==========================================
@@ -119,6 +167,68 @@ def cleanup_expired_captchas():
         del captcha_store[k]
 
 
+# ==========================================
+# 🎴 选项格式化 (兼容旧前端)
+# ==========================================
+STYLE_EMOJI_MAP = {
+    "COLD": "❄️",
+    "TSUNDERE": "💢",
+    "GENKI": "✨",
+    "FLATTERING": "🥺",
+    "CHUNIBYO": "🌙"
+}
+
+def format_option(idx: int, opt: dict) -> dict:
+    """将 ReplyOption 转换为前端使用的选项格式 (完整传递 kaomoji / score 等字段)"""
+    score = opt.get("score", 0)
+    return {
+        "id": chr(65 + idx),  # A, B, C
+        "text": opt.get("text", ""),
+        "kaomoji": opt.get("kaomoji", ""),
+        "score": score,
+        "style": opt.get("style", ""),
+        "style_name": opt.get("style_name", "未知"),
+        "emoji": STYLE_EMOJI_MAP.get(opt.get("style", ""), "💬"),
+        "favorChange": score,  # 直接使用评分作为好感度变化
+        "type": "default",
+        "description": f"情商评分: {score:+d}",
+        "effect": ""
+    }
+
+def sse_event(event: str, data: dict) -> str:
+    """编码一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # 禁止反向代理缓冲，保证事件即时送达
+}
+
+def upstream_error_response(exc: Exception) -> JSONResponse:
+    """
+    上游不可用时的统一响应
+    - AdmissionRejected: 并发已满，429 + Retry-After，前端据此退避重试
+    - BudgetExceeded: token 预算已用尽，429 + Retry-After（到预算窗口重置）
+    - DeadlineExceeded: 已超过请求截止时间，504
+    """
+    if isinstance(exc, DeadlineExceeded):
+        return JSONResponse(status_code=504, content={
+            "success": False,
+            "message": f"请求超时: {str(exc)}",
+            "error_code": "DEADLINE_EXCEEDED"
+        })
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+        content={
+            "success": False,
+            "message": str(exc),
+            "error_code": "TOKEN_BUDGET_EXCEEDED" if isinstance(exc, BudgetExceeded) else "UPSTREAM_OVERLOADED",
+            "retryAfter": exc.retry_after
+        }
+    )
+
+
 # ==========================================
 # 1. 解决 Network Error 的核心：CORS 配置
 # ==========================================
@@ -136,8 +246,87 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # 允许所有方法 (POST, GET, OPTIONS 等)
     allow_headers=["*"],  # 允许所有 Header
+    expose_headers=["Server-Timing", "X-Request-Id"],  # 前端可读取阶段耗时与请求 ID
 )
 
+# 接口路径 -> 上游调用优先级：视觉请求体积大、耗时长，排在交互式文本请求之后
+PATH_PRIORITIES = {
+    "/api/vision/": PRIORITY_VISION,
+}
+
+# 请求级截止时间(秒)：超过后不再重试，客户端可用 X-Request-Timeout 头进一步收紧
+REQUEST_DEADLINE = float(os.getenv("AI_REQUEST_DEADLINE", "60"))
+VISION_REQUEST_DEADLINE = float(os.getenv("AI_VISION_REQUEST_DEADLINE", "90"))
+
+# 客户端带 X-Debug-Trace: 1 时在 JSON 响应体中附带完整 span 树（可用该开关整体禁用）
+REQUEST_TRACE_DEBUG = os.getenv("REQUEST_TRACE_DEBUG", "true").lower() == "true"
+
+
+async def attach_trace_body(response, trace):
+    """把 span 树写入 JSON 响应体的 trace 字段（非 JSON 对象的响应原样返回）"""
+    if not response.headers.get("content-type", "").startswith("application/json"):
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        data["trace"] = trace.to_dict()
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    return Response(body, status_code=response.status_code, headers=headers)
+
+
+@app.middleware("http")
+async def assign_request_context(request, call_next):
+    """
+    按接口路径设置本次请求的上游排队优先级与截止时间，并开启请求级阶段追踪：
+    响应带 Server-Timing（各阶段耗时汇总）与 X-Request-Id；流式接口的 Server-Timing 只覆盖响应头发出之前的阶段
+    """
+    path = request.url.path
+    priority = next(
+        (p for prefix, p in PATH_PRIORITIES.items() if path.startswith(prefix)),
+        PRIORITY_INTERACTIVE
+    )
+    deadline = VISION_REQUEST_DEADLINE if path.startswith("/api/vision/") else REQUEST_DEADLINE
+    if path.endswith("/batch"):
+        deadline = None  # 批量接口由 batch_service 为每条单独设置截止时间
+    try:
+        timeout = request.headers.get("x-request-timeout")
+        if timeout is not None:
+            deadline = min(deadline or float("inf"), float(timeout))
+    except ValueError:
+        pass
+
+    token = request_priority.set(priority)
+    trace_token = start_trace(make_request_id(request.headers.get("x-request-id")))
+    # token 用量归属：X-User-Id（带 userId 字段的接口会在处理时覆盖；接口由 bind_usage_endpoint 在路由匹配后设置）
+    if request.headers.get("x-user-id"):
+        usage_user.set(request.headers["x-user-id"][:64])
+    trace = current_trace.get()
+    http_in_flight.inc()
+    start = time.perf_counter()
+    status = "500"
+    try:
+        with deadline_scope(deadline):
+            response = await call_next(request)
+        status = str(response.status_code)
+        trace.root.end = time.perf_counter()
+        if REQUEST_TRACE_DEBUG and request.headers.get("x-debug-trace") == "1":
+            response = await attach_trace_body(response, trace)
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Request-Id"] = trace.request_id
+        return response
+    finally:
+        request_priority.reset(token)
+        current_trace.reset(trace_token)
+        http_in_flight.dec()
+        # 用路由模板而不是原始路径作标签，避免 /api/session/{id} 之类的路径撑爆时间序列
+        route = getattr(request.scope.get("route"), "path", "other")
+        http_duration.observe(time.perf_counter() - start, route)
+        http_requests.inc(request.method, route, status)
+
 # ==========================================
 # 3. 路由定义 (Endpoint)
 # ==========================================
@@ -147,14 +336,211 @@ async def root():
 
 @app.get("/bridge/health")
 async def health_check():
-    load_dotenv(override=True)
     return {
         "status": "ok",
         "message": "Backend is healthy",
         "mode": "Love Advisor",
-        "model": os.getenv("AI_MODEL", "")
+        "model": llm_pool.profile("chat").model
     }
 
+@app.post("/api/system/reload-config")
+async def reload_config():
+    """
+    立即重新加载 .env 并原子替换 LLM 客户端（不等待文件监听轮询）
+    """
+    changed = await llm_pool.reload(force=True)
+    logger.info(f"🔄 [/api/system/reload-config] Reloaded (changed: {changed})")
+    return {
+        "success": True,
+        "data": {
+            "changed": changed,
+            "models": {name: llm_pool.profile(name).model for name in ("chat", "vision")}
+        }
+    }
+
+@app.get("/api/system/usage")
+async def get_token_usage(userId: Optional[str] = None, top: int = 20):
+    """
+    上游 token 用量（按接口 / 模型 / 策略 / 用户汇总）与预算状态
+
+    Args:
+        userId: 只查询该用户的用量
+        top: 返回用量最高的前 N 个用户
+    """
+    if userId:
+        return {"success": True, "data": token_usage.user_usage(userId)}
+    return {"success": True, "data": token_usage.stats(top_users=top)}
+
+@app.get("/api/system/stats")
+async def get_system_stats():
+    """
+    运行时统计（缓存命中率等），用于观察性能优化效果
+    """
+    return {
+        "success": True,
+        "data": {
+            "analyzeCache": ai_service.analyze_cache.stats(),
+            "localAnalyzer": local_analyzer.stats(),
+            "classifier": intent_classifier.stats(),
+            "singleFlight": {
+                flight.name: flight.stats()
+                for flight in (
+                    ai_service.analyze_flight, ai_service.execute_flight, ai_service.combined_flight,
+                    vision_service.vision_flight,
+                )
+            },
+            "pipeline": pipeline_service.stats(),
+            "batch": batch_service.stats(),
+            "prompt": prompt_assembler.stats(),
+            "jsonRepair": json_repair_stats.stats(),
+            "fanout": dict(ai_service.fanout_stats),
+            "routing": {
+                router.group: router.stats() for router in (chat_router, vision_router)
+            },
+            "admission": upstream_limiter.stats(),
+            "retry": llm_retry.stats(),
+            "eventLoop": loop_monitor.stats()
+        }
+    }
+
+def collect_component_metrics():
+    """抓取 /metrics 时读取各组件已有的计数（缓存、请求合并、限流器、本地分析等），不在热路径上重复计数"""
+    caches = [(c.name, c.stats()) for c in (ai_service.analyze_cache, prompt_assembler.summary_cache)]
+    yield "sdp_cache_hits_total", "counter", "TTL cache hits", [
+        ({"cache": name}, stats["hits"]) for name, stats in caches
+    ]
+    yield "sdp_cache_misses_total", "counter", "TTL cache misses", [
+        ({"cache": name}, stats["misses"]) for name, stats in caches
+    ]
+    yield "sdp_cache_entries", "gauge", "TTL cache entries", [
+        ({"cache": name}, stats["size"]) for name, stats in caches
+    ]
+
+    flights = [
+        (flight.name, flight.stats())
+        for flight in (
+            ai_service.analyze_flight, ai_service.execute_flight, ai_service.combined_flight,
+            vision_service.vision_flight,
+        )
+    ]
+    yield "sdp_singleflight_calls_total", "counter", "Single-flight calls", [
+        ({"flight": name}, stats["calls"]) for name, stats in flights
+    ]
+    yield "sdp_singleflight_coalesced_total", "counter", "Calls served by an in-flight leader", [
+        ({"flight": name}, stats["coalesced"]) for name, stats in flights
+    ]
+
+    admission = upstream_limiter.stats()
+    yield "sdp_upstream_inflight", "gauge", "Upstream LLM calls in flight", [({}, admission["inflight"])]
+    yield "sdp_upstream_queue_depth", "gauge", "Calls waiting for an upstream slot", [({}, admission["queueDepth"])]
+    yield "sdp_upstream_concurrency_limit", "gauge", "Current adaptive upstream concurrency limit", [
+        ({}, admission["limit"])
+    ]
+    yield "sdp_upstream_rejected_total", "counter", "Calls rejected by admission control", [
+        ({}, admission["rejected"])
+    ]
+
+    yield "sdp_local_hits_total", "counter", "Requests answered locally without an LLM call", [
+        ({"component": "local_analyzer"}, local_analyzer.stats()["hits"]),
+        ({"component": "intent_classifier"}, intent_classifier.stats()["hits"]),
+    ]
+    yield "sdp_json_repair_total", "counter", "LLM JSON parse outcomes", [
+        ({"label": label, "outcome": outcome}, counts[outcome])
+        for label, counts in json_repair_stats.stats().items()
+        for outcome in ("clean", "repaired", "failed")
+    ]
+    yield "sdp_fanout_total", "counter", "Per-style fan-out generation counters", [
+        ({"event": event}, value) for event, value in ai_service.fanout_stats.items()
+    ]
+    yield "sdp_event_loop_lag_quantile_seconds", "gauge", "Event loop lag quantiles over the recent window", [
+        ({"quantile": q}, value) for q, value in loop_monitor.percentiles().items()
+    ]
+
+
+registry.register_collector(collect_component_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus 抓取接口（text exposition format 0.0.4）
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/system/profile")
+async def profile_process(
+    seconds: float = 10,
+    format: str = "collapsed",
+    interval_ms: Optional[float] = None,
+    idle: bool = False
+):
+    """
+    采样剖析运行中的进程（需设置 PROFILER_ENABLED=true）
+
+    Args:
+        seconds: 采样时长（不超过 PROFILER_MAX_SECONDS）
+        format: collapsed（火焰图折叠栈文本）或 speedscope（JSON，可直接拖入 speedscope.app）
+        interval_ms: 采样间隔，默认 PROFILER_INTERVAL_MS
+        idle: 是否保留空闲等待的样本
+    """
+    if not profiler.enabled:
+        return JSONResponse(status_code=403, content={
+            "success": False,
+            "message": "剖析接口未启用，请设置 PROFILER_ENABLED=true",
+            "error_code": "PROFILER_DISABLED"
+        })
+    if format not in ("collapsed", "speedscope"):
+        return JSONResponse(status_code=400, content={
+            "success": False,
+            "message": f"不支持的格式: {format}（collapsed / speedscope）",
+            "error_code": "INVALID_FORMAT"
+        })
+    try:
+        result = await profiler.profile(seconds, interval_ms / 1000 if interval_ms else None, idle)
+    except ProfilerBusy as exc:
+        return JSONResponse(status_code=409, content={
+            "success": False,
+            "message": str(exc),
+            "error_code": "PROFILER_BUSY"
+        })
+
+    filename = f"sdp-profile-{time.strftime('%Y%m%d-%H%M%S')}"
+    if format == "speedscope":
+        return JSONResponse(
+            result.speedscope(),
+            headers={"Content-Disposition": f'attachment; filename="{filename}.speedscope.json"'}
+        )
+    return PlainTextResponse(
+        result.collapsed(),
+        headers={"X-Profile-Summary": json.dumps(result.summary())}
+    )
+
+@app.get("/api/system/event-loop")
+async def get_event_loop_stats():
+    """
+    事件循环延迟分位数，以及最近的卡顿（归属接口、阻塞点、调用栈）
+    """
+    return {
+        "success": True,
+        "data": {
+            **loop_monitor.stats(),
+            "recentStalls": loop_monitor.recent(),
+        }
+    }
+
+def tail_lines(path: str, lines: int, block_size: int = 64 * 1024) -> str:
+    """从文件末尾按块向前读取最后 N 行（不读入整个文件）"""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= lines:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    return b"".join(data.splitlines(keepends=True)[-lines:]).decode("utf-8", errors="replace")
+
 @app.get("/api/system/logs", response_class=PlainTextResponse)
 async def get_system_logs(lines: int = 100):
     """
@@ -170,11 +556,8 @@ async def get_system_logs(lines: int = 100):
         return "Log file not found. Please check if the backend has been started."
     
     try:
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            all_lines = f.readlines()
-            # 返回最后 N 行
-            last_lines = all_lines[-lines:] if len(all_lines) > lines else all_lines
-            return "".join(last_lines)
+        # 返回最后 N 行（在线程中读取，不阻塞事件循环）
+        return await asyncio.to_thread(tail_lines, LOG_FILE, max(lines, 0))
     except Exception as e:
         logger.error(f"❌ [/api/system/logs] Error reading logs: {e}")
         return f"Error reading logs: {str(e)}"
@@ -357,7 +740,11 @@ async def analyze_endpoint(request: AnalyzeRequest):
     start_time = time.perf_counter()
     
     try:
-        analysis = await ai_service.analyze_situation(request.user_input, request.history)
+        analysis = await ai_service.analyze_situation(
+            request.user_input,
+            request.history,
+            use_cache=not request.bypass_cache
+        )
         
         analysis_time_ms = int((time.perf_counter() - start_time) * 1000)
         
@@ -367,6 +754,8 @@ async def analyze_endpoint(request: AnalyzeRequest):
             "raw_input": request.user_input,
             "analysisTimeMs": analysis_time_ms
         }
+    except (AdmissionRejected, DeadlineExceeded) as exc:
+        return upstream_error_response(exc)
     except Exception as exc:
         logger.error(f"❌ [/api/analyze] Error: {exc}")
         return {
@@ -410,6 +799,8 @@ async def vision_analyze_endpoint(request: VisionAnalyzeRequest):
             "raw_text": raw_text[:500] if raw_text else "",  # 截断原始文本
             "analysis_time_ms": analysis_time_ms
         }
+    except (AdmissionRejected, DeadlineExceeded) as exc:
+        return upstream_error_response(exc)
     except Exception as exc:
         logger.error(f"❌ [/api/vision/analyze] Error: {exc}")
         return {
@@ -471,28 +862,7 @@ async def vision_execute_endpoint(request: VisionExecuteRequest):
         execution_time_ms = int((time.perf_counter() - start_time) * 1000)
         
         # 格式化选项
-        formatted_options = []
-        for idx, opt in enumerate(result.get("options", [])):
-            score = opt.get("score", 0)
-            emoji_map = {
-                "COLD": "❄️", "TSUNDERE": "💢", "GENKI": "✨",
-                "FLATTERING": "🥺", "CHUNIBYO": "🌙"
-            }
-            emoji = emoji_map.get(opt.get("style", ""), "💬")
-            
-            formatted_options.append({
-                "id": chr(65 + idx),
-                "text": opt.get("text", ""),
-                "kaomoji": opt.get("kaomoji", ""),
-                "score": score,
-                "style": opt.get("style", ""),
-                "style_name": opt.get("style_name", "未知"),
-                "emoji": emoji,
-                "favorChange": score,
-                "type": "default",
-                "description": f"情商评分: {score:+d}",
-                "effect": ""
-            })
+        formatted_options = [format_option(idx, opt) for idx, opt in enumerate(result.get("options", []))]
         
         return {
             "success": True,
@@ -500,6 +870,8 @@ async def vision_execute_endpoint(request: VisionExecuteRequest):
             "options": formatted_options,
             "executionTimeMs": execution_time_ms
         }
+    except (AdmissionRejected, DeadlineExceeded) as exc:
+        return upstream_error_response(exc)
     except Exception as exc:
         logger.error(f"❌ [/api/vision/execute] Error: {exc}")
         return {
@@ -538,28 +910,7 @@ async def execute_endpoint(request: ExecuteRequest):
         execution_time_ms = int((time.perf_counter() - start_time) * 1000)
         
         # 格式化选项（兼容旧前端）
-        formatted_options = []
-        for idx, opt in enumerate(result.get("options", [])):
-            score = opt.get("score", 0)
-            emoji_map = {
-                "COLD": "❄️", "TSUNDERE": "💢", "GENKI": "✨",
-                "FLATTERING": "🥺", "CHUNIBYO": "🌙"
-            }
-            emoji = emoji_map.get(opt.get("style", ""), "💬")
-            
-            formatted_options.append({
-                "id": chr(65 + idx),
-                "text": opt.get("text", ""),
-                "kaomoji": opt.get("kaomoji", ""),
-                "score": score,
-                "style": opt.get("style", ""),
-                "style_name": opt.get("style_name", "未知"),
-                "emoji": emoji,
-                "favorChange": score,
-                "type": "default",
-                "description": f"情商评分: {score:+d}",
-                "effect": ""
-            })
+        formatted_options = [format_option(idx, opt) for idx, opt in enumerate(result.get("options", []))]
         
         return {
             "success": True,
@@ -572,6 +923,8 @@ async def execute_endpoint(request: ExecuteRequest):
             }
         }
         
+    except (AdmissionRejected, DeadlineExceeded) as exc:
+        return upstream_error_response(exc)
     except Exception as exc:
         logger.error(f"❌ [/api/execute] Error: {exc}")
         return {
@@ -583,6 +936,291 @@ async def execute_endpoint(request: ExecuteRequest):
         }
 
 
+async def stream_advisor_events(events, start_time: float, tag: str, done_extra: dict):
+    """
+    将 AIService 的流式事件转换为 SSE
+    analysis -> option x3 -> done；出错时推送 error 事件后结束
+    fan-out 模式下 done 可能只含部分选项 (partial=true)，其余选项随后以 late_option 推送
+    """
+    option_count = 0
+    try:
+        async for event, data in events:
+            elapsed_ms = int((time.perf_counter() - start_time) * 1000)
+            if event == "analysis":
+                yield sse_event("analysis", {"sceneSummary": data, "elapsedMs": elapsed_ms})
+            elif event in ("option", "late_option"):
+                # late_option: fan-out 模式下 done 之后才完成的风格
+                yield sse_event(event, {**format_option(option_count, data), "elapsedMs": elapsed_ms})
+                option_count += 1
+            elif event == "done":
+                yield sse_event("done", {
+                    "sceneSummary": data.get("analysis", ""),
+                    "options": [format_option(idx, opt) for idx, opt in enumerate(data.get("options", []))],
+                    "elapsedMs": elapsed_ms,
+                    **{key: data[key] for key in ("partial", "pendingStyles") if key in data},
+                    **done_extra
+                })
+    except DeadlineExceeded as exc:
+        yield sse_event("error", {
+            "message": f"请求超时: {str(exc)}",
+            "errorCode": "DEADLINE_EXCEEDED",
+            "elapsedMs": int((time.perf_counter() - start_time) * 1000)
+        })
+    except AdmissionRejected as exc:
+        yield sse_event("error", {
+            "message": str(exc),
+            "errorCode": "UPSTREAM_OVERLOADED",
+            "retryAfter": exc.retry_after,
+            "elapsedMs": int((time.perf_counter() - start_time) * 1000)
+        })
+    except Exception as exc:
+        logger.error(f"❌ [{tag}] Stream failed: {exc}")
+        yield sse_event("error", {
+            "message": f"生成失败: {str(exc)}",
+            "elapsedMs": int((time.perf_counter() - start_time) * 1000)
+        })
+
+
+@app.post("/api/execute/stream")
+async def execute_stream_endpoint(request: ExecuteRequest):
+    """
+    /api/execute 的 SSE 流式版本
+    analysis 与每个选项生成完毕即推送，缩短首个选项的等待时间
+    
+    Events: analysis -> option (x3) -> done | error
+    """
+    strategy = request.analysis_context.strategy
+    logger.info(f"⚔️ [/api/execute/stream] Strategy: {strategy} | Input: {request.user_input[:30]}...")
+    
+    start_time = time.perf_counter()
+    events = ai_service.stream_execute_tactics(
+        request.user_input,
+        request.analysis_context.model_dump(),
+        request.history
+    )
+    return StreamingResponse(
+        stream_advisor_events(events, start_time, "/api/execute/stream", {
+            "originalText": request.user_input,
+            "appliedStrategy": strategy
+        }),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+# ==================== 一体化管线 API (分析 + 推测执行) ====================
+
+def pipeline_result_payload(
+    user_input: str,
+    analysis: Dict[str, Any],
+    result: Dict[str, Any],
+    analysis_time_ms: int,
+    execution_time_ms: int,
+    mode: str
+) -> Dict[str, Any]:
+    """/api/pipeline 一次返回分析与回复选项时的响应体"""
+    return {
+        "success": True,
+        "mode": mode,
+        "analysis": analysis,
+        "analysisTimeMs": analysis_time_ms,
+        "data": {
+            "originalText": user_input,
+            "sceneSummary": result.get("analysis", analysis.get("summary", "")),
+            "options": [format_option(idx, opt) for idx, opt in enumerate(result.get("options", []))],
+            "executionTimeMs": execution_time_ms,
+            "appliedStrategy": analysis.get("strategy")
+        }
+    }
+
+
+@app.post("/api/pipeline")
+async def pipeline_endpoint(request: PipelineRequest):
+    """
+    态势分析完成后立即以建议策略推测执行战术，省去一次客户端往返
+    
+    wait_for_execution=True:  { success, mode, analysis, data: {options, ...} }
+    wait_for_execution=False: { success, pipelineId, analysis } -> 再调用 /api/pipeline/{id}/execute
+    single_call=True（或 PIPELINE_SINGLE_CALL=true）: 分析与回复由一次 LLM 调用产出，mode="single_call"
+    """
+    single_call = request.single_call if request.single_call is not None else pipeline_service.single_call_default
+    single_call = single_call and request.wait_for_execution
+    logger.info(
+        f"🔮 [/api/pipeline] Input: {request.user_input[:30]}... | Wait: {request.wait_for_execution}"
+        f" | Single call: {single_call}"
+    )
+    
+    start_time = time.perf_counter()
+    
+    try:
+        if single_call:
+            analysis, result = await pipeline_service.run_single_call(
+                request.user_input,
+                request.history,
+                use_cache=not request.bypass_cache
+            )
+            # 分析与执行在同一次调用中完成，无法拆分耗时
+            total_time_ms = int((time.perf_counter() - start_time) * 1000)
+            return pipeline_result_payload(request.user_input, analysis, result, total_time_ms, 0, "single_call")
+
+        pipeline_id, analysis = await pipeline_service.start(
+            request.user_input,
+            request.history,
+            use_cache=not request.bypass_cache
+        )
+        analysis_time_ms = int((time.perf_counter() - start_time) * 1000)
+        
+        if not request.wait_for_execution:
+            return {
+                "success": True,
+                "pipelineId": pipeline_id,
+                "analysis": analysis,
+                "raw_input": request.user_input,
+                "analysisTimeMs": analysis_time_ms
+            }
+        
+        result, analysis, _ = await pipeline_service.commit(pipeline_id)
+        execution_time_ms = int((time.perf_counter() - start_time) * 1000) - analysis_time_ms
+        return pipeline_result_payload(
+            request.user_input, analysis, result, analysis_time_ms, execution_time_ms, "speculative"
+        )
+    except (AdmissionRejected, DeadlineExceeded) as exc:
+        return upstream_error_response(exc)
+    except Exception as exc:
+        logger.error(f"❌ [/api/pipeline] Error: {exc}")
+        return {
+            "success": False,
+            "message": f"战术管线失败: {str(exc)}",
+            "data": {
+                "executionTimeMs": int((time.perf_counter() - start_time) * 1000)
+            }
+        }
+
+
+@app.post("/api/pipeline/{pipeline_id}/execute")
+async def pipeline_execute_endpoint(pipeline_id: str, request: PipelineExecuteRequest):
+    """
+    确认推测执行：策略未改变时直接返回（或等待）推测结果，否则取消并按修改后的分析重新执行
+    
+    Response: 与 /api/execute 相同，data.speculative 表示是否命中推测结果
+    """
+    start_time = time.perf_counter()
+    edited = request.analysis_context.model_dump() if request.analysis_context else None
+    
+    try:
+        result, analysis, speculative = await pipeline_service.commit(pipeline_id, edited)
+    except KeyError:
+        return JSONResponse(status_code=404, content={
+            "success": False,
+            "message": "管线不存在或已过期，请改用 /api/execute",
+            "error_code": "PIPELINE_NOT_FOUND"
+        })
+    except (AdmissionRejected, DeadlineExceeded) as exc:
+        return upstream_error_response(exc)
+    except Exception as exc:
+        logger.error(f"❌ [/api/pipeline/execute] Error: {exc}")
+        return {
+            "success": False,
+            "message": f"战术执行失败: {str(exc)}",
+            "data": {
+                "executionTimeMs": int((time.perf_counter() - start_time) * 1000)
+            }
+        }
+    
+    return {
+        "success": True,
+        "data": {
+            "sceneSummary": result.get("analysis", analysis.get("summary", "")),
+            "options": [format_option(idx, opt) for idx, opt in enumerate(result.get("options", []))],
+            "executionTimeMs": int((time.perf_counter() - start_time) * 1000),
+            "appliedStrategy": analysis.get("strategy"),
+            "speculative": speculative
+        }
+    }
+
+
+# ==================== 批量 API (NDJSON) ====================
+
+async def stream_batch_results(results, start_time: float, tag: str, total: int):
+    """
+    将批处理结果编码为 NDJSON：每行一条结果（按完成顺序），最后一行为汇总
+    """
+    succeeded = 0
+    async for item in results:
+        succeeded += item["success"]
+        if not item["success"]:
+            logger.warning(f"⚠️ [{tag}] Item {item['index']} failed: {item['message']}")
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+    elapsed_ms = int((time.perf_counter() - start_time) * 1000)
+    logger.success(f"✅ [{tag}] {succeeded}/{total} succeeded in {elapsed_ms}ms")
+    yield json.dumps({
+        "done": True,
+        "total": total,
+        "succeeded": succeeded,
+        "failed": total - succeeded,
+        "elapsedMs": elapsed_ms
+    }) + "\n"
+
+
+@app.post("/api/analyze/batch")
+async def analyze_batch_endpoint(request: AnalyzeBatchRequest):
+    """
+    批量态势分析，结果以 NDJSON 按完成顺序流式返回
+    
+    Line: { index, success, data: SituationAnalysis } | { index, success: false, message, error_code }
+    Last: { done: true, total, succeeded, failed, elapsedMs }
+    """
+    logger.info(f"📦 [/api/analyze/batch] Items: {len(request.items)}")
+    
+    start_time = time.perf_counter()
+    
+    async def analyze_item(item: AnalyzeRequest) -> dict:
+        # 不使用兜底分析：上游失败时该条记为失败，而不是返回默认结果
+        return await ai_service.analyze_situation(
+            item.user_input,
+            item.history,
+            use_cache=not item.bypass_cache,
+            fallback=False
+        )
+    
+    results = batch_service.run(request.items, analyze_item, request.concurrency)
+    return StreamingResponse(
+        stream_batch_results(results, start_time, "/api/analyze/batch", len(request.items)),
+        media_type="application/x-ndjson"
+    )
+
+
+@app.post("/api/execute/batch")
+async def execute_batch_endpoint(request: ExecuteBatchRequest):
+    """
+    批量战术执行，结果以 NDJSON 按完成顺序流式返回
+    
+    Line: { index, success, data: {sceneSummary, options, appliedStrategy} } | { index, success: false, message, error_code }
+    Last: { done: true, total, succeeded, failed, elapsedMs }
+    """
+    logger.info(f"📦 [/api/execute/batch] Items: {len(request.items)}")
+    
+    start_time = time.perf_counter()
+    
+    async def execute_item(item: ExecuteRequest) -> dict:
+        result = await ai_service.execute_tactics(
+            item.user_input,
+            item.analysis_context.model_dump(),
+            item.history
+        )
+        return {
+            "sceneSummary": result.get("analysis", item.analysis_context.summary),
+            "options": [format_option(idx, opt) for idx, opt in enumerate(result.get("options", []))],
+            "appliedStrategy": item.analysis_context.strategy
+        }
+    
+    results = batch_service.run(request.items, execute_item, request.concurrency)
+    return StreamingResponse(
+        stream_batch_results(results, start_time, "/api/execute/batch", len(request.items)),
+        media_type="application/x-ndjson"
+    )
+
+
 # ==================== 原有接口（保持兼容） ====================
 
 @app.post("/api/chat", response_model=AdvisorResponse)
@@ -598,6 +1236,8 @@ async def chat_endpoint(request: ChatRequest):
         # 传入 user_input 和 history，风格由后端随机
         result = await ai_service.generate_response(request.user_input, request.history)
         return result
+    except (AdmissionRejected, DeadlineExceeded) as exc:
+        return upstream_error_response(exc)
     except Exception as exc:
         logger.error(f"❌ [/api/chat] Error: {exc}")
         # 兜底返回，防止前端白屏
@@ -648,6 +1288,8 @@ async def generate_dialog(request: LegacyGenerateRequest):
     }
     """
     start_time = time.perf_counter()
+    if request.userId:
+        usage_user.set(request.userId)
     
     # v8.1: 记录战术意图
     intent_str = f" | Intent: {request.tacticalIntent}" if request.tacticalIntent else ""
@@ -661,43 +1303,16 @@ async def generate_dialog(request: LegacyGenerateRequest):
         )
         
         # v8.1: 如果有战术意图，传递给 AI 服务
-        advisor_response = await ai_service.generate_response_with_intent(
+        use_fanout = request.fanout if request.fanout is not None else ai_service.fanout_default
+        generate = ai_service.generate_fanout if use_fanout else ai_service.generate_response_with_intent
+        advisor_response = await generate(
             request.text, 
             request.history or [],
             request.tacticalIntent  # 🆕 战术意图
         )
         
         # 转换为旧格式
-        formatted_options = []
-        for idx, opt in enumerate(advisor_response.get("options", [])):
-            # 根据评分映射好感度变化
-            score = opt.get("score", 0)
-            favor_change = score  # 直接使用评分作为好感度变化
-            
-            # 根据风格选择 emoji
-            emoji_map = {
-                "COLD": "❄️",
-                "TSUNDERE": "💢",
-                "GENKI": "✨",
-                "FLATTERING": "🥺",
-                "CHUNIBYO": "🌙"
-            }
-            emoji = emoji_map.get(opt.get("style", ""), "💬")
-            
-            # 🆕 v3.1: 完整传递所有字段
-            formatted_options.append({
-                "id": chr(65 + idx),  # A, B, C
-                "text": opt.get("text", ""),
-                "kaomoji": opt.get("kaomoji", ""),  # 🆕 颜文字
-                "score": score,                      # 🆕 评分
-                "style": opt.get("style", ""),       # 风格代码
-                "style_name": opt.get("style_name", "未知"),  # 风格名称
-                "emoji": emoji,
-                "favorChange": favor_change,
-                "type": "default",
-                "description": f"情商评分: {score:+d}",
-                "effect": ""
-            })
+        formatted_options = [format_option(idx, opt) for idx, opt in enumerate(advisor_response.get("options", []))]
         
         generation_time_ms = int((time.perf_counter() - start_time) * 1000)
         
@@ -710,10 +1325,15 @@ async def generate_dialog(request: LegacyGenerateRequest):
                 "options": formatted_options,
                 "style": request.style or "random",
                 "generationTimeMs": generation_time_ms,
-                "tacticalIntent": request.tacticalIntent  # 🆕 返回使用的战术意图
+                "tacticalIntent": request.tacticalIntent,  # 🆕 返回使用的战术意图
+                # fan-out 模式：截止时间到达时未完成的风格
+                "partial": advisor_response.get("partial", False),
+                "pendingStyles": advisor_response.get("pendingStyles", [])
             }
         }
         
+    except (AdmissionRejected, DeadlineExceeded) as exc:
+        return upstream_error_response(exc)
     except Exception as exc:
         logger.error(f"❌ [/api/generate] Failed: {exc}")
         return {
@@ -725,13 +1345,46 @@ async def generate_dialog(request: LegacyGenerateRequest):
             }
         }
 
+@app.post("/api/generate/stream")
+async def generate_stream_endpoint(request: LegacyGenerateRequest):
+    """
+    /api/generate 的 SSE 流式版本 (支持 tacticalIntent)
+    
+    Events: analysis -> option (x3) -> done | error
+    fan-out 模式: analysis -> option (x1~3) -> done -> late_option (x0~2) | error
+    """
+    intent_str = f" | Intent: {request.tacticalIntent}" if request.tacticalIntent else ""
+    logger.info(f"📨 [/api/generate/stream] History: {len(request.history or [])} msgs{intent_str}")
+    
+    start_time = time.perf_counter()
+    if request.userId:
+        usage_user.set(request.userId)
+    use_fanout = request.fanout if request.fanout is not None else ai_service.fanout_default
+    stream = ai_service.stream_generate_fanout if use_fanout else ai_service.stream_generate_response_with_intent
+    events = stream(
+        request.text,
+        request.history or [],
+        request.tacticalIntent
+    )
+    return StreamingResponse(
+        stream_advisor_events(events, start_time, "/api/generate/stream", {
+            "sessionId": request.sessionId or "temp-session",
+            "originalText": request.text,
+            "style": request.style or "random",
+            "tacticalIntent": request.tacticalIntent
+        }),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
 
 @app.post("/api/selection")
 @app.post("/api/dialog/selection")
 async def record_selection(request: SelectionRequest):
     print(f"收到选择: {request.optionIndex}")
     
-    session = db_service.get_session(request.sessionId)
+    session = await db_service.run(db_service.get_session, request.sessionId)
     if not session:
         # If session not found (maybe from old backend or restart), just log it but don't crash
         print(f"Session {request.sessionId} not found")
@@ -748,20 +1401,22 @@ async def record_selection(request: SelectionRequest):
                 else:
                     selected_option_text = str(selected_option)
     
-    selection = db_service.create_selection(
+    selection = await db_service.run(
+        db_service.create_selection,
         session_id=request.sessionId,
         option_id=f"opt-{(request.optionIndex or 0) + 1}",
         user_id=request.userId or ""
     )
 
     if session and selected_option_text:
-        db_service.append_to_training_set(
+        await db_service.run(
+            db_service.append_to_training_set,
             scene=session.get("originalText", ""),
             selected_option=selected_option_text,
             style="unknown"
         )
 
-    user_stats = db_service.get_user_stats(request.userId)
+    user_stats = await db_service.run(db_service.get_user_stats, request.userId)
 
     return {
         "success": True,
@@ -785,7 +1440,8 @@ async def record_feedback(request: FeedbackRequest):
     }
     training_weight = weight_map.get(feedback_type, 1.0)
 
-    entry = db_service.record_feedback(
+    entry = await db_service.run(
+        db_service.record_feedback,
         message_id=request.messageId,
         feedback_type=feedback_type,
         training_weight=training_weight,
@@ -795,7 +1451,7 @@ async def record_feedback(request: FeedbackRequest):
     )
 
     if feedback_type == "like" and request.scene and request.response:
-        db_service.append_to_positive_set(request.scene, request.response)
+        await db_service.run(db_service.append_to_positive_set, request.scene, request.response)
 
     return {
         "success": True,
@@ -807,7 +1463,7 @@ async def record_feedback(request: FeedbackRequest):
 
 @app.delete("/api/sessions/{session_id}/messages/{message_id}")
 async def delete_message(session_id: str, message_id: str):
-    deleted = db_service.delete_session_message(session_id, message_id)
+    deleted = await db_service.run(db_service.delete_session_message, session_id, message_id)
     return {
         "success": True,
         "data": {
@@ -0,0 +1,43 @@
+"""
+把旧的 TinyDB 数据文件（db.json）导入 SQLite 存储
+
+后端以 DB_BACKEND=sqlite（默认）启动时会自动导入一次；本脚本用于提前离线迁移或重新导入。
+导入在单个事务中完成，失败时 SQLite 文件保持原样，db.json 不做任何修改（可随时切回 DB_BACKEND=tinydb）。
+
+Usage (from backend/):
+  python migrate_db.py [--json db.json] [--sqlite sdp.db] [--force]
+"""
+
+import argparse
+import os
+
+from services.db_storage import SQLiteStorage, migrate_tinydb
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the TinyDB db.json into the SQLite storage backend")
+    parser.add_argument("--json", default=os.getenv("DB_LEGACY_JSON_PATH", os.path.join(BACKEND_DIR, "db.json")))
+    parser.add_argument("--sqlite", default=os.getenv("DB_PATH", os.path.join(BACKEND_DIR, "sdp.db")))
+    parser.add_argument("--force", action="store_true", help="re-import even if already migrated")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.json):
+        raise SystemExit(f"{args.json} not found")
+
+    storage = SQLiteStorage(args.sqlite)
+    try:
+        counts = migrate_tinydb(args.json, storage, force=args.force)
+    finally:
+        storage.close()
+    if not counts:
+        print(f"Already migrated ({args.sqlite}); pass --force to re-import")
+        return
+    for table, count in counts.items():
+        print(f"  {table:<12} {count}")
+    print(f"Done: {args.json} -> {args.sqlite}")
+
+
+if __name__ == "__main__":
+    main()
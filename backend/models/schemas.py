@@ -44,6 +44,7 @@ class AnalyzeRequest(BaseModel):
     """v8.0 态势感知请求"""
     user_input: str = Field(..., description="对方发来的消息 (支持多行/连发)")
     history: List[dict] = Field(default=[], description="对话历史上下文")
+    bypass_cache: bool = Field(default=False, description="跳过态势分析缓存，强制重新分析")
     
     @field_validator('history')
     @classmethod
@@ -73,6 +74,31 @@ class ExecuteResponse(BaseModel):
     analysis: str = Field(..., description="最终采用的局势分析")
     options: List['ReplyOption'] = Field(..., min_length=3, max_length=3)
 
+class PipelineRequest(AnalyzeRequest):
+    """分析 + 推测执行一体化请求"""
+    wait_for_execution: bool = Field(
+        default=True,
+        description="True: 一次返回分析与回复选项; False: 先返回分析，执行在后台推测进行"
+    )
+    single_call: Optional[bool] = Field(
+        default=None,
+        description="仅 wait_for_execution=True 时生效：一次 LLM 调用同时完成分析与回复生成；为空使用 PIPELINE_SINGLE_CALL 配置"
+    )
+
+class PipelineExecuteRequest(BaseModel):
+    """确认推测执行 - 可提交修改后的分析，仅当策略改变时重新执行"""
+    analysis_context: Optional[SituationAnalysis] = Field(None, description="用户确认/修改后的战术分析，为空表示直接采用")
+
+class AnalyzeBatchRequest(BaseModel):
+    """批量态势分析（评测 / 审核任务用），结果以 NDJSON 流式返回"""
+    items: List[AnalyzeRequest] = Field(..., min_length=1, max_length=5000, description="待分析的消息列表")
+    concurrency: Optional[int] = Field(None, ge=1, le=32, description="批内并发上限，为空使用服务端默认值")
+
+class ExecuteBatchRequest(BaseModel):
+    """批量战术执行（评测 / 审核任务用），结果以 NDJSON 流式返回"""
+    items: List[ExecuteRequest] = Field(..., min_length=1, max_length=5000, description="待生成回复的请求列表")
+    concurrency: Optional[int] = Field(None, ge=1, le=32, description="批内并发上限，为空使用服务端默认值")
+
 # ==================== 新版：恋爱军师模型 ====================
 
 class ChatRequest(BaseModel):
@@ -156,6 +182,7 @@ class LegacyGenerateRequest(BaseModel):
     sessionId: Optional[str] = None
     clientMessages: Optional[List[dict]] = None
     tacticalIntent: Optional[str] = None  # 🆕 v8.1: 战术意图
+    fanout: Optional[bool] = None  # 每个风格并发一次调用，超时先返回已完成的选项；为空使用 GENERATE_FANOUT 配置
 
 # ==================== 响应模型 ====================
 
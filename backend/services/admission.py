@@ -0,0 +1,213 @@
+"""
+Admission Control - 上游并发自适应限流
+所有 LLM / VLM 调用共享一个 AIMD 并发上限：
+成功且延迟正常时缓慢加性增长，遇到 429 / 5xx / 超时或延迟劣化时乘性下降。
+超出上限的请求按优先级排队，队列满时快速拒绝并给出重试建议。
+"""
+import asyncio
+import bisect
+import contextvars
+import itertools
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import openai
+from loguru import logger
+
+# 数值越小优先级越高
+PRIORITY_INTERACTIVE = 0
+PRIORITY_VISION = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_BATCH = 3
+
+# 当前请求的优先级，由 main.py 按接口路径设置
+request_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "request_priority", default=PRIORITY_INTERACTIVE
+)
+
+# 过载信号：限流、服务端错误、超时、连接失败
+OVERLOAD_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    asyncio.TimeoutError,
+)
+
+
+class AdmissionRejected(Exception):
+    """上游繁忙，请求被拒绝（附带建议的重试等待秒数）"""
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 自适应并发限制器
+
+    - 成功且延迟不超过基线 × tolerance：limit += 1 / limit（约每轮 +1）
+    - 过载信号或延迟劣化：limit *= backoff，冷却期内只下降一次
+    - 等待队列按 (优先级, 到达顺序) 排序，满时高优先级请求可挤掉最低优先级的等待者
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.min_limit = float(os.getenv("AI_LIMIT_MIN", "2"))
+        self.max_limit = float(os.getenv("AI_LIMIT_MAX", "64"))
+        self.limit = float(os.getenv("AI_LIMIT_INITIAL", "8"))
+        self.backoff = float(os.getenv("AI_LIMIT_BACKOFF", "0.7"))
+        self.latency_tolerance = float(os.getenv("AI_LIMIT_LATENCY_TOLERANCE", "2.5"))
+        self.decrease_cooldown = float(os.getenv("AI_LIMIT_DECREASE_COOLDOWN", "2"))
+        self.queue_size = int(os.getenv("AI_LIMIT_QUEUE_SIZE", "64"))
+        self.queue_timeout = float(os.getenv("AI_LIMIT_QUEUE_TIMEOUT", "30"))
+
+        self.inflight = 0
+        self._waiters: List[Tuple[int, int, "asyncio.Future[None]"]] = []
+        self._seq = itertools.count()
+        self._baseline: Optional[float] = None
+        self._last_decrease = 0.0
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.overloads = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    # ==================== 准入 ====================
+
+    def _has_capacity(self) -> bool:
+        return self.inflight < int(self.limit)
+
+    def retry_after(self) -> float:
+        """粗略估计队列排空所需时间"""
+        latency = self._baseline or 2.0
+        return round(max(1.0, latency * (len(self._waiters) + 1) / max(self.limit, 1.0)), 1)
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self.rejected += 1
+        retry_after = self.retry_after()
+        logger.warning(f"🚦 [Admission:{self.name}] Rejected ({reason}), retry after {retry_after}s")
+        return AdmissionRejected(f"上游繁忙（{reason}），请 {retry_after} 秒后重试", retry_after)
+
+    async def acquire(self, priority: int, timeout: Optional[float] = None) -> None:
+        """
+        获取一个上游并发名额
+
+        Args:
+            priority: 排队优先级（越小越优先）
+            timeout: 最长排队时间（通常为请求剩余的截止时间），不超过 AI_LIMIT_QUEUE_TIMEOUT
+        """
+        if self._has_capacity() and not self._waiters:
+            self.inflight += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiters) >= self.queue_size:
+            worst_priority, _, worst = self._waiters[-1]
+            if priority >= worst_priority:
+                raise self._reject("queue full")
+            # 挤掉队尾最低优先级的等待者
+            self._waiters.pop()
+            worst.set_exception(self._reject("preempted"))
+
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        bisect.insort(self._waiters, entry)
+        self.queued += 1
+        start = time.perf_counter()
+        try:
+            wait_timeout = self.queue_timeout if timeout is None else max(0.0, min(timeout, self.queue_timeout))
+            await asyncio.wait_for(asyncio.shield(future), timeout=wait_timeout)
+        except BaseException as exc:
+            self._remove(entry)
+            granted = future.done() and not future.cancelled() and future.exception() is None
+            timed_out = isinstance(exc, asyncio.TimeoutError)
+            if not (granted and timed_out):
+                if granted:
+                    # 已被授予名额但调用方取消，归还名额
+                    self.inflight -= 1
+                    self._grant()
+                elif not future.done():
+                    future.cancel()
+                if timed_out:
+                    raise self._reject("queue timeout")
+                raise
+        finally:
+            waited = time.perf_counter() - start
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        self.admitted += 1
+
+    def _remove(self, entry: Tuple[int, int, "asyncio.Future[None]"]) -> None:
+        idx = bisect.bisect_left(self._waiters, entry)
+        if idx < len(self._waiters) and self._waiters[idx] is entry:
+            self._waiters.pop(idx)
+
+    def _grant(self) -> None:
+        """把空出的名额按优先级交给等待者"""
+        while self._waiters and self._has_capacity():
+            _, _, future = self._waiters.pop(0)
+            if future.done():
+                continue
+            self.inflight += 1
+            future.set_result(None)
+
+    def release(self, latency: Optional[float], overloaded: bool) -> None:
+        """
+        归还名额并调整上限
+
+        Args:
+            latency: 本次调用耗时；None 表示不作为延迟信号（流式请求、被取消的对冲请求）
+            overloaded: 是否收到过载信号 (429 / 5xx / 超时)
+        """
+        self.inflight -= 1
+        now = time.monotonic()
+
+        degraded = (
+            latency is not None
+            and self._baseline is not None
+            and latency > self._baseline * self.latency_tolerance
+        )
+        if overloaded or degraded:
+            if overloaded:
+                self.overloads += 1
+            if now - self._last_decrease >= self.decrease_cooldown:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                logger.info(f"📉 [Admission:{self.name}] Limit -> {self.limit:.1f} (overload: {overloaded})")
+        elif latency is not None:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+        if latency is not None and not overloaded:
+            # 基线跟踪正常响应延迟，只缓慢上移以免被劣化样本拖高
+            if self._baseline is None:
+                self._baseline = latency
+            else:
+                weight = 0.02 if latency > self._baseline else 0.1
+                self._baseline += weight * (latency - self._baseline)
+
+        self._grant()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = max(self.queued, 1)
+        return {
+            "limit": round(self.limit, 2),
+            "inflight": self.inflight,
+            "queueDepth": len(self._waiters),
+            "queueCapacity": self.queue_size,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "overloads": self.overloads,
+            "avgQueueWaitMs": round(self.total_wait / waits * 1000, 1),
+            "maxQueueWaitMs": round(self.max_wait * 1000, 1),
+            "baselineLatencyMs": round(self._baseline * 1000) if self._baseline else None,
+        }
+
+
+# 全局共享：文本与视觉调用共用同一个上游并发预算
+upstream_limiter = AdaptiveLimiter("upstream")
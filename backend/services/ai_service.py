@@ -1,24 +1,39 @@
 """
 AI Service - 恋爱军师核心逻辑 v8.0 指挥官系统
 """
+import asyncio
 import json
 import os
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-from dotenv import load_dotenv
 from loguru import logger
 from openai import AsyncOpenAI
 from pydantic import ValidationError
-from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_fixed
 
 # 引入新定义的 Schema 和 Config
-from models.schemas import AdvisorResponse, SituationAnalysis
+from models.schemas import AdvisorResponse, ReplyOption, SituationAnalysis
 from config.styles import (
     build_advisor_prompt, 
     build_analyze_prompt, 
+    build_combined_prompt,
     build_execute_prompt,
+    build_single_style_prompt,
     get_random_styles
 )
+from services.admission import AdmissionRejected
+from services.cache import TTLCache, make_cache_key, normalize_text
+from services.db_service import db_service
+from services.intent_classifier import intent_classifier
+from services.json_repair import clamp_float, clamp_int, parse_llm_json
+from services.llm_client import llm_pool
+from services.llm_router import chat_router
+from services.local_analyzer import detect_burst, local_analyzer
+from services.metrics import stage_timer, timed
+from services.prompt_assembler import CompactHistory, prompt_assembler
+from services.retry_policy import DeadlineExceeded, llm_retry, remaining_time
+from services.singleflight import SingleFlight
+from services.token_usage import usage_strategy
+from services.stream_parser import MAX_OPTIONS, AdvisorStreamParser, StreamEvent, coerce_option
 
 class AIService:
     """
@@ -28,55 +43,110 @@ class AIService:
     
     def __init__(self) -> None:
         logger.info("🚀 [AIService] Initializing Commander System v8.0...")
-        self._refresh_config()
-
-    def _refresh_config(self) -> None:
-        """加载环境变量配置"""
-        load_dotenv(override=True)
-        self.api_key = os.getenv("SILICONFLOW_API_KEY", "")
-        # 推荐使用指令遵循能力强的模型
-        self.model = os.getenv("AI_MODEL", "Qwen/Qwen2.5-72B-Instruct")
-        self.max_tokens = int(os.getenv("AI_MAX_TOKENS", "2048"))
-        self.temperature = float(os.getenv("AI_TEMPERATURE", "0.95")) # 提高创造性
-        
-        self.client = AsyncOpenAI(
-            api_key=self.api_key,
-            base_url="https://api.siliconflow.cn/v1"
+        # 态势感知结果缓存：相同输入 + 历史在 TTL 内直接复用
+        self.analyze_cache = TTLCache(
+            "analyze",
+            max_size=int(os.getenv("ANALYZE_CACHE_SIZE", "512")),
+            ttl=float(os.getenv("ANALYZE_CACHE_TTL", "300")),
         )
-        
-        logger.success(f"✅ [Config] Model: {self.model} | Temp: {self.temperature}")
+        # 相同请求并发到达时只调用一次上游
+        self.analyze_flight = SingleFlight("analyze")
+        self.execute_flight = SingleFlight("execute")
+        self.combined_flight = SingleFlight("combined")
+        # LLM 态势分析结果（含用户原文）写入 data/analyze_labels.jsonl，供 train_classifier.py 训练本地分类器；需显式开启
+        self.log_analyze_labels = os.getenv("ANALYZE_LABEL_LOG", "false").lower() == "true"
+        # 按风格并行生成（fan-out）：每个风格一次较小的上游调用，软截止时间到达时先返回已完成的选项
+        self.fanout_default = os.getenv("GENERATE_FANOUT", "false").lower() == "true"
+        self.fanout_deadline = float(os.getenv("GENERATE_FANOUT_DEADLINE", "6"))
+        self.fanout_max_tokens = int(os.getenv("GENERATE_FANOUT_MAX_TOKENS", "256"))
+        self.fanout_stats = {"requests": 0, "partial": 0, "lateOptions": 0, "failedStyles": 0}
+
+    # 配置与客户端统一由 llm_pool 管理（长连接 + 热重载），这里只做只读代理
+    @property
+    def client(self) -> AsyncOpenAI:
+        return llm_pool.client("chat")
+
+    @property
+    def model(self) -> str:
+        return llm_pool.profile("chat").model
+
+    @property
+    def max_tokens(self) -> int:
+        return llm_pool.profile("chat").max_tokens
+
+    @property
+    def temperature(self) -> float:
+        return llm_pool.profile("chat").temperature
+
+    async def _create_completion(self, messages: list, **kwargs: Any) -> Any:
+        """
+        调用 chat.completions.create
+
+        由 chat_router 在已配置的后端间选择（延迟感知 + 对冲请求），
+        model 以及未显式传入的 temperature / max_tokens 取自被选中的后端配置。
+        """
+        return await chat_router.create(messages, **kwargs)
+
+    async def _complete_advisor(self, messages: list) -> Dict[str, Any]:
+        """单次调用 + 解析校验为 AdvisorResponse（作为一次重试尝试）"""
+        response = await self._create_completion(
+            messages=messages,
+            response_format={"type": "json_object"},
+        )
+        return self._parse_response(response.choices[0].message.content)
 
     def _detect_burst_mode(self, text: str) -> tuple[bool, int]:
         """
         检测连发消息模式
         Returns: (is_burst, pressure_level)
         """
-        lines = text.strip().split('\n')
-        line_count = len(lines)
-        
-        # 计算短消息占比（<=5字符的行）
-        short_lines = sum(1 for line in lines if len(line.strip()) <= 5)
-        
-        is_burst = line_count >= 3 or (line_count >= 2 and short_lines >= 2)
-        pressure_level = min(line_count, 5)  # 最高5级
-        
-        return is_burst, pressure_level
+        return detect_burst(text)
+
+    def _analyze_cache_key(self, user_input: str, context: CompactHistory) -> str:
+        """
+        态势感知缓存键：归一化输入 + Prompt 实际使用的（压缩后）历史 + 模型名
+        """
+        recent = [
+            # build_analyze_prompt 只区分 user / 非 user
+            [msg.get("role") == "user", normalize_text(str(msg.get("content", "")))]
+            for msg in context.messages
+        ]
+        return make_cache_key(normalize_text(user_input), recent, context.summary, self.model)
+
+    @staticmethod
+    def _coerce_advisor(data: Dict[str, Any]) -> Dict[str, Any]:
+        """规整回复选项：丢弃空选项、只保留前 3 个、评分钳制到 [-3, 3]、补全缺失字段（与流式推送共用 coerce_option）"""
+        options = [coerced for coerced in map(coerce_option, data.get("options") or []) if coerced is not None]
+        data["options"] = options[:MAX_OPTIONS]
+        data.setdefault("analysis", "")
+        return data
+
+    @staticmethod
+    def _coerce_analysis(data: Dict[str, Any]) -> Dict[str, Any]:
+        """规整态势分析的数值字段（越界值钳制，字符串布尔值转换）"""
+        data["emotion_score"] = clamp_int(data.get("emotion_score"), -3, 3)
+        data["confidence"] = clamp_float(data.get("confidence"), 0.0, 1.0, default=0.8)
+        data["pressure_level"] = clamp_int(data.get("pressure_level"), 0, 5)
+        burst = data.get("burst_detected", False)
+        data["burst_detected"] = burst.strip().lower() == "true" if isinstance(burst, str) else bool(burst)
+        return data
 
     def _parse_response(self, raw_content: str) -> Dict[str, Any]:
         """
         解析 LLM 返回的 JSON 响应并验证数据结构
+        先做容错修复与字段规整（多余选项、越界评分、缺失的颜文字），
+        只有修复失败或关键字段缺失时才抛出异常交给重试策略
         """
-        clean_content = raw_content.replace("```json", "").replace("```", "").strip()
-        
-        logger.debug(f"📝 [Parse] Raw content length: {len(clean_content)}")
-        
+        logger.debug(f"📝 [Parse] Raw content length: {len(raw_content or '')}")
+
         try:
-            data = json.loads(clean_content)
+            data = self._coerce_advisor(parse_llm_json(raw_content, "advisor"))
             # 使用新版模型验证
-            validated = AdvisorResponse(**data)
+            with stage_timer("validation", "advisor"):
+                validated = AdvisorResponse(**data)
             logger.debug(f"✅ [Validate] Analysis: {validated.analysis[:20]}...")
             return validated.model_dump()
-            
+
         except json.JSONDecodeError as e:
             logger.error(f"❌ [Parse] JSON Error: {e}")
             raise e
@@ -88,11 +158,10 @@ class AIService:
         """
         解析态势感知响应 (SituationAnalysis)
         """
-        clean_content = raw_content.replace("```json", "").replace("```", "").strip()
-        
         try:
-            data = json.loads(clean_content)
-            validated = SituationAnalysis(**data)
+            data = self._coerce_analysis(parse_llm_json(raw_content, "analysis"))
+            with stage_timer("validation", "analysis"):
+                validated = SituationAnalysis(**data)
             return validated.model_dump()
         except json.JSONDecodeError as e:
             logger.error(f"❌ [Analyze Parse] JSON Error: {e}")
@@ -101,6 +170,65 @@ class AIService:
             logger.error(f"❌ [Analyze Parse] Schema Error: {e}")
             raise e
 
+    def _parse_style_response(self, raw_content: str, style: Dict[str, str]) -> Tuple[str, Dict[str, Any]]:
+        """
+        解析 fan-out 单风格输出：返回 (一句话分析, ReplyOption 字典)
+        风格代码以请求时分配的为准，不信任模型回填的值
+        """
+        try:
+            data = parse_llm_json(raw_content, "fanout")
+            with stage_timer("validation", "fanout"):
+                option = ReplyOption(
+                    style=style["key"],
+                    style_name=style["name"],
+                    text=str(data.get("text") or "").strip(),
+                    kaomoji=str(data.get("kaomoji") or ""),
+                    score=clamp_int(data.get("score"), -3, 3),
+                ).model_dump()
+            return str(data.get("analysis") or ""), option
+        except json.JSONDecodeError as e:
+            logger.error(f"❌ [Fanout Parse] JSON Error: {e}")
+            raise e
+        except ValidationError as e:
+            logger.error(f"❌ [Fanout Parse] Schema Error: {e}")
+            raise e
+
+    def _parse_combined_response(self, raw_content: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        解析单次调用模式的合并输出，分别验证为 SituationAnalysis 与 AdvisorResponse
+        """
+        try:
+            data = parse_llm_json(raw_content, "combined")
+            with stage_timer("validation", "combined"):
+                analysis = SituationAnalysis(**self._coerce_analysis(dict(data))).model_dump()
+                advice = AdvisorResponse(**self._coerce_advisor({
+                    "analysis": data.get("summary", ""),
+                    "options": data.get("options"),
+                })).model_dump()
+            return analysis, advice
+        except json.JSONDecodeError as e:
+            logger.error(f"❌ [Combined Parse] JSON Error: {e}")
+            raise e
+        except ValidationError as e:
+            logger.error(f"❌ [Combined Parse] Schema Error: {e}")
+            raise e
+
+    def _history_section(self, history: list) -> str:
+        """按 token 预算压缩历史并格式化为 Prompt 段落（无历史时为空字符串）"""
+        context = prompt_assembler.compact(history, "generate")
+        context_str = ""
+        if context.messages:
+            context_str = "\n# 📜 Conversation History (Recent Context)\n"
+            context_str += "以下是之前的对话上下文，用于理解当前局势的背景：\n"
+            if context.summary:
+                context_str += f"0. 更早的对话摘要: {context.summary}\n"
+            for i, msg in enumerate(context.messages, 1):
+                role = "对方" if msg.get("role") == "user" else "你之前的建议"
+                content = msg.get("content", "")
+                context_str += f"{i}. {role}: {content}\n"
+            context_str += "\n---\n"
+        return context_str
+
     def _build_context_prompt(self, user_input: str, history: list, selected_styles: list) -> str:
         """
         构建带上下文的 Prompt
@@ -113,57 +241,94 @@ class AIService:
         Returns:
             完整的 system prompt
         """
-        # 1. 格式化历史记录
-        context_str = ""
-        if history:
-            context_str = "\n# 📜 Conversation History (Recent Context)\n"
-            context_str += "以下是之前的对话上下文，用于理解当前局势的背景：\n"
-            for i, msg in enumerate(history, 1):
-                role = "对方" if msg.get("role") == "user" else "你之前的建议"
-                content = msg.get("content", "")
-                context_str += f"{i}. {role}: {content}\n"
-            context_str += "\n---\n"
+        # 1. 按 token 预算压缩并格式化历史记录
+        context_str = self._history_section(history)
         
-        # 2. 获取基础 prompt
-        base_prompt = build_advisor_prompt(user_input, selected_styles)
-        
-        # 🔥 [新增] v10.0: 强制颜文字风格指令
-        style_enforcement = """
-
-=== 🎭 GALGAME EMOTION EXPRESSION RULES ===
-【强制规则】
-1. 【禁用标准Emoji】: 严格禁止使用 😀😭😡 等标准Unicode Emoji表情
-2. 【必用颜文字】: 必须使用日本颜文字(Kaomoji)来表达情感，例如：
-   - 甜蜜: (๑•́ ω •̀๑)、(≧▽≦)ﾉ、(๑˃ᴗ˂)و
-   - 伤心: (｡•́︿•̀｡)、(´；ω；`)、(´；︿；')
-   - 愤怒: (╯°□°）╯︵ ┻━┻、(´・ω・`)っ由紀ヲタ
-   - 害羞: (´▽｀)、(//∇//)、(´°̥̥̥̥̥̥̥̥ω°̥̥̥̥̥̥̥̥｀)
-3. 【保持沉浸】: 回复要完全沉浸在二次元Galgame角色设定中
-
-【示例】✓正确: "等你呢...(´°̥̥̥̥̥̥̥̥ω°̥̥̥̥̥̥̥̥｀)" | ✗错误: "等你呢...😭"
+        # 2. 静态前缀 + 预生成风格段落 + 历史 + 最新消息（颜文字规则已并入静态前缀）
+        return build_advisor_prompt(user_input, selected_styles, context_str)
+
+    def _intent_instructions(self, tactical_intent: Optional[str], multi: bool = True) -> str:
+        """用户指定战术意图时追加的战术指令（multi=False 用于只生成一个选项的 fan-out 调用）"""
+        if not tactical_intent or tactical_intent not in self.INTENT_TO_STRATEGY:
+            return ""
+        instructions = f"""
+
+# 🎯 用户指定战术意图: {tactical_intent}
+用户明确要求使用「{tactical_intent}」策略，请严格按照以下风格方向生成回复：
+
+- PRESSURE (高压威慑): 回复要强势、主导、带有轻微压迫感，让对方感受到你的气场
+- LURE (示弱诱敌): 回复要撒娇、示弱、卖萌，引发对方的保护欲和心软
+- PROBE (模糊试探): 回复要含糊、话里有话、不正面回应，让对方猜测你的真实意图
+- COMFORT (情绪安抚): 回复要共情、理解、温柔陪伴，让对方感受到被接纳和支持
+
+当前策略: {tactical_intent}
 """
-        base_prompt += style_enforcement
-        
-        # 3. 将 context 插入到 Input 之前
-        if context_str:
-            final_prompt = base_prompt.replace(
-                "# Input - The Other Person's Message", 
-                f"{context_str}# Input - The Other Person's Message (最新消息)"
-            )
+        if multi:
+            instructions += "所有3个选项都应该符合这个战术方向，但保持风格差异。\n"
         else:
-            final_prompt = base_prompt
-            
-        return final_prompt
+            instructions += "回复应该符合这个战术方向，同时保持所分配风格的特点。\n"
+        return instructions
+
+    # ==================== 消息构建 ====================
+
+    @timed("prompt_build", "execute")
+    def _build_execute_messages(self, user_input: str, analysis: Dict[str, Any], history: list) -> List[Dict[str, str]]:
+        """构建战术执行的 messages（随机抽取风格 + 执行 Prompt）"""
+        # 1. 随机抽取风格
+        selected_styles = get_random_styles(3)
+        style_names = [s['name'] for s in selected_styles]
+        logger.info(f"🎲 [Execute] Styles: {style_names} | Strategy: {analysis.get('strategy')}")
+        usage_strategy.set(str(analysis.get("strategy") or "none"))
+        
+        # 2. 构建执行 Prompt
+        context = prompt_assembler.compact(history, "execute")
+        system_prompt = build_execute_prompt(user_input, analysis, selected_styles, context.messages, context.summary)
+        prompt_assembler.record_prefix("execute", system_prompt)
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"基于{analysis.get('strategy')}策略，为以下消息生成3个回复选项：\n{user_input}"},
+        ]
+
+    @timed("prompt_build", "generate")
+    def _build_generate_messages(
+        self, 
+        user_input: str, 
+        history: list, 
+        tactical_intent: Optional[str] = None
+    ) -> List[Dict[str, str]]:
+        """构建「直出+热修」模式的 messages（带记忆 + 可选战术意图）"""
+        # 1. 随机抽取 3 种风格
+        selected_styles = get_random_styles(3)
+        style_names = [s['name'] for s in selected_styles]
+        
+        intent_str = f" | Intent: {tactical_intent}" if tactical_intent else " | Auto"
+        logger.info(f"🎲 [Generate] Styles: {style_names} | History: {len(history)}{intent_str}")
+        usage_strategy.set(self.INTENT_TO_STRATEGY.get(tactical_intent or "", "AUTO"))
+        
+        # 2. 构建带记忆的 Prompt
+        system_prompt = self._build_context_prompt(user_input, history, selected_styles)
+        
+        # 3. 如果有战术意图，添加战术指令
+        system_prompt += self._intent_instructions(tactical_intent)
+        
+        logger.info(f"⚡ [Request] Input: {user_input[:30]}...")
+        prompt_assembler.record_prefix("generate", system_prompt)
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"对方最新消息：{user_input}"},
+        ]
 
     # ==================== v8.0 新增：双阶段 API ====================
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_fixed(2),
-        retry=retry_if_exception_type((json.JSONDecodeError, ValidationError, Exception)),
-        reraise=True,
-    )
-    async def analyze_situation(self, user_input: str, history: list = []) -> Dict[str, Any]:
+    async def analyze_situation(
+        self, 
+        user_input: str, 
+        history: list = [], 
+        use_cache: bool = True,
+        fallback: bool = True
+    ) -> Dict[str, Any]:
         """
         v8.0 Phase 1: 态势感知 (Situation Awareness)
         分析对方情绪、意图和语境压迫感
@@ -171,23 +336,96 @@ class AIService:
         Args:
             user_input: 对方发来的消息（支持多行连发）
             history: 历史对话上下文
+            use_cache: 是否允许读取缓存（False 时强制请求 LLM，结果仍会写入缓存）
+            fallback: LLM 失败（重试用尽或不可重试）时是否返回兜底分析；
+                      批量评测传 False，失败直接抛出，避免把兜底结果当成真实分析记录下来
             
         Returns:
             SituationAnalysis 的字典形式
         """
-        self._refresh_config()
+        analysis, context, cache_key = self._lookup_analysis(user_input, history, use_cache)
+        if analysis is not None:
+            return analysis
         
+        # 相同输入的并发请求共享一次 LLM 调用（共享任务失败时抛出，是否兜底由各调用方决定）
+        try:
+            return await self.analyze_flight.do(
+                cache_key,
+                lambda: self._analyze_uncached(user_input, context, cache_key)
+            )
+        except AdmissionRejected:
+            raise
+        except Exception:
+            if not fallback:
+                raise
+            return self._fallback_analysis(user_input)
+
+    def _fallback_analysis(self, user_input: str) -> Dict[str, Any]:
+        """LLM 不可用时的兜底：优先用本地分类器的预测，没有模型时返回默认分析结果"""
+        is_burst, pressure_level = self._detect_burst_mode(user_input)
+        predicted = intent_classifier.fallback(user_input)
+        if predicted is not None:
+            logger.info(f"🧮 [Analyze] Fallback to classifier: {predicted['intent']}/{predicted['strategy']}")
+            return {**predicted, "burst_detected": is_burst, "pressure_level": pressure_level}
+        return {
+            "summary": "无法完成态势分析，请手动调整参数。",
+            "emotion_score": 0,
+            "intent": "UNKNOWN",
+            "strategy": "COMFORT",
+            "confidence": 0.5,
+            "burst_detected": is_burst,
+            "pressure_level": pressure_level
+        }
+
+    def _lookup_analysis(
+        self,
+        user_input: str,
+        history: list,
+        use_cache: bool
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[CompactHistory], Optional[str]]:
+        """
+        无需调用 LLM 的态势分析来源：本地规则 -> 离线分类器 -> 分析缓存（强制重新分析时全部跳过）
+
+        Returns:
+            (命中的分析或 None, 压缩后的历史, 分析缓存键)；规则 / 分类器命中时后两者为 None
+        """
+        # 0. 本地规则快速通道："晚安"、"哈哈哈" 这类输入无需调用 LLM
+        if use_cache:
+            local = local_analyzer.try_answer(user_input, has_history=bool(history))
+            if local is not None:
+                return local, None, None
+            # 离线训练的分类器足够确定时同样跳过 LLM
+            predicted = intent_classifier.try_answer(user_input)
+            if predicted is not None:
+                is_burst, pressure_level = self._detect_burst_mode(user_input)
+                return {**predicted, "burst_detected": is_burst, "pressure_level": pressure_level}, None, None
+
+        # 1. 按 token 预算压缩历史，并查询缓存
+        context = prompt_assembler.compact(history, "analyze")
+        cache_key = self._analyze_cache_key(user_input, context)
+        if not use_cache:
+            self.analyze_cache.bypasses += 1
+        elif self.analyze_cache.enabled:
+            cached = self.analyze_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"💾 [Analyze] Cache hit: {user_input[:30]}...")
+                return cached, context, cache_key
+        return None, context, cache_key
+
+    async def _analyze_uncached(self, user_input: str, context: CompactHistory, cache_key: str) -> Dict[str, Any]:
+        """调用 LLM 完成态势分析，成功结果写入缓存"""
         # 1. 预检测连发模式
         is_burst, pressure_level = self._detect_burst_mode(user_input)
         logger.info(f"🎯 [Analyze] Input: {user_input[:30]}... | Burst: {is_burst} | Pressure: {pressure_level}")
         
         # 2. 构建分析 Prompt
-        system_prompt = build_analyze_prompt(user_input, history)
+        with stage_timer("prompt_build", "analyze"):
+            system_prompt = build_analyze_prompt(user_input, context.messages, context.summary)
+        prompt_assembler.record_prefix("analyze", system_prompt)
         
-        try:
-            # 3. 调用 LLM 进行心理侧写
-            response = await self.client.chat.completions.create(
-                model=self.model,
+        async def attempt() -> Dict[str, Any]:
+            # 3. 调用 LLM 进行心理侧写（解析失败也会触发重试）
+            response = await self._create_completion(
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": f"请分析以下消息：\n{user_input}"},
@@ -196,9 +434,10 @@ class AIService:
                 max_tokens=512,   # 分析输出较短
                 response_format={"type": "json_object"},
             )
-            
-            raw_content = response.choices[0].message.content
-            result = self._parse_analysis_response(raw_content)
+            return self._parse_analysis_response(response.choices[0].message.content)
+
+        try:
+            result = await llm_retry.call(attempt, "analyze")
             
             # 4. 用预检测结果覆盖（更准确）
             result["burst_detected"] = is_burst
@@ -206,27 +445,20 @@ class AIService:
             
             logger.success(f"✅ [Analyze] Strategy: {result.get('strategy')} | Emotion: {result.get('emotion_score')}")
             
+            # 只缓存 LLM 成功返回的结果，兜底默认值不缓存
+            self.analyze_cache.set(cache_key, result)
+            if self.log_analyze_labels:
+                await db_service.run(db_service.append_analyze_label, user_input, result)
+            
             return result
             
+        except AdmissionRejected:
+            raise
         except Exception as exc:
+            # 重试用尽或不可重试：由 analyze_situation 决定兜底还是把错误交给调用方
             logger.error(f"❌ [Analyze] Failed: {exc}")
-            # 返回默认分析结果
-            return {
-                "summary": "无法完成态势分析，请手动调整参数。",
-                "emotion_score": 0,
-                "intent": "UNKNOWN",
-                "strategy": "COMFORT",
-                "confidence": 0.5,
-                "burst_detected": is_burst,
-                "pressure_level": pressure_level
-            }
+            raise
     
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_fixed(2),
-        retry=retry_if_exception_type((json.JSONDecodeError, ValidationError, Exception)),
-        reraise=True,
-    )
     async def execute_tactics(
         self, 
         user_input: str, 
@@ -245,31 +477,19 @@ class AIService:
         Returns:
             AdvisorResponse 的字典形式 (analysis, options)
         """
-        self._refresh_config()
-        
-        # 1. 随机抽取风格
-        selected_styles = get_random_styles(3)
-        style_names = [s['name'] for s in selected_styles]
-        logger.info(f"🎲 [Execute] Styles: {style_names} | Strategy: {analysis.get('strategy')}")
-        
-        # 2. 构建执行 Prompt
-        system_prompt = build_execute_prompt(user_input, analysis, selected_styles, history)
+        flight_key = make_cache_key("execute", normalize_text(user_input), analysis, history, self.model)
+        return await self.execute_flight.do(
+            flight_key,
+            lambda: self._execute_uncached(user_input, analysis, history)
+        )
+
+    async def _execute_uncached(self, user_input: str, analysis: Dict[str, Any], history: list) -> Dict[str, Any]:
+        """调用 LLM 生成回复选项"""
+        messages = self._build_execute_messages(user_input, analysis, history)
         
         try:
             # 3. 调用 LLM 生成回复
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"基于{analysis.get('strategy')}策略，为以下消息生成3个回复选项：\n{user_input}"},
-                ],
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                response_format={"type": "json_object"},
-            )
-            
-            raw_content = response.choices[0].message.content
-            result = self._parse_response(raw_content)
+            result = await llm_retry.call(lambda: self._complete_advisor(messages), "execute")
             
             logger.success(f"✅ [Execute] Generated {len(result.get('options', []))} options")
             
@@ -279,6 +499,73 @@ class AIService:
             logger.error(f"❌ [Execute] Failed: {exc}")
             raise exc
 
+    async def analyze_and_execute(
+        self,
+        user_input: str,
+        history: list = [],
+        use_cache: bool = True
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        单次调用模式：一个 Prompt 同时产出态势分析与 3 个回复选项（无人工修改环节的客户端使用）
+        分析已可由本地规则 / 分类器 / 缓存得到时，只需再调用一次战术执行
+        
+        Returns:
+            (SituationAnalysis 的字典形式, AdvisorResponse 的字典形式)
+        """
+        analysis, _, cache_key = self._lookup_analysis(user_input, history, use_cache)
+        if analysis is not None:
+            return analysis, await self.execute_tactics(user_input, analysis, history)
+
+        return await self.combined_flight.do(
+            make_cache_key("combined", cache_key),
+            lambda: self._combined_uncached(user_input, history, cache_key)
+        )
+
+    async def _combined_uncached(
+        self,
+        user_input: str,
+        history: list,
+        cache_key: str
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """调用 LLM 一次完成分析 + 执行，分析结果同样写入分析缓存"""
+        is_burst, pressure_level = self._detect_burst_mode(user_input)
+        selected_styles = get_random_styles(3)
+        logger.info(
+            f"🎯 [Combined] Input: {user_input[:30]}... | Styles: {[s['name'] for s in selected_styles]} "
+            f"| Burst: {is_burst}"
+        )
+        usage_strategy.set("AUTO")
+
+        with stage_timer("prompt_build", "combined"):
+            context = prompt_assembler.compact(history, "combined")
+            system_prompt = build_combined_prompt(
+                user_input, selected_styles, context.messages, context.summary, is_burst, pressure_level
+            )
+        prompt_assembler.record_prefix("combined", system_prompt)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"请分析以下消息并生成3个回复选项：\n{user_input}"},
+        ]
+
+        async def attempt() -> Tuple[Dict[str, Any], Dict[str, Any]]:
+            response = await self._create_completion(
+                messages=messages,
+                response_format={"type": "json_object"},
+            )
+            return self._parse_combined_response(response.choices[0].message.content)
+
+        analysis, result = await llm_retry.call(attempt, "combined")
+        analysis["burst_detected"] = is_burst
+        analysis["pressure_level"] = max(analysis.get("pressure_level", 0), pressure_level)
+        logger.success(
+            f"✅ [Combined] Strategy: {analysis.get('strategy')} | Options: {len(result.get('options', []))}"
+        )
+
+        self.analyze_cache.set(cache_key, analysis)
+        if self.log_analyze_labels:
+            await db_service.run(db_service.append_analyze_label, user_input, analysis)
+        return analysis, result
+
     # ==================== 原有接口（保持兼容） ====================
 
     # v8.1: 战术意图到策略的映射
@@ -289,12 +576,6 @@ class AIService:
         "COMFORT": "COMFORT",            # 情绪安抚 → 安抚
     }
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_fixed(2),
-        retry=retry_if_exception_type((json.JSONDecodeError, ValidationError, Exception)),
-        reraise=True,
-    )
     async def generate_response_with_intent(
         self, 
         user_input: str, 
@@ -312,55 +593,11 @@ class AIService:
         Returns:
             AdvisorResponse 的字典形式 (analysis, options)
         """
-        self._refresh_config()
-        
-        # 1. 随机抽取 3 种风格
-        selected_styles = get_random_styles(3)
-        style_names = [s['name'] for s in selected_styles]
-        
-        intent_str = f" | Intent: {tactical_intent}" if tactical_intent else " | Auto"
-        logger.info(f"🎲 [Generate] Styles: {style_names} | History: {len(history)}{intent_str}")
-        
-        # 2. 构建带记忆的 Prompt
-        system_prompt = self._build_context_prompt(user_input, history, selected_styles)
-        
-        # 3. 如果有战术意图，添加战术指令
-        if tactical_intent and tactical_intent in self.INTENT_TO_STRATEGY:
-            strategy = self.INTENT_TO_STRATEGY[tactical_intent]
-            intent_instructions = f"""
-
-# 🎯 用户指定战术意图: {tactical_intent}
-用户明确要求使用「{tactical_intent}」策略，请严格按照以下风格方向生成回复：
-
-- PRESSURE (高压威慑): 回复要强势、主导、带有轻微压迫感，让对方感受到你的气场
-- LURE (示弱诱敌): 回复要撒娇、示弱、卖萌，引发对方的保护欲和心软
-- PROBE (模糊试探): 回复要含糊、话里有话、不正面回应，让对方猜测你的真实意图
-- COMFORT (情绪安抚): 回复要共情、理解、温柔陪伴，让对方感受到被接纳和支持
-
-当前策略: {tactical_intent}
-所有3个选项都应该符合这个战术方向，但保持风格差异。
-"""
-            system_prompt += intent_instructions
-        
-        logger.info(f"⚡ [Request] Input: {user_input[:30]}...")
+        messages = self._build_generate_messages(user_input, history, tactical_intent)
 
         try:
-            # 4. 调用 LLM
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"对方最新消息：{user_input}"},
-                ],
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                response_format={"type": "json_object"},
-            )
-
-            raw_content = response.choices[0].message.content
-            
-            # 5. 解析结果
-            result = self._parse_response(raw_content)
+            # 4. 调用 LLM 并解析结果
+            result = await llm_retry.call(lambda: self._complete_advisor(messages), "generate")
             
             logger.success(f"✅ [LLM] Generation successful | Options: {len(result.get('options', []))}")
             
@@ -370,12 +607,6 @@ class AIService:
             logger.error(f"❌ [LLM] Failed: {exc}")
             raise exc
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_fixed(2),
-        retry=retry_if_exception_type((json.JSONDecodeError, ValidationError, Exception)),
-        reraise=True,
-    )
     async def generate_response(self, user_input: str, history: list = []) -> Dict[str, Any]:
         """
         生成恋爱军师建议（支持历史上下文）
@@ -387,36 +618,29 @@ class AIService:
         Returns:
             AdvisorResponse 的字典形式 (analysis, options)
         """
-        self._refresh_config()
-        
         # 1. 随机抽取 3 种风格
         selected_styles = get_random_styles(3)
         style_names = [s['name'] for s in selected_styles]
         logger.info(f"🎲 [Random] Styles: {style_names} | History Depth: {len(history)}")
+        usage_strategy.set("AUTO")
         
         # 2. 构建带记忆的 Prompt
-        system_prompt = self._build_context_prompt(user_input, history, selected_styles)
+        with stage_timer("prompt_build", "generate"):
+            system_prompt = self._build_context_prompt(user_input, history, selected_styles)
+        prompt_assembler.record_prefix("generate", system_prompt)
         
         logger.info(f"⚡ [Request] Input: {user_input[:30]}... | Context: {len(history)} messages")
 
         try:
-            # 3. 调用 LLM
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
+            # 3. 调用 LLM 并解析结果
+            result = await llm_retry.call(
+                lambda: self._complete_advisor([
                     {"role": "system", "content": system_prompt},
                     # 也可以选择把 user_input 放在这里再次强调，或者仅靠 system prompt
                     {"role": "user", "content": f"对方最新消息：{user_input}"},
-                ],
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                response_format={"type": "json_object"},
+                ]),
+                "chat"
             )
-
-            raw_content = response.choices[0].message.content
-            
-            # 4. 解析结果
-            result = self._parse_response(raw_content)
             
             logger.success(f"✅ [LLM] Generation successful | Options: {len(result.get('options', []))}")
             
@@ -426,5 +650,213 @@ class AIService:
             logger.error(f"❌ [LLM] Failed: {exc}")
             raise exc
 
+    # ==================== 按风格并行生成 (fan-out) ====================
+
+    async def _generate_one_style(
+        self,
+        user_input: str,
+        style: Dict[str, str],
+        context_section: str,
+        intent_section: str
+    ) -> Tuple[str, Dict[str, Any]]:
+        """为单个风格调用一次 LLM（独立重试），返回 (一句话分析, 选项)"""
+        with stage_timer("prompt_build", "fanout"):
+            system_prompt = build_single_style_prompt(user_input, style["key"], context_section) + intent_section
+        prompt_assembler.record_prefix("fanout", system_prompt)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"对方最新消息：{user_input}"},
+        ]
+
+        async def attempt() -> Tuple[str, Dict[str, Any]]:
+            response = await self._create_completion(
+                messages=messages,
+                response_format={"type": "json_object"},
+                max_tokens=self.fanout_max_tokens,
+            )
+            return self._parse_style_response(response.choices[0].message.content, style)
+
+        return await llm_retry.call(attempt, "fanout")
+
+    async def _fanout_events(
+        self,
+        user_input: str,
+        history: list = [],
+        tactical_intent: Optional[str] = None
+    ) -> AsyncIterator[StreamEvent]:
+        """
+        每个风格并发一次上游调用，按完成顺序产出事件
+
+        Yields:
+            ("analysis", str)：最先完成的风格附带的分析
+            ("option", dict)：每完成一个风格
+            ("done", dict)：全部完成，或软截止时间已到且至少有一个选项；
+                            含 partial 与 pendingStyles（尚未完成的风格代码）
+            ("late_option", dict)：done 之后、硬截止时间（请求截止时间）之前完成的风格
+        """
+        selected_styles = get_random_styles(3)
+        context_section = self._history_section(history)
+        intent_section = self._intent_instructions(tactical_intent, multi=False)
+        intent_str = f" | Intent: {tactical_intent}" if tactical_intent else " | Auto"
+        logger.info(
+            f"🎲 [Fanout] Styles: {[s['name'] for s in selected_styles]} | History: {len(history)}{intent_str}"
+        )
+        self.fanout_stats["requests"] += 1
+        usage_strategy.set(self.INTENT_TO_STRATEGY.get(tactical_intent or "", "AUTO"))
+
+        tasks = {
+            asyncio.create_task(self._generate_one_style(user_input, style, context_section, intent_section)): style
+            for style in selected_styles
+        }
+        loop = asyncio.get_running_loop()
+        remaining = remaining_time()
+        hard_at = None if remaining is None else loop.time() + remaining
+        soft_at = loop.time() + (self.fanout_deadline if remaining is None else min(self.fanout_deadline, remaining))
+
+        pending = set(tasks)
+        analysis: Optional[str] = None
+        options: List[Dict[str, Any]] = []
+        first_error: Optional[BaseException] = None
+        done_sent = False
+        try:
+            while pending:
+                # 已有选项时等到软截止时间；还没有任何选项或 done 已发出时等到硬截止时间
+                until_soft = bool(options) and not done_sent
+                wait_until = soft_at if until_soft else hard_at
+                timeout = None if wait_until is None else max(0.0, wait_until - loop.time())
+                finished, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in finished:
+                    style = tasks[task]
+                    try:
+                        summary, option = task.result()
+                    except Exception as exc:
+                        self.fanout_stats["failedStyles"] += 1
+                        first_error = first_error or exc
+                        logger.warning(f"⚠️ [Fanout] Style {style['key']} failed: {exc}")
+                        continue
+                    if done_sent:
+                        self.fanout_stats["lateOptions"] += 1
+                        yield "late_option", option
+                        continue
+                    if analysis is None and summary:
+                        analysis = summary
+                        yield "analysis", summary
+                    options.append(option)
+                    yield "option", option
+
+                if not done_sent and options and (not pending or loop.time() >= soft_at):
+                    done_sent = True
+                    partial = len(options) < len(selected_styles)
+                    if partial:
+                        self.fanout_stats["partial"] += 1
+                    logger.success(
+                        f"✅ [Fanout] Options: {len(options)}/{len(selected_styles)}"
+                        + (f" | Pending: {[tasks[t]['key'] for t in pending]}" if pending else "")
+                    )
+                    yield "done", {
+                        "analysis": analysis or "",
+                        "options": list(options),
+                        "partial": partial,
+                        "pendingStyles": [tasks[t]["key"] for t in pending],
+                    }
+                elif not finished and not until_soft:
+                    break  # 硬截止时间已到
+
+            if not done_sent:
+                if first_error is not None:
+                    raise first_error
+                raise DeadlineExceeded("fan-out generation produced no option before the deadline")
+        finally:
+            # 客户端断开 / 截止时间已到：取消仍在进行的上游调用
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.info(f"⏱️ [Fanout] Cancelled {len(pending)} unfinished style(s)")
+
+    async def generate_fanout(
+        self,
+        user_input: str,
+        history: list = [],
+        tactical_intent: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        fan-out 模式的非流式接口：软截止时间到达时只返回已完成的选项
+
+        Returns:
+            {"analysis", "options"(1~3 个), "partial", "pendingStyles"}
+        """
+        events = self._fanout_events(user_input, history, tactical_intent)
+        try:
+            async for event, data in events:
+                if event == "done":
+                    return data
+        finally:
+            await events.aclose()
+        raise RuntimeError("fan-out generation ended without result")
+
+    def stream_generate_fanout(
+        self,
+        user_input: str,
+        history: list = [],
+        tactical_intent: Optional[str] = None
+    ) -> AsyncIterator[StreamEvent]:
+        """generate_fanout 的流式版本：done 之后仍会推送迟到的选项 (late_option)"""
+        return self._fanout_events(user_input, history, tactical_intent)
+
+    # ==================== 流式接口 (SSE) ====================
+
+    async def _stream_advisor(self, messages: List[Dict[str, str]]) -> AsyncIterator[StreamEvent]:
+        """
+        以 stream=True 调用 LLM，边生成边产出事件
+
+        Yields:
+            ("analysis", str) / ("option", dict)，最后产出 ("done", AdvisorResponse 字典)
+        """
+        parser = AdvisorStreamParser()
+        # 只有建立流（首个 chunk 之前）可以重试，已推送的内容无法撤回
+        stream = await llm_retry.call(
+            lambda: self._create_completion(
+                messages=messages,
+                response_format={"type": "json_object"},
+                stream=True,
+            ),
+            "stream"
+        )
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    for event in parser.feed(delta):
+                        yield event
+        finally:
+            # 客户端断开时尽快释放上游连接
+            await stream.close()
+
+        # 完整结果仍走统一的解析与校验
+        result = self._parse_response(parser.buffer)
+        logger.success(f"✅ [Stream] Completed | Options: {len(result.get('options', []))}")
+        yield "done", result
+
+    def stream_execute_tactics(
+        self, 
+        user_input: str, 
+        analysis: Dict[str, Any], 
+        history: list = []
+    ) -> AsyncIterator[StreamEvent]:
+        """execute_tactics 的流式版本（不做整体重试，已推送的选项无法撤回）"""
+        return self._stream_advisor(self._build_execute_messages(user_input, analysis, history))
+
+    def stream_generate_response_with_intent(
+        self, 
+        user_input: str, 
+        history: list = [], 
+        tactical_intent: str = None
+    ) -> AsyncIterator[StreamEvent]:
+        """generate_response_with_intent 的流式版本"""
+        return self._stream_advisor(self._build_generate_messages(user_input, history, tactical_intent))
+
 # 创建全局实例
 ai_service = AIService()
\ No newline at end of file
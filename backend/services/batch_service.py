@@ -0,0 +1,122 @@
+"""
+Batch Service - 批量分析 / 战术执行
+评测与审核任务一次提交成百上千条消息，批内以有限并发执行，按完成顺序逐条产出结果。
+批量请求以最低优先级 (PRIORITY_BATCH) 进入共享的上游限流队列，不会挤占交互式请求。
+"""
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, TypeVar
+
+from loguru import logger
+
+from services.admission import PRIORITY_BATCH, AdmissionRejected, request_priority
+from services.retry_policy import UNKNOWN, DeadlineExceeded, classify_error, deadline_scope
+from services.token_usage import BudgetExceeded
+
+T = TypeVar("T")
+
+
+class BatchService:
+    """
+    有界并发的批处理执行器
+
+    - 固定数量的 worker 从待处理队列取任务，内存占用与批大小无关
+    - 每条结果完成即产出 (index, success, payload)，失败只影响该条
+    - 上游繁忙 (AdmissionRejected) 时按 retry_after 等待后重试，直到单条截止时间
+    - 调用方停止读取（客户端断开）时取消全部未完成的任务
+    """
+
+    def __init__(self) -> None:
+        self.default_concurrency = int(os.getenv("BATCH_CONCURRENCY", "4"))
+        self.max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+        # 单条的截止时间（含排队等待），批量任务对延迟不敏感
+        self.item_deadline = float(os.getenv("BATCH_ITEM_DEADLINE", "300"))
+        self.batches = 0
+        self.items = 0
+        self.failed = 0
+
+    async def _run_item(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """以批量优先级执行单条任务，上游繁忙时退避等待"""
+        request_priority.set(PRIORITY_BATCH)
+        with deadline_scope(self.item_deadline):
+            started = time.monotonic()
+            while True:
+                try:
+                    return await fn()
+                except AdmissionRejected as exc:
+                    if time.monotonic() - started + exc.retry_after >= self.item_deadline:
+                        raise
+                    await asyncio.sleep(exc.retry_after)
+
+    async def run(
+        self,
+        items: Sequence[Any],
+        worker: Callable[[Any], Awaitable[T]],
+        concurrency: Optional[int] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        并发执行 worker(item)，按完成顺序产出每条结果
+
+        Yields:
+            {"index": i, "success": True, "data": ...} 或
+            {"index": i, "success": False, "message": ..., "error_code": ...}
+        """
+        limit = max(1, min(concurrency or self.default_concurrency, self.max_concurrency, len(items)))
+        pending: "asyncio.Queue[int]" = asyncio.Queue()
+        for idx in range(len(items)):
+            pending.put_nowait(idx)
+        results: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+
+        async def _worker() -> None:
+            while True:
+                try:
+                    idx = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    data = await self._run_item(lambda: worker(items[idx]))
+                    results.put_nowait({"index": idx, "success": True, "data": data})
+                except Exception as exc:
+                    results.put_nowait({
+                        "index": idx,
+                        "success": False,
+                        "message": str(exc),
+                        "error_code": _error_code(exc),
+                    })
+
+        self.batches += 1
+        logger.info(f"📦 [Batch] Running {len(items)} items with concurrency {limit}")
+        workers: List["asyncio.Task[None]"] = [asyncio.create_task(_worker()) for _ in range(limit)]
+        try:
+            for _ in range(len(items)):
+                result = await results.get()
+                self.items += 1
+                if not result["success"]:
+                    self.failed += 1
+                yield result
+        finally:
+            for task in workers:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "failed": self.failed,
+        }
+
+
+def _error_code(exc: Exception) -> str:
+    if isinstance(exc, BudgetExceeded):
+        return "TOKEN_BUDGET_EXCEEDED"
+    if isinstance(exc, AdmissionRejected):
+        return "UPSTREAM_OVERLOADED"
+    if isinstance(exc, DeadlineExceeded):
+        return "DEADLINE_EXCEEDED"
+    # 重试用尽后的上游错误：UPSTREAM_TIMEOUT / UPSTREAM_SERVER / UPSTREAM_PARSE ...
+    kind = classify_error(exc)
+    return "ITEM_FAILED" if kind == UNKNOWN else f"UPSTREAM_{kind.upper()}"
+
+
+batch_service = BatchService()
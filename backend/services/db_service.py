@@ -1,36 +1,72 @@
-from tinydb import TinyDB, Query
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Callable, List, Optional, TypeVar
+import asyncio
+import contextvars
+import functools
 import time
 import os
 import json
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 
+from loguru import logger
+
+from services.db_storage import SQLiteStorage, Storage, TinyDBStorage, migrate_tinydb
+from services.metrics import timed
+
+T = TypeVar("T")
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
 class DatabaseService:
-    def __init__(self):
-        # Ensure the directory exists
-        # In backend/services/db_service.py, so we go up one level to backend/
-        db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "db.json")
-        self.db = TinyDB(db_path)
-        self.users = self.db.table('users')
-        self.sessions = self.db.table('dialogSessions')
-        self.selections = self.db.table('userSelections')
-        self.templates = self.db.table('templates')
-        self.feedback = self.db.table('feedback')
+    def __init__(self, db_path: Optional[str] = None, backend: Optional[str] = None):
+        """
+        backend 取 DB_BACKEND（sqlite / tinydb，默认 sqlite），db_path 默认 DB_PATH 或 backend/ 下的 sdp.db / db.json。
+        未显式传入 db_path 时，SQLite 首次启动若存在旧的 db.json（DB_LEGACY_JSON_PATH）会自动导入一次。
+        """
+        auto_migrate = db_path is None
+        backend = (backend or os.getenv("DB_BACKEND", "sqlite")).lower()
+        if backend == "tinydb":
+            db_path = db_path or os.getenv("DB_PATH") or os.path.join(_BACKEND_DIR, "db.json")
+            self.storage: Storage = TinyDBStorage(db_path)
+        elif backend == "sqlite":
+            db_path = db_path or os.getenv("DB_PATH") or os.path.join(_BACKEND_DIR, "sdp.db")
+            self.storage = SQLiteStorage(db_path)
+            legacy_path = os.getenv("DB_LEGACY_JSON_PATH", os.path.join(_BACKEND_DIR, "db.json"))
+            if auto_migrate and os.path.isfile(legacy_path) and not self.storage.get_meta("migrated_from"):
+                migrate_tinydb(legacy_path, self.storage)
+        else:
+            raise ValueError(f"Unsupported DB_BACKEND: {backend}")
+        self.db_path = db_path
+        # data/analyze_labels.jsonl 含原始聊天文本，超过上限后轮转，避免无限增长
+        self.analyze_label_max_bytes = int(float(os.getenv("ANALYZE_LABEL_MAX_MB", "20")) * 1024 * 1024)
+        logger.info(f"🗄️ [DB] Using {self.storage.name} storage at {db_path}")
+        # 所有来自事件循环的访问都排进同一个工作线程串行执行（TinyDB 不是线程安全的，SQLite 只允许一个写者）
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        在 DB 工作线程中执行 fn（本类的同步方法），不阻塞事件循环
+        用法：await db_service.run(db_service.create_selection, session_id=..., ...)
+        """
+        loop = asyncio.get_running_loop()
+        # 带上当前请求的 contextvar（阶段追踪、用量归属）
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, fn, *args, **kwargs))
 
     def get_or_create_user(self, user_id: str) -> Dict[str, Any]:
-        User = Query()
-        user = self.users.search(User.id == user_id)
+        user = self.storage.get_user(user_id)
         if user:
-            return user[0]
-        
+            return user
+
         new_user = {"id": user_id, "username": "Guest", "createdAt": int(time.time() * 1000)}
-        self.users.insert(new_user)
+        self.storage.insert_user(new_user)
         return new_user
 
+    @timed("db_write")
     def save_session(self, session_id: Optional[str], user_id: str, text: str, style: str,
                      options: List[str], scene_summary: str, messages: Optional[List[Dict[str, Any]]] = None) -> str:
-        Session = Query()
         session_id = session_id or f"session-{int(time.time() * 1000)}"
         now = int(time.time() * 1000)
         safe_messages: List[Dict[str, Any]] = []
@@ -39,7 +75,7 @@ class DatabaseService:
                 msg["id"] = f"msg-{uuid.uuid4().hex}"
             safe_messages.append(msg)
 
-        existing = self.sessions.search(Session.id == session_id)
+        existing = self.storage.get_session(session_id)
         payload = {
             "id": session_id,
             "userId": user_id,
@@ -51,32 +87,30 @@ class DatabaseService:
             "updatedAt": now,
         }
         if existing:
-            payload["createdAt"] = existing[0].get("createdAt", now)
-            self.sessions.update(payload, Session.id == session_id)
+            payload["createdAt"] = existing.get("createdAt", now)
+            self.storage.update_session(session_id, payload)
         else:
             payload["createdAt"] = now
-            self.sessions.insert(payload)
+            self.storage.insert_session(payload)
 
         return session_id
 
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
-        Session = Query()
-        result = self.sessions.search(Session.id == session_id)
-        return result[0] if result else None
+        return self.storage.get_session(session_id)
 
+    @timed("db_write")
     def delete_session_message(self, session_id: str, message_id: str) -> bool:
-        Session = Query()
-        result = self.sessions.search(Session.id == session_id)
-        if not result:
+        session = self.storage.get_session(session_id)
+        if not session:
             return False
-        session = result[0]
         messages = session.get("messages", [])
         if not messages:
             return False
         next_messages = [msg for msg in messages if msg.get("id") != message_id]
-        self.sessions.update({"messages": next_messages, "updatedAt": int(time.time() * 1000)}, Session.id == session_id)
+        self.storage.update_session(session_id, {"messages": next_messages, "updatedAt": int(time.time() * 1000)})
         return True
 
+    @timed("db_write")
     def create_selection(self, session_id: str, option_id: str, user_id: str) -> Dict[str, Any]:
         selection = {
             "sessionId": session_id,
@@ -84,9 +118,10 @@ class DatabaseService:
             "userId": user_id,
             "createdAt": int(time.time() * 1000)
         }
-        self.selections.insert(selection)
+        self.storage.insert_selection(selection)
         return selection
 
+    @timed("db_write")
     def append_to_training_set(self, scene: str, selected_option: str, style: str) -> None:
         """
         Append a training sample to data/lora_train.jsonl in Alpaca/ShareGPT style.
@@ -109,6 +144,7 @@ class DatabaseService:
         except Exception as e:
             print(f"Failed to append training sample: {e}")
 
+    @timed("db_write")
     def append_to_positive_set(self, scene: str, response: str) -> None:
         """
         Append a positive training sample to data/lora_train_positive.jsonl.
@@ -131,6 +167,35 @@ class DatabaseService:
         except Exception as e:
             print(f"Failed to append positive sample: {e}")
 
+    @timed("db_write")
+    def append_analyze_label(self, text: str, analysis: Dict[str, Any]) -> None:
+        """
+        Append an LLM situation analysis to data/analyze_labels.jsonl (training data for train_classifier.py).
+        The file is rotated to analyze_labels.jsonl.1 once it reaches ANALYZE_LABEL_MAX_MB (only one backup is kept).
+        """
+        try:
+            if not text or not analysis.get("intent") or analysis.get("intent") == "UNKNOWN":
+                return
+
+            label_entry = {
+                "text": text,
+                "intent": analysis.get("intent"),
+                "strategy": analysis.get("strategy"),
+                "emotion_score": analysis.get("emotion_score"),
+                "createdAt": int(time.time() * 1000)
+            }
+
+            log_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "analyze_labels.jsonl")
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            if os.path.exists(log_path) and os.path.getsize(log_path) >= self.analyze_label_max_bytes:
+                os.replace(log_path, log_path + ".1")
+
+            with open(log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(label_entry, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.warning(f"⚠️ [DB] Failed to append analyze label: {e}")
+
+    @timed("db_write")
     def record_feedback(self, message_id: str, feedback_type: str, training_weight: float,
                         scene: Optional[str] = None, response: Optional[str] = None,
                         user_id: Optional[str] = None) -> Dict[str, Any]:
@@ -143,22 +208,16 @@ class DatabaseService:
             "userId": user_id,
             "createdAt": int(time.time() * 1000)
         }
-        self.feedback.insert(entry)
+        self.storage.insert_feedback(entry)
         return entry
 
     def get_user_top_styles(self, user_id: str, top_n: int = 3) -> List[str]:
         """
         Return user's top N most frequent styles based on selection history.
         """
-        Selection = Query()
-        user_selections = self.selections.search(Selection.userId == user_id)
-
-        if not user_selections:
-            return []
-
         style_counter = Counter()
-        for sel in user_selections:
-            session = self.get_session(sel.get("sessionId", ""))
+        # 选择与会话一次取出（SQLite 为一条 JOIN），不再逐条查询会话
+        for sel, session in self.storage.user_selected_sessions(user_id):
             if not session:
                 continue
             options = session.get("generatedOptions", [])
@@ -172,12 +231,10 @@ class DatabaseService:
         return [style for style, _ in style_counter.most_common(top_n)]
 
     def get_user_stats(self, user_id: str) -> Dict[str, Any]:
-        Selection = Query()
-        user_selections = self.selections.search(Selection.userId == user_id)
-        
+        last = self.storage.last_user_selection(user_id)
         return {
-            "totalSelections": len(user_selections),
-            "lastSelection": user_selections[-1]["selectedOptionId"] if user_selections else None
+            "totalSelections": self.storage.count_user_selections(user_id),
+            "lastSelection": last["selectedOptionId"] if last else None
         }
 
 db_service = DatabaseService()
@@ -0,0 +1,348 @@
+"""
+DB Storage - DatabaseService 的可插拔存储层
+- TinyDBStorage：原有的单个 db.json（每次写入重写整个文件，查询全表扫描），保留用于兼容
+- SQLiteStorage：WAL 模式的 SQLite，会话 ID / userId / createdAt 建索引，语句参数化并由连接缓存预编译结果；
+  文档原样以 JSON 存在 doc 列，索引列只是从中提取的字段，字段增减不需要改表结构
+migrate_tinydb() 把旧 db.json 一次性导入 SQLite。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from tinydb import Query, TinyDB
+
+Doc = Dict[str, Any]
+
+# TinyDB 表名 -> SQLite 表名
+LEGACY_TABLES = {
+    "users": "users",
+    "dialogSessions": "sessions",
+    "userSelections": "selections",
+    "feedback": "feedback",
+}
+
+
+class Storage(ABC):
+    """DatabaseService 使用的数据访问接口（缺少任一方法的实现在实例化时即报错）"""
+
+    name = ""
+
+    @abstractmethod
+    def get_user(self, user_id: str) -> Optional[Doc]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_user(self, user: Doc) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_session(self, session_id: str) -> Optional[Doc]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_session(self, session: Doc) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_session(self, session_id: str, fields: Doc) -> None:
+        """把 fields 合并进已有会话"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_selection(self, selection: Doc) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_user_selections(self, user_id: Optional[str]) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def last_user_selection(self, user_id: Optional[str]) -> Optional[Doc]:
+        """该用户最后写入的一条选择"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def user_selected_sessions(self, user_id: str) -> List[Tuple[Doc, Optional[Doc]]]:
+        """该用户的每条选择及其对应的会话（会话不存在时为 None）"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_feedback(self, entry: Doc) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class TinyDBStorage(Storage):
+    name = "tinydb"
+
+    def __init__(self, path: str) -> None:
+        self.db = TinyDB(path)
+        self.users = self.db.table("users")
+        self.sessions = self.db.table("dialogSessions")
+        self.selections = self.db.table("userSelections")
+        self.feedback = self.db.table("feedback")
+
+    def get_user(self, user_id: str) -> Optional[Doc]:
+        result = self.users.search(Query().id == user_id)
+        return result[0] if result else None
+
+    def insert_user(self, user: Doc) -> None:
+        self.users.insert(user)
+
+    def get_session(self, session_id: str) -> Optional[Doc]:
+        result = self.sessions.search(Query().id == session_id)
+        return result[0] if result else None
+
+    def insert_session(self, session: Doc) -> None:
+        self.sessions.insert(session)
+
+    def update_session(self, session_id: str, fields: Doc) -> None:
+        self.sessions.update(fields, Query().id == session_id)
+
+    def insert_selection(self, selection: Doc) -> None:
+        self.selections.insert(selection)
+
+    def count_user_selections(self, user_id: Optional[str]) -> int:
+        return self.selections.count(Query().userId == user_id)
+
+    def last_user_selection(self, user_id: Optional[str]) -> Optional[Doc]:
+        result = self.selections.search(Query().userId == user_id)
+        return result[-1] if result else None
+
+    def user_selected_sessions(self, user_id: str) -> List[Tuple[Doc, Optional[Doc]]]:
+        return [
+            (sel, self.get_session(sel.get("sessionId", "")))
+            for sel in self.selections.search(Query().userId == user_id)
+        ]
+
+    def insert_feedback(self, entry: Doc) -> None:
+        self.feedback.insert(entry)
+
+    def close(self) -> None:
+        self.db.close()
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    created_at INTEGER,
+    updated_at INTEGER,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id, created_at);
+CREATE TABLE IF NOT EXISTS selections (
+    seq INTEGER PRIMARY KEY,
+    session_id TEXT,
+    user_id TEXT,
+    created_at INTEGER,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_selections_user ON selections (user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_selections_session ON selections (session_id);
+CREATE TABLE IF NOT EXISTS feedback (
+    seq INTEGER PRIMARY KEY,
+    message_id TEXT,
+    user_id TEXT,
+    created_at INTEGER,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_feedback_user ON feedback (user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_feedback_message ON feedback (message_id);
+"""
+
+# 固定的 SQL 文本 + ? 参数：sqlite3 按文本缓存预编译语句（cached_statements）
+_SQL_GET_USER = "SELECT doc FROM users WHERE id = ?"
+_SQL_INSERT_USER = "INSERT OR REPLACE INTO users (id, doc) VALUES (?, ?)"
+_SQL_GET_SESSION = "SELECT doc FROM sessions WHERE id = ?"
+_SQL_UPSERT_SESSION = (
+    "INSERT OR REPLACE INTO sessions (id, user_id, created_at, updated_at, doc) VALUES (?, ?, ?, ?, ?)"
+)
+_SQL_INSERT_SELECTION = "INSERT INTO selections (session_id, user_id, created_at, doc) VALUES (?, ?, ?, ?)"
+_SQL_COUNT_SELECTIONS = "SELECT COUNT(*) FROM selections WHERE user_id = ?"
+_SQL_LAST_SELECTION = "SELECT doc FROM selections WHERE user_id = ? ORDER BY seq DESC LIMIT 1"
+_SQL_USER_SELECTED_SESSIONS = (
+    "SELECT sel.doc, ses.doc FROM selections AS sel "
+    "LEFT JOIN sessions AS ses ON ses.id = sel.session_id "
+    "WHERE sel.user_id = ? ORDER BY sel.seq"
+)
+_SQL_INSERT_FEEDBACK = "INSERT INTO feedback (message_id, user_id, created_at, doc) VALUES (?, ?, ?, ?)"
+
+
+def _dumps(doc: Doc) -> str:
+    return json.dumps(doc, ensure_ascii=False)
+
+
+def _session_row(session: Doc) -> Tuple[Any, ...]:
+    return (session.get("id"), session.get("userId"), session.get("createdAt"), session.get("updatedAt"), _dumps(session))
+
+
+def _selection_row(selection: Doc) -> Tuple[Any, ...]:
+    return (selection.get("sessionId"), selection.get("userId"), selection.get("createdAt"), _dumps(selection))
+
+
+def _feedback_row(entry: Doc) -> Tuple[Any, ...]:
+    return (entry.get("messageId"), entry.get("userId"), entry.get("createdAt"), _dumps(entry))
+
+
+class SQLiteStorage(Storage):
+    """
+    SQLite (WAL) 存储
+
+    单个连接 + 锁：写入串行（SQLite 本身也只允许一个写者），WAL 下读取不阻塞写入；
+    DatabaseService.run 已经把事件循环的访问排进同一个工作线程，锁只防护其他线程的直接调用
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, cached_statements=128, isolation_level=None)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            # WAL 下 NORMAL 在断电时最多丢失最后一个事务，不会损坏数据库
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(f"PRAGMA busy_timeout={int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))}")
+            self.conn.executescript(_SCHEMA)
+
+    def _one(self, sql: str, params: Tuple[Any, ...]) -> Optional[Doc]:
+        with self.lock:
+            row = self.conn.execute(sql, params).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write(self, sql: str, params: Tuple[Any, ...]) -> None:
+        with self.lock:
+            self.conn.execute(sql, params)
+
+    def get_user(self, user_id: str) -> Optional[Doc]:
+        return self._one(_SQL_GET_USER, (user_id,))
+
+    def insert_user(self, user: Doc) -> None:
+        self._write(_SQL_INSERT_USER, (user.get("id"), _dumps(user)))
+
+    def get_session(self, session_id: str) -> Optional[Doc]:
+        return self._one(_SQL_GET_SESSION, (session_id,))
+
+    def insert_session(self, session: Doc) -> None:
+        self._write(_SQL_UPSERT_SESSION, _session_row(session))
+
+    def update_session(self, session_id: str, fields: Doc) -> None:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(_SQL_GET_SESSION, (session_id,)).fetchone()
+                if row:
+                    session = {**json.loads(row[0]), **fields}
+                    self.conn.execute(_SQL_UPSERT_SESSION, _session_row(session))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def insert_selection(self, selection: Doc) -> None:
+        self._write(_SQL_INSERT_SELECTION, _selection_row(selection))
+
+    def count_user_selections(self, user_id: Optional[str]) -> int:
+        with self.lock:
+            return self.conn.execute(_SQL_COUNT_SELECTIONS, (user_id,)).fetchone()[0]
+
+    def last_user_selection(self, user_id: Optional[str]) -> Optional[Doc]:
+        return self._one(_SQL_LAST_SELECTION, (user_id,))
+
+    def user_selected_sessions(self, user_id: str) -> List[Tuple[Doc, Optional[Doc]]]:
+        with self.lock:
+            rows = self.conn.execute(_SQL_USER_SELECTED_SESSIONS, (user_id,)).fetchall()
+        # 同一会话被多次选择时只解析一次
+        sessions: Dict[str, Optional[Doc]] = {}
+        result = []
+        for selection_doc, session_doc in rows:
+            selection = json.loads(selection_doc)
+            key = selection.get("sessionId") or ""
+            if key not in sessions:
+                sessions[key] = json.loads(session_doc) if session_doc else None
+            result.append((selection, sessions[key]))
+        return result
+
+    def insert_feedback(self, entry: Doc) -> None:
+        self._write(_SQL_INSERT_FEEDBACK, _feedback_row(entry))
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+def migrate_tinydb(json_path: str, storage: SQLiteStorage, force: bool = False) -> Dict[str, int]:
+    """
+    把 TinyDB 的 db.json 一次性导入 SQLite（单个事务）
+
+    已导入过（meta.migrated_from 存在）时跳过，force=True 时重新导入（按主键覆盖，选择 / 反馈会重复追加）
+
+    Returns:
+        各表导入的文档数
+    """
+    if not force and storage.get_meta("migrated_from"):
+        logger.info(f"🗄️ [DB] {json_path} already migrated, skipping")
+        return {}
+    with open(json_path, "r", encoding="utf-8") as f:
+        raw = f.read().strip()
+    data = json.loads(raw) if raw else {}
+
+    def docs(table: str) -> List[Doc]:
+        # TinyDB 以字符串形式的自增 doc_id 为键，按 doc_id 排序即写入顺序
+        rows = data.get(table) or {}
+        return [rows[k] for k in sorted(rows, key=lambda k: int(k) if str(k).isdigit() else 0)]
+
+    counts: Dict[str, int] = {}
+    start = time.perf_counter()
+    with storage.lock:
+        conn = storage.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            users = docs("users")
+            conn.executemany(_SQL_INSERT_USER, [(u.get("id"), _dumps(u)) for u in users])
+            sessions = docs("dialogSessions")
+            conn.executemany(_SQL_UPSERT_SESSION, [_session_row(s) for s in sessions])
+            selections = docs("userSelections")
+            conn.executemany(_SQL_INSERT_SELECTION, [_selection_row(s) for s in selections])
+            feedback = docs("feedback")
+            conn.executemany(_SQL_INSERT_FEEDBACK, [_feedback_row(e) for e in feedback])
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                ("migrated_from", f"{os.path.abspath(json_path)} @ {int(time.time())}"),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    for legacy, table in LEGACY_TABLES.items():
+        counts[table] = len(data.get(legacy) or {})
+
+    skipped = {k: len(v) for k, v in data.items() if k not in LEGACY_TABLES and v}
+    if skipped:
+        logger.warning(f"⚠️ [DB] Tables without a SQLite counterpart were not migrated: {skipped}")
+    logger.success(
+        f"🗄️ [DB] Migrated {json_path} -> {storage.path} in {(time.perf_counter() - start) * 1000:.0f}ms | {counts}"
+    )
+    return counts
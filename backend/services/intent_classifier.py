@@ -0,0 +1,246 @@
+"""
+Intent Classifier - 轻量级意图 / 策略 / 情绪分类器
+字符 n-gram 特征 + 多项式朴素贝叶斯（NumPy 向量化），纯 CPU。
+由 train_classifier.py 从 LLM 态势分析的历史结果（data/analyze_labels.jsonl）离线训练，
+启动时加载一次序列化产物；在线用于 analyze_situation 的前置过滤与上游不可用时的兜底。
+"""
+import json
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(__file__))
+DEFAULT_MODEL_PATH = os.path.join(_BACKEND_DIR, "data", "intent_classifier.npz")
+LABELS_PATH = os.path.join(_BACKEND_DIR, "data", "analyze_labels.jsonl")
+
+# n-gram 范围与哈希桶数量（训练与推理必须一致，写入产物元数据中校验）
+NGRAM_RANGE = (1, 3)
+HASH_BUCKETS = 1 << 20
+
+# 分类头：即结果字段名，也是产物中各数组名的前缀
+HEADS = ("intent", "strategy", "emotion_score")
+
+INTENT_NAMES = {
+    "TESTING_BOUNDARIES": "试探边界",
+    "SEEKING_ATTENTION": "求关注",
+    "EXPRESSING_AFFECTION": "表达好感",
+    "VENTING_EMOTION": "发泄情绪",
+    "CASUAL_CHAT": "闲聊",
+    "FLIRTING": "调情",
+    "COMPLAINING": "抱怨",
+    "JEALOUS": "吃醋",
+    "COLD_WAR": "冷战",
+    "UNKNOWN": "意图不明",
+}
+STRATEGY_NAMES = {
+    "OFFENSIVE_FLIRT": "主动进攻调情",
+    "DEFENSIVE_FLIRT": "防守式调情",
+    "COMFORT": "安抚",
+    "FREEZE": "冷处理",
+    "PUSH_PULL": "推拉",
+    "DIRECT": "直球表达",
+    "PLAYFUL": "俏皮玩闹",
+    "IGNORE": "战略性忽略",
+    "APOLOGIZE": "认错道歉",
+    "ESCALATE": "升级关系",
+}
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def extract_features(text: str) -> np.ndarray:
+    """
+    文本 -> 字符 n-gram 哈希桶编号（可重复，重复次数即词频）
+    使用 crc32 而不是 hash()，保证跨进程稳定
+    """
+    text = _SPACE_RE.sub(" ", text.strip().lower())
+    padded = f"^{text}$"
+    low, high = NGRAM_RANGE
+    ids: List[int] = []
+    for n in range(low, high + 1):
+        for i in range(len(padded) - n + 1):
+            ids.append(zlib.crc32(padded[i:i + n].encode("utf-8")) % HASH_BUCKETS)
+    return np.asarray(ids, dtype=np.int64)
+
+
+class NaiveBayesHead:
+    """单个分类头：只保存训练集中出现过的特征列，产物体积与数据量成正比"""
+
+    def __init__(self, classes: List[str], features: np.ndarray, log_prior: np.ndarray, log_prob: np.ndarray) -> None:
+        self.classes = classes
+        self.features = features      # (V,) 升序的哈希桶编号
+        self.log_prior = log_prior    # (C,)
+        self.log_prob = log_prob      # (C, V)
+
+    @classmethod
+    def fit(cls, docs: List[np.ndarray], labels: List[str], alpha: float = 0.5) -> "NaiveBayesHead":
+        classes = sorted(set(labels))
+        class_index = {name: i for i, name in enumerate(classes)}
+        features = np.unique(np.concatenate(docs)) if docs else np.zeros(0, dtype=np.int64)
+
+        counts = np.zeros((len(classes), len(features)), dtype=np.float64)
+        rows = np.concatenate([np.full(len(doc), class_index[label]) for doc, label in zip(docs, labels)])
+        cols = np.searchsorted(features, np.concatenate(docs))
+        np.add.at(counts, (rows, cols), 1.0)
+
+        class_counts = np.bincount([class_index[label] for label in labels], minlength=len(classes))
+        log_prior = np.log(class_counts / class_counts.sum())
+        smoothed = counts + alpha
+        log_prob = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+        return cls(classes, features, log_prior.astype(np.float32), log_prob.astype(np.float32))
+
+    def known(self, doc: np.ndarray) -> np.ndarray:
+        """doc 中训练时见过的特征在 features 中的列号"""
+        if not len(self.features) or not len(doc):
+            return np.zeros(0, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.features, doc), len(self.features) - 1)
+        return idx[self.features[idx] == doc]
+
+    def predict_proba(self, doc: np.ndarray) -> np.ndarray:
+        """返回各类别的后验概率 (C,)；未见过的特征直接忽略"""
+        scores = self.log_prior + self.log_prob[:, self.known(doc)].sum(axis=1)
+        scores = scores - scores.max()
+        probs = np.exp(scores)
+        return probs / probs.sum()
+
+
+class IntentClassifier:
+    """
+    意图 / 策略 / 情绪三头分类器
+
+    - predict: 返回完整的 SituationAnalysis 字典与置信度（三个头中最低的后验概率）
+    - 产物不存在时 ready=False，调用方退回原有逻辑
+    """
+
+    def __init__(self, model_path: Optional[str] = None, autoload: bool = True) -> None:
+        self.model_path = model_path or os.getenv("ANALYZE_CLASSIFIER_PATH", DEFAULT_MODEL_PATH)
+        self.enabled = os.getenv("ANALYZE_CLASSIFIER_ENABLED", "true").lower() != "false"
+        # 前置过滤：置信度达到该值时不再调用 LLM
+        self.threshold = float(os.getenv("ANALYZE_CLASSIFIER_THRESHOLD", "0.9"))
+        self.min_coverage = float(os.getenv("ANALYZE_CLASSIFIER_MIN_COVERAGE", "0.6"))
+        self.heads: Dict[str, NaiveBayesHead] = {}
+        self.meta: Dict[str, Any] = {}
+        self.calls = 0
+        self.hits = 0
+        self.fallbacks = 0
+        self.total_time = 0.0
+        if self.enabled and autoload:
+            self.load()
+
+    @property
+    def ready(self) -> bool:
+        return self.enabled and len(self.heads) == len(HEADS)
+
+    def load(self) -> bool:
+        """加载序列化产物（启动时调用一次；重新训练后可再次调用）"""
+        if not os.path.exists(self.model_path):
+            logger.info(f"ℹ️ [Classifier] No model at {self.model_path}, classifier disabled")
+            return False
+        try:
+            with np.load(self.model_path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("hash_buckets") != HASH_BUCKETS or tuple(meta.get("ngram_range", ())) != NGRAM_RANGE:
+                    logger.warning("⚠️ [Classifier] Model was trained with different features, ignored")
+                    return False
+                self.heads = {
+                    head: NaiveBayesHead(
+                        classes=meta["classes"][head],
+                        features=data[f"{head}_features"],
+                        log_prior=data[f"{head}_log_prior"],
+                        log_prob=data[f"{head}_log_prob"],
+                    )
+                    for head in HEADS
+                }
+                self.meta = meta
+        except Exception as e:
+            logger.error(f"❌ [Classifier] Failed to load {self.model_path}: {e}")
+            self.heads = {}
+            return False
+        logger.success(
+            f"✅ [Classifier] Loaded model ({meta.get('samples')} samples, "
+            f"holdout acc {meta.get('holdout_accuracy')})"
+        )
+        return True
+
+    def save(self, path: str, meta: Dict[str, Any]) -> None:
+        arrays: Dict[str, Any] = {}
+        classes = {}
+        for head, model in self.heads.items():
+            classes[head] = model.classes
+            arrays[f"{head}_features"] = model.features
+            arrays[f"{head}_log_prior"] = model.log_prior
+            arrays[f"{head}_log_prob"] = model.log_prob
+        meta = {**meta, "classes": classes, "hash_buckets": HASH_BUCKETS, "ngram_range": list(NGRAM_RANGE)}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path, meta=np.array(json.dumps(meta, ensure_ascii=False)), **arrays)
+
+    def predict(self, text: str) -> Tuple[Optional[Dict[str, Any]], float, float]:
+        """
+        Returns:
+            (SituationAnalysis 字典（不含连发特征）, 置信度, 特征覆盖率)；模型未就绪时返回 (None, 0.0, 0.0)
+            置信度取三个头中最低的后验概率；覆盖率为训练时见过的 n-gram 占比
+        """
+        if not self.ready or not text.strip():
+            return None, 0.0, 0.0
+        start = time.perf_counter()
+        doc = extract_features(text)
+        coverage = len(self.heads["intent"].known(doc)) / len(doc)
+        result: Dict[str, Any] = {}
+        confidence = 1.0
+        for head, model in self.heads.items():
+            probs = model.predict_proba(doc)
+            best = int(probs.argmax())
+            result[head] = model.classes[best]
+            confidence = min(confidence, float(probs[best]))
+        self.total_time += time.perf_counter() - start
+
+        result["emotion_score"] = int(result["emotion_score"])
+        intent_name = INTENT_NAMES.get(result["intent"], result["intent"])
+        strategy_name = STRATEGY_NAMES.get(result["strategy"], result["strategy"])
+        result["summary"] = f"对方大概率在{intent_name}，建议{strategy_name}"
+        result["confidence"] = round(confidence * coverage, 3)
+        return result, confidence, coverage
+
+    def try_answer(self, text: str) -> Optional[Dict[str, Any]]:
+        """前置过滤：置信度与覆盖率都达标时返回预测结果，否则返回 None（交给 LLM）"""
+        if not self.ready:
+            return None
+        self.calls += 1
+        result, confidence, coverage = self.predict(text)
+        # 朴素贝叶斯对见过的少量特征往往过度自信，覆盖率不足说明输入超出了训练分布
+        if result is None or confidence < self.threshold or coverage < self.min_coverage:
+            return None
+        self.hits += 1
+        logger.info(f"🧮 [Classifier] Hit ({confidence:.2f}, coverage {coverage:.2f}): {text[:30]} -> {result['intent']}/{result['strategy']}")
+        return result
+
+    def fallback(self, text: str) -> Optional[Dict[str, Any]]:
+        """上游不可用时的兜底预测（不看阈值）"""
+        result, _, _ = self.predict(text)
+        if result is not None:
+            self.fallbacks += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        predictions = self.calls + self.fallbacks
+        return {
+            "ready": self.ready,
+            "threshold": self.threshold,
+            "minCoverage": self.min_coverage,
+            "samples": self.meta.get("samples"),
+            "holdoutAccuracy": self.meta.get("holdout_accuracy"),
+            "trainedAt": self.meta.get("trained_at"),
+            "calls": self.calls,
+            "hits": self.hits,
+            "hitRate": round(self.hits / self.calls, 3) if self.calls else 0.0,
+            "fallbacks": self.fallbacks,
+            "avgMicros": round(self.total_time / predictions * 1e6, 1) if predictions else 0.0,
+        }
+
+
+intent_classifier = IntentClassifier()
@@ -0,0 +1,308 @@
+"""
+JSON Repair - 容错的 LLM JSON 输出解析
+从模型输出中提取第一个完整的 JSON 对象，并修复常见缺陷：
+代码块围栏 / 前后多余文字、尾随逗号、注释、单引号、全角标点、输出被截断（截断在字符串中途的成员整个丢弃）。
+对象完整却需要丢弃成员才能解析时（如字符串内未转义的引号）按修复失败处理，交给重试。
+修复成功即可省去一次完整的重新生成；只有修复失败时才交给重试策略。
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from services.metrics import stage_timer
+
+# 字符串外出现时按 ASCII 结构字符处理的全角标点
+_FULLWIDTH = {
+    "｛": "{", "｝": "}", "［": "[", "］": "]",
+    "：": ":", "，": ",", "＂": '"',
+}
+# 字符串外出现时视为字符串定界符的引号 -> 对应的结束引号
+_OPEN_QUOTES = {'"': '"', "'": "'", "“": "”", "‘": "’"}
+_CLOSERS = {"{": "}", "[": "]"}
+
+# 截断修复时最多回退的成员数
+_MAX_TRIMS = 8
+# "key": 片段
+_KEY_RE = re.compile(r'"[^"\n]{1,64}"\s*:')
+
+
+class JSONRepairError(json.JSONDecodeError):
+    """修复后仍无法解析（继承 JSONDecodeError，重试策略会按解析失败处理）"""
+
+
+def _closes_string(text: str, pos: int) -> bool:
+    """引号后的第一个非空白字符是结构字符（或已到结尾）时才视为字符串结束"""
+    rest = text[pos:].lstrip()
+    return not rest or rest[0] in ",:}]，：｝］"
+
+
+def _normalize(text: str) -> Tuple[str, List[str], bool, bool, int]:
+    """
+    逐字符扫描并规范化 JSON 文本（扫描到第一个对象闭合为止）
+
+    - 字符串外：全角标点转 ASCII，// 与 /* */ 注释删除，单引号 / 中文引号字符串改为双引号
+    - 字符串内：不像结束引号的双引号（后面不是 , : } ]）补转义，裸换行转为 \\n
+
+    Returns:
+        (规范化后的文本, 未闭合的括号栈, 是否在字符串中途截断, 是否改动过内容, 扫描结束位置)
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    quote: Optional[str] = None  # 当前字符串的结束引号
+    changed = False
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if quote is not None:
+            if ch == "\\" and i + 1 < n:
+                if quote != '"' and text[i + 1] == "'":
+                    out.append("'")  # JSON 中 \\' 不是合法转义
+                    changed = True
+                else:
+                    out.append(text[i:i + 2])
+                i += 2
+                continue
+            if ch == quote and _closes_string(text, i + 1):
+                out.append('"')
+                changed = changed or ch != '"'
+                quote = None
+            elif ch == '"':
+                out.append('\\"')
+                changed = True
+            elif ch == "\n":
+                out.append("\\n")
+                changed = True
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        mapped = _FULLWIDTH.get(ch, ch)
+        changed = changed or mapped != ch
+        ch = mapped
+        if ch in _OPEN_QUOTES:
+            quote = _OPEN_QUOTES[ch]
+            changed = changed or ch != '"'
+            out.append('"')
+        elif ch == "/" and text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end < 0 else end
+            changed = True
+            continue
+        elif ch == "/" and text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+            changed = True
+            continue
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+            out.append(ch)
+        elif ch in "}]":
+            if stack and stack[-1] == ch:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                # 第一个对象已闭合，忽略后面的内容
+                return "".join(out), stack, False, changed, i + 1
+        else:
+            out.append(ch)
+        i += 1
+    return "".join(out), stack, quote is not None, changed, n
+
+
+def _has_prose(text: str) -> bool:
+    """对象之外除了代码块围栏与空白之外是否还有其他文字"""
+    return bool(text.replace("```json", "").replace("```", "").strip())
+
+
+def _is_json_leftover(text: str) -> bool:
+    """
+    对象闭合后剩下的内容看起来仍是 JSON 的一部分（以 , : } ] 或引号开头、或含 "key": 片段）：
+    说明字符串内未转义的引号被误判为结束引号、对象被提前闭合，后面的成员会被静默丢掉
+    """
+    rest = text.replace("```json", "").replace("```", "").strip()
+    return bool(rest) and (rest[0] in ',:}]"\'' or _KEY_RE.search(rest) is not None)
+
+
+def _strip_trailing_commas(text: str) -> str:
+    """删除 } / ] 之前的尾随逗号（字符串内的逗号不受影响）"""
+    out: List[str] = []
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "}]":
+            while out and out[-1] in " \t\r\n":
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        out.append(ch)
+    return "".join(out)
+
+
+def _close(text: str, stack: List[str]) -> str:
+    """为被截断的文本补齐括号；悬空的 key / 冒号 / 逗号先去掉"""
+    body = text.rstrip()
+    if body.endswith(":"):
+        body += " null"
+    body = body.rstrip(",")
+    return _strip_trailing_commas(body + "".join(reversed(stack)))
+
+
+def _trim_last_member(text: str) -> Optional[str]:
+    """回退到最后一个结构逗号 / 开括号之前，丢弃最后一个不完整的成员"""
+    in_string = False
+    escaped = False
+    cut = -1
+    for idx, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == ",":
+            cut = idx
+        elif ch in "{[":
+            cut = idx + 1
+    if cut <= 0 or cut >= len(text):
+        return None
+    return text[:cut]
+
+
+def repair_json(raw: str) -> Tuple[Any, bool]:
+    """
+    解析 LLM 输出中的第一个 JSON 对象
+
+    Returns:
+        (解析结果, 是否经过了修复)
+
+    Raises:
+        JSONRepairError: 修复后仍无法解析
+    """
+    if raw is None:
+        raise JSONRepairError("empty response", "", 0)
+
+    start = raw.find("{")
+    if start < 0:
+        start = raw.find("｛")
+    if start < 0:
+        raise JSONRepairError("no JSON object found", raw, 0)
+
+    candidate = raw[start:]
+    normalized, stack, in_string, changed, end = _normalize(candidate)
+    if _is_json_leftover(candidate[end:]):
+        raise JSONRepairError("object closed early, members would be dropped", raw, start + end)
+
+    # 最常见的情况：只是多了代码块围栏（不算修复）或前后说明文字
+    try:
+        value = json.loads(normalized)
+        return value, changed or _has_prose(raw[:start]) or _has_prose(candidate[end:])
+    except json.JSONDecodeError:
+        pass
+
+    if not stack and not in_string:
+        # 对象完整但仍无法解析：只尝试删除尾随逗号；回退成员只用于输出被截断的情况，
+        # 否则会把无法理解的内容连同后面的成员一起丢掉，并当作修复成功
+        try:
+            return json.loads(_strip_trailing_commas(normalized)), True
+        except json.JSONDecodeError:
+            raise JSONRepairError("unrepairable JSON", raw, start) from None
+
+    text = normalized
+    for _ in range(_MAX_TRIMS):
+        # 截断在字符串中途时不补引号：半句话会被当成完整的值，直接丢弃该成员
+        if not in_string:
+            fixed = _close(text, stack) if stack else _strip_trailing_commas(text)
+            try:
+                return json.loads(fixed), True
+            except json.JSONDecodeError:
+                pass
+        trimmed = _trim_last_member(text.rstrip().rstrip(","))
+        if trimmed is None:
+            break
+        text = trimmed
+        _, stack, in_string, _, _ = _normalize(text)
+
+    raise JSONRepairError("unrepairable JSON", raw, start)
+
+
+def clamp_int(value: Any, low: int, high: int, default: int = 0) -> int:
+    """把 "+2" / 2.6 / 5 之类的值转换为 [low, high] 内的整数"""
+    try:
+        number = int(round(float(str(value).strip().lstrip("+"))))
+    except (TypeError, ValueError):
+        return default
+    return max(low, min(high, number))
+
+
+def clamp_float(value: Any, low: float, high: float, default: float) -> float:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    return max(low, min(high, number))
+
+
+class JSONRepairStats:
+    """按用途统计：直接解析成功 / 修复后成功 / 修复失败（需要重试）"""
+
+    def __init__(self) -> None:
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, label: str, outcome: str) -> None:
+        counts = self._counts.setdefault(label, {"clean": 0, "repaired": 0, "failed": 0})
+        counts[outcome] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for label, counts in self._counts.items():
+            total = sum(counts.values())
+            result[label] = {
+                **counts,
+                # 每次修复成功即省去一次完整的重新生成
+                "savedRoundTrips": counts["repaired"],
+                "repairRate": round(counts["repaired"] / total, 3) if total else 0.0,
+            }
+        return result
+
+
+json_repair_stats = JSONRepairStats()
+
+
+def parse_llm_json(raw: str, label: str) -> Dict[str, Any]:
+    """
+    repair_json + 统计；结果必须是 JSON 对象
+
+    Raises:
+        JSONRepairError: 无法修复（由调用方的重试策略决定是否重新生成）
+    """
+    try:
+        with stage_timer("parse", label):
+            value, repaired = repair_json(raw)
+    except JSONRepairError:
+        json_repair_stats.record(label, "failed")
+        logger.warning(f"⚠️ [JSONRepair:{label}] Unrepairable output: {(raw or '')[:80]!r}")
+        raise
+    if not isinstance(value, dict):
+        json_repair_stats.record(label, "failed")
+        raise JSONRepairError("top-level JSON is not an object", raw or "", 0)
+    json_repair_stats.record(label, "repaired" if repaired else "clean")
+    if repaired:
+        logger.info(f"🩹 [JSONRepair:{label}] Repaired malformed output")
+    return value
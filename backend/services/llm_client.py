@@ -0,0 +1,273 @@
+"""
+LLM Client Pool - 共享长连接客户端 + 配置热重载
+所有服务共用同一组 AsyncOpenAI 客户端（连接池 + keep-alive），
+配置只在 .env 变化或调用 reload 接口时重新加载，并原子替换。
+"""
+import asyncio
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+import httpx
+from dotenv import find_dotenv, load_dotenv
+from loguru import logger
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENV_PATH = os.getenv("SDP_ENV_FILE") or find_dotenv() or os.path.join(BACKEND_DIR, ".env")
+
+DEFAULT_BASE_URL = "https://api.siliconflow.cn/v1"
+
+
+@dataclass(frozen=True)
+class LLMProfile:
+    """单个 LLM 配置快照（不可变，热重载时整体替换）"""
+    name: str
+    api_key: str
+    base_url: str
+    model: str
+    max_tokens: int
+    temperature: float
+    weight: float = 1.0
+
+    @property
+    def connection_key(self) -> Tuple[str, str]:
+        """相同 base_url + key 的配置共享同一个连接池"""
+        return (self.base_url, self.api_key)
+
+
+def load_backend_profiles(default: LLMProfile) -> List[LLMProfile]:
+    """
+    解析 AI_BACKENDS（JSON 数组）为多后端配置，未设置时只有默认后端
+
+    AI_BACKENDS='[{"name": "sf", "base_url": "...", "api_key": "...", "model": "...", "weight": 2},
+                  {"name": "backup", "base_url": "http://127.0.0.1:9001/v1"}]'
+
+    第一个条目作为主配置 "chat"，其余命名为 "chat@<name>"；缺省字段沿用 AI_* 配置。
+    """
+    raw = os.getenv("AI_BACKENDS", "").strip()
+    if not raw:
+        return [default]
+
+    profiles = []
+    for idx, entry in enumerate(json.loads(raw)):
+        name = "chat" if idx == 0 else f"chat@{entry.get('name', idx)}"
+        profiles.append(LLMProfile(
+            name=name,
+            api_key=entry.get("api_key", default.api_key),
+            base_url=entry.get("base_url", default.base_url),
+            model=entry.get("model", default.model),
+            max_tokens=int(entry.get("max_tokens", default.max_tokens)),
+            temperature=float(entry.get("temperature", default.temperature)),
+            weight=float(entry.get("weight", 1.0)),
+        ))
+    return profiles or [default]
+
+
+def load_profiles() -> Dict[str, LLMProfile]:
+    """从当前环境变量构建所有 LLM 配置"""
+    api_key = os.getenv("SILICONFLOW_API_KEY", "")
+    base_url = os.getenv("AI_BASE_URL", DEFAULT_BASE_URL)
+
+    chat = LLMProfile(
+        name="chat",
+        api_key=api_key,
+        base_url=base_url,
+        # 推荐使用指令遵循能力强的模型
+        model=os.getenv("AI_MODEL", "Qwen/Qwen2.5-72B-Instruct"),
+        max_tokens=int(os.getenv("AI_MAX_TOKENS", "2048")),
+        temperature=float(os.getenv("AI_TEMPERATURE", "0.95")),  # 提高创造性
+    )
+
+    return {
+        **{p.name: p for p in load_backend_profiles(chat)},
+        "vision": LLMProfile(
+            name="vision",
+            # 优先使用专门的视觉 API，否则复用主 API
+            api_key=os.getenv("VISION_API_KEY") or api_key,
+            base_url=os.getenv("VISION_BASE_URL", base_url),
+            # 视觉模型配置 - 推荐 Qwen-VL
+            model=os.getenv("VISION_MODEL", "Qwen/Qwen2-VL-72B-Instruct"),
+            max_tokens=int(os.getenv("VISION_MAX_TOKENS", "2048")),
+            temperature=float(os.getenv("VISION_TEMPERATURE", "0.7")),
+        ),
+    }
+
+
+class LLMClientPool:
+    """
+    长生命周期的 LLM 客户端池
+
+    - 每个 (base_url, api_key) 只建一个 AsyncOpenAI，复用 TCP/TLS 连接
+    - 配置快照 + 客户端作为一个整体原子替换，进行中的请求不受影响
+    - 被替换下来的客户端在宽限期后关闭
+    """
+
+    def __init__(self, env_path: str = ENV_PATH) -> None:
+        self.env_path = env_path
+        self._env_mtime: Optional[float] = None
+        self._reload_lock = threading.Lock()
+        self._state: Dict[str, Tuple[LLMProfile, AsyncOpenAI]] = {}
+        self._clients: Dict[Tuple[str, str], AsyncOpenAI] = {}
+        self._retired: list[AsyncOpenAI] = []
+        self._background: Set[asyncio.Task] = set()
+        self._watch_task: Optional[asyncio.Task] = None
+        self.reload_count = 0
+        self._apply(force=True)
+
+    # ==================== 读取 ====================
+
+    def get(self, name: str) -> Tuple[LLMProfile, AsyncOpenAI]:
+        """返回同一时刻的 (配置, 客户端) 快照，保证 model 与 client 一致"""
+        return self._state[name]
+
+    def profile(self, name: str) -> LLMProfile:
+        return self._state[name][0]
+
+    def client(self, name: str) -> AsyncOpenAI:
+        return self._state[name][1]
+
+    def backends(self, group: str) -> List[Tuple[LLMProfile, AsyncOpenAI]]:
+        """返回某一组的全部后端，如 "chat" -> [chat, chat@backup, ...]"""
+        state = self._state
+        return [v for k, v in state.items() if k == group or k.startswith(f"{group}@")]
+
+    # ==================== 构建 / 重载 ====================
+
+    def _build_client(self, profile: LLMProfile) -> AsyncOpenAI:
+        """构建带调优连接池的客户端（LLM_SIMULATOR=inprocess 时请求交给进程内模拟上游）"""
+        transport = None
+        if os.getenv("LLM_SIMULATOR", "").lower() == "inprocess":
+            from benchmarks.llm_simulator import SimulatorTransport
+            transport = SimulatorTransport()
+            logger.warning(f"🧪 [LLMPool] {profile.name} -> in-process LLM simulator")
+        http_client = DefaultAsyncHttpxClient(
+            transport=transport,
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20")),
+                keepalive_expiry=float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "90")),
+            ),
+            timeout=httpx.Timeout(
+                float(os.getenv("AI_TIMEOUT_READ", "60")),
+                connect=float(os.getenv("AI_TIMEOUT_CONNECT", "10")),
+            ),
+        )
+        return AsyncOpenAI(
+            api_key=profile.api_key,
+            base_url=profile.base_url,
+            http_client=http_client,
+            # 重试统一由 services.retry_policy 按错误类型与截止时间控制
+            max_retries=0,
+        )
+
+    def _env_changed(self) -> bool:
+        try:
+            mtime = os.path.getmtime(self.env_path)
+        except OSError:
+            mtime = None
+        if mtime == self._env_mtime:
+            return False
+        self._env_mtime = mtime
+        return True
+
+    def _apply(self, force: bool = False) -> bool:
+        """
+        同步执行一次重载
+
+        Returns:
+            配置是否发生了替换
+        """
+        with self._reload_lock:
+            if not self._env_changed() and not force:
+                return False
+
+            load_dotenv(self.env_path, override=True)
+            profiles = load_profiles()
+
+            # 连接参数未变化的客户端直接复用，只有 key/base_url 变化才重建
+            clients: Dict[Tuple[str, str], AsyncOpenAI] = {}
+            for profile in profiles.values():
+                key = profile.connection_key
+                if key not in clients:
+                    clients[key] = self._clients.get(key) or self._build_client(profile)
+
+            new_state = {name: (p, clients[p.connection_key]) for name, p in profiles.items()}
+            if new_state == self._state:
+                return False
+
+            self._retired.extend(c for k, c in self._clients.items() if k not in clients)
+            self._clients = clients
+            self._state = new_state  # 原子替换
+            self.reload_count += 1
+
+        for profile in profiles.values():
+            logger.success(
+                f"✅ [Config] {profile.name}: {profile.model} | Temp: {profile.temperature} | {profile.base_url}"
+            )
+        return True
+
+    async def reload(self, force: bool = False) -> bool:
+        """重载配置（.env 未变化时为空操作，force=True 强制重读）；读文件与重建客户端在线程中执行"""
+        changed = await asyncio.to_thread(self._apply, force)
+        self._close_retired()
+        return changed
+
+    def _close_retired(self) -> None:
+        grace = float(os.getenv("LLM_CLIENT_RETIRE_GRACE", "120"))
+        while self._retired:
+            client = self._retired.pop()
+            task = asyncio.create_task(self._close_later(client, grace))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    @staticmethod
+    async def _close_later(client: AsyncOpenAI, delay: float) -> None:
+        """等待进行中的请求结束后再关闭旧客户端"""
+        await asyncio.sleep(delay)
+        await client.close()
+
+    # ==================== 生命周期 ====================
+
+    async def warm_up(self) -> None:
+        """启动时预热：提前完成 TCP+TLS 握手，把连接放进 keep-alive 池"""
+        timeout = float(os.getenv("LLM_WARMUP_TIMEOUT", "5"))
+
+        async def _warm(client: AsyncOpenAI) -> None:
+            try:
+                await client.with_options(timeout=timeout, max_retries=0).models.list()
+                logger.info(f"🔥 [LLMPool] Warmed up {client.base_url}")
+            except Exception as exc:
+                logger.warning(f"⚠️ [LLMPool] Warm-up failed for {client.base_url}: {exc}")
+
+        await asyncio.gather(*(_warm(c) for c in list(self._clients.values())))
+
+    async def _watch(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload()
+            except Exception as exc:
+                logger.error(f"❌ [LLMPool] Config reload failed: {exc}")
+
+    def start_watching(self, interval: float) -> None:
+        """轮询 .env 修改时间，变化时自动热重载"""
+        if interval > 0 and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch(interval))
+            logger.info(f"👀 [LLMPool] Watching {self.env_path} every {interval}s")
+
+    async def aclose(self) -> None:
+        if self._watch_task:
+            self._watch_task.cancel()
+            self._watch_task = None
+        for task in list(self._background):
+            task.cancel()
+        for client in list(self._clients.values()) + self._retired:
+            await client.close()
+        self._retired.clear()
+
+
+# 全局共享实例
+llm_pool = LLMClientPool()
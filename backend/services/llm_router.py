@@ -0,0 +1,322 @@
+"""
+LLM Router - 多后端延迟感知路由 + 对冲请求 (Hedged Requests)
+在 llm_pool 的一组后端之间选择当前最快的一个；
+主后端在 p95 推导的阈值内仍未返回（流式为首个 token）时，向第二个后端补发请求，取先完成者。
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Tuple
+
+from loguru import logger
+from openai import AsyncOpenAI
+
+from services.admission import OVERLOAD_ERRORS, request_priority, upstream_limiter
+from services.llm_client import LLMProfile, llm_pool
+from services.metrics import observe_stage, upstream_responses
+from services.prompt_assembler import prompt_assembler
+from services.retry_policy import remaining_time
+from services.token_usage import token_usage
+
+
+class BackendStats:
+    """单个后端的延迟统计"""
+
+    def __init__(self, window: int) -> None:
+        self.latencies: Deque[float] = deque(maxlen=window)  # 非流式：完整响应耗时
+        self.ttfts: Deque[float] = deque(maxlen=window)      # 流式：首 token 耗时
+        self.ewma: Optional[float] = None
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.last_error_at = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def observe(self, seconds: float, streaming: bool) -> None:
+        (self.ttfts if streaming else self.latencies).append(seconds)
+        self._update_ewma(seconds)
+
+    def observe_cancelled(self, seconds: float) -> None:
+        """对冲落败被取消：真实延迟至少为 seconds，只更新 EWMA，不污染分位数样本"""
+        self._update_ewma(seconds)
+
+    def _update_ewma(self, seconds: float) -> None:
+        self.ewma = seconds if self.ewma is None else 0.8 * self.ewma + 0.2 * seconds
+
+    def percentile(self, q: float, streaming: bool) -> Optional[float]:
+        samples = sorted(self.ttfts if streaming else self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+class _PrefetchedStream:
+    """
+    已取到首个 chunk 的流：先吐出首个 chunk，再继续读取原始流
+    流读完或被关闭时调用 on_close（归还上游并发名额）；带 usage 的 chunk（通常是最后一个）交给 on_usage
+    """
+
+    def __init__(
+        self,
+        stream: Any,
+        first: Any,
+        on_close: Optional[Callable[[], None]] = None,
+        on_usage: Optional[Callable[[Any], None]] = None
+    ) -> None:
+        self._stream = stream
+        self._first = first
+        self._on_close = on_close
+        self._on_usage = on_usage
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        try:
+            if self._first is not None:
+                first, self._first = self._first, None
+                self._check_usage(first)
+                yield first
+            async for chunk in self._stream:
+                self._check_usage(chunk)
+                yield chunk
+        finally:
+            self._finish()
+
+    def _check_usage(self, chunk: Any) -> None:
+        usage = getattr(chunk, "usage", None)
+        if usage is not None and self._on_usage is not None:
+            self._on_usage(usage)
+
+    async def close(self) -> None:
+        try:
+            await self._stream.close()
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close()
+
+
+Backend = Tuple[LLMProfile, AsyncOpenAI]
+
+
+class LLMRouter:
+    """
+    一组 OpenAI 兼容后端的路由器
+
+    - 选择：EWMA 延迟 × (1 + 进行中请求数) / 权重 最小者；近期出错的后端短暂降权
+    - 对冲：等待 hedge_delay（主后端 p95 × 系数，限制在 [min, max]）后仍未完成，
+      则向次优后端补发，先完成者胜出，另一方被取消
+    """
+
+    def __init__(self, group: str) -> None:
+        self.group = group
+        self.window = int(os.getenv("AI_ROUTER_WINDOW", "200"))
+        self.hedge_enabled = os.getenv("AI_HEDGE_ENABLED", "1") == "1"
+        self.hedge_percentile = float(os.getenv("AI_HEDGE_PERCENTILE", "95"))
+        self.hedge_factor = float(os.getenv("AI_HEDGE_FACTOR", "1.0"))
+        self.hedge_min_delay = float(os.getenv("AI_HEDGE_MIN_DELAY", "0.3"))
+        self.hedge_max_delay = float(os.getenv("AI_HEDGE_MAX_DELAY", "15"))
+        self.hedge_default_delay = float(os.getenv("AI_HEDGE_DEFAULT_DELAY", "5"))
+        self.hedge_min_samples = int(os.getenv("AI_HEDGE_MIN_SAMPLES", "20"))
+        self.error_cooldown = float(os.getenv("AI_ROUTER_ERROR_COOLDOWN", "30"))
+        # 流式请求要求上游在最后一个 chunk 附带 usage（不支持 stream_options 的后端可关闭）
+        self.stream_usage = os.getenv("AI_STREAM_USAGE", "1") == "1"
+        self._stats: Dict[str, BackendStats] = {}
+
+    def _stat(self, profile: LLMProfile) -> BackendStats:
+        stat = self._stats.get(profile.name)
+        if stat is None:
+            stat = self._stats[profile.name] = BackendStats(self.window)
+        return stat
+
+    # ==================== 路由 ====================
+
+    def _score(self, profile: LLMProfile) -> float:
+        stat = self._stat(profile)
+        # 未观测过的后端给一个乐观估计，保证新后端能被探索到
+        latency = stat.ewma if stat.ewma is not None else 0.0
+        score = (latency + 0.05) * (1 + stat.inflight) / max(profile.weight, 1e-6)
+        if time.monotonic() - stat.last_error_at < self.error_cooldown:
+            score *= 10
+        return score * random.uniform(0.95, 1.05)
+
+    def rank(self) -> List[Backend]:
+        """按当前得分从优到劣排序的后端列表"""
+        return sorted(llm_pool.backends(self.group), key=lambda b: self._score(b[0]))
+
+    def hedge_delay(self, profile: LLMProfile, streaming: bool) -> float:
+        stat = self._stat(profile)
+        samples = stat.ttfts if streaming else stat.latencies
+        if len(samples) < self.hedge_min_samples:
+            return self.hedge_default_delay
+        p = stat.percentile(self.hedge_percentile, streaming) or self.hedge_default_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, p * self.hedge_factor))
+
+    # ==================== 调用 ====================
+
+    async def _call(self, backend: Backend, messages: list, kwargs: Dict[str, Any]) -> Any:
+        """
+        对单个后端发起请求；流式请求在取到首个 chunk 后才算完成
+
+        每次上游调用（包括对冲补发）都先经过 token 预算检查（可能降级 max_tokens / 模型）
+        与共享的自适应并发限制器，流式请求的名额一直占用到流被读完或关闭。
+        """
+        profile, client = backend
+        stat = self._stat(profile)
+        params = {"temperature": profile.temperature, "max_tokens": profile.max_tokens, **kwargs}
+        streaming = bool(params.get("stream"))
+        if streaming and self.stream_usage:
+            params.setdefault("stream_options", {"include_usage": True})
+
+        budget = token_usage.check(self.group)
+        model = budget.model or profile.model
+        if budget.max_tokens is not None:
+            params["max_tokens"] = min(params.get("max_tokens") or budget.max_tokens, budget.max_tokens)
+
+        queued_at = time.perf_counter()
+        await upstream_limiter.acquire(request_priority.get(), timeout=remaining_time())
+        stat.inflight += 1
+        stat.requests += 1
+        start = time.perf_counter()
+        observe_stage("upstream_queue", self.group, start - queued_at)
+        try:
+            response = await client.chat.completions.create(model=model, messages=messages, **params)
+            if streaming:
+                try:
+                    first = await response.__anext__()
+                except StopAsyncIteration:
+                    first = None
+                except BaseException:
+                    await response.close()
+                    raise
+                response = _PrefetchedStream(
+                    response, first,
+                    on_close=lambda: upstream_limiter.release(None, False),
+                    on_usage=lambda usage: self._record_usage(stat, model, usage)
+                )
+        except asyncio.CancelledError:
+            stat.observe_cancelled(time.perf_counter() - start)
+            upstream_limiter.release(None, False)
+            raise
+        except Exception as exc:
+            stat.errors += 1
+            stat.last_error_at = time.monotonic()
+            status = str(getattr(exc, "status_code", None) or type(exc).__name__)
+            upstream_responses.inc(self.group, profile.name, status)
+            observe_stage("upstream_error", self.group, time.perf_counter() - start)
+            upstream_limiter.release(time.perf_counter() - start, isinstance(exc, OVERLOAD_ERRORS))
+            raise
+        finally:
+            stat.inflight -= 1
+
+        elapsed = time.perf_counter() - start
+        stat.observe(elapsed, streaming)
+        observe_stage("ttft" if streaming else "upstream_wait", self.group, elapsed)
+        upstream_responses.inc(self.group, profile.name, "200")
+        if not streaming:
+            upstream_limiter.release(elapsed, False)
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                self._record_usage(stat, model, usage)
+            if self.group == "chat" and usage is not None and usage.prompt_tokens:
+                # 视觉请求含图片 token，不参与文本估算校准
+                prompt_assembler.calibrate(messages, usage.prompt_tokens)
+        return response
+
+    def _record_usage(self, stat: BackendStats, model: str, usage: Any) -> None:
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        stat.prompt_tokens += prompt_tokens
+        stat.completion_tokens += completion_tokens
+        token_usage.record(self.group, model, prompt_tokens, completion_tokens)
+
+    async def create(self, messages: list, **kwargs: Any) -> Any:
+        """
+        等价于 chat.completions.create，但 model / 后端由路由器决定
+
+        Returns:
+            ChatCompletion；stream=True 时返回可 async for 迭代、带 close() 的流
+        """
+        ranked = self.rank()
+        primary = ranked[0]
+        if not self.hedge_enabled or len(ranked) < 2:
+            return await self._call(primary, messages, kwargs)
+
+        delay = self.hedge_delay(primary[0], bool(kwargs.get("stream")))
+        tasks = [asyncio.create_task(self._call(primary, messages, kwargs))]
+        winner: Optional["asyncio.Task[Any]"] = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                secondary = ranked[1]
+                self._stat(secondary[0]).hedges_fired += 1
+                logger.info(
+                    f"🪁 [Router] {primary[0].name} slower than {delay:.2f}s, hedging to {secondary[0].name}"
+                )
+                tasks.append(asyncio.create_task(self._call(secondary, messages, kwargs)))
+            winner = await self._first_success(tasks)
+            if winner is not tasks[0]:
+                self._stat(ranked[1][0]).hedges_won += 1
+            return winner.result()
+        finally:
+            # 调用方取消或已有胜者时，结束其余请求（已拿到的流会被关闭）
+            for task in tasks:
+                if task is winner:
+                    continue
+                task.cancel()
+                task.add_done_callback(self._discard_loser)
+
+    @staticmethod
+    async def _first_success(tasks: List["asyncio.Task[Any]"]) -> "asyncio.Task[Any]":
+        """返回最先成功完成的任务；全部失败时返回主请求（其 result() 会抛出异常）"""
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task
+        return tasks[0]
+
+    @staticmethod
+    def _discard_loser(task: "asyncio.Task[Any]") -> None:
+        """落败的一方若已拿到流，需要关闭以归还连接"""
+        if task.cancelled():
+            return
+        if task.exception() is None:
+            result = task.result()
+            if isinstance(result, _PrefetchedStream):
+                asyncio.ensure_future(result.close())
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for profile, _ in llm_pool.backends(self.group):
+            stat = self._stat(profile)
+            p95 = stat.percentile(95, False)
+            ttft_p95 = stat.percentile(95, True)
+            result[profile.name] = {
+                "model": profile.model,
+                "baseUrl": profile.base_url,
+                "weight": profile.weight,
+                "ewmaMs": round(stat.ewma * 1000) if stat.ewma is not None else None,
+                "p95Ms": round(p95 * 1000) if p95 is not None else None,
+                "ttftP95Ms": round(ttft_p95 * 1000) if ttft_p95 is not None else None,
+                "inflight": stat.inflight,
+                "requests": stat.requests,
+                "errors": stat.errors,
+                "hedgesFired": stat.hedges_fired,
+                "hedgesWon": stat.hedges_won,
+                "promptTokens": stat.prompt_tokens,
+                "completionTokens": stat.completion_tokens,
+            }
+        return result
+
+
+# 文本对话与视觉各一个路由器
+chat_router = LLMRouter("chat")
+vision_router = LLMRouter("vision")
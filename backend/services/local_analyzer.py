@@ -0,0 +1,234 @@
+"""
+Local Analyzer - 态势感知本地快速通道
+"晚安"、"哈哈哈"、单个表情这类输入不需要 LLM 也能给出可靠的侧写：
+逐行用词典 + 正则匹配，结合连发特征生成完整的 SituationAnalysis 与置信度。
+置信度达到阈值时直接返回，否则交给 LLM。整个过程在微秒级完成。
+"""
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from models.schemas import SituationAnalysis
+
+# 超过该长度的输入语义通常不止一个意思，直接交给 LLM
+_MAX_INPUT_CHARS = 40
+# 有历史上下文时同样的短句可能另有含义，置信度略打折扣
+_HISTORY_DISCOUNT = 0.95
+# 多行命中不同规则时的折扣（情绪混杂）
+_MIXED_DISCOUNT = 0.8
+
+# 行尾 / 行首可忽略的标点与语气符号
+_TRIM_RE = re.compile(r"^[\s。．.，,、！!？?~～…]+|[\s。．.，,、！!？?~～…]+$")
+# 表情符号（含变体选择符与零宽连接符）
+_EMOJI_RE = re.compile(
+    "[\U0001F300-\U0001FAFF\u2600-\u27bf\ufe0f\u200d\U0001F1E6-\U0001F1FF]+"
+)
+
+# 变体选择符、零宽连接符、肤色修饰符
+_EMOJI_MODIFIERS = set("\ufe0f\u200d\U0001F3FB\U0001F3FC\U0001F3FD\U0001F3FE\U0001F3FF")
+_LOVE_EMOJI = set("😍🥰😘😚😻💕💖💗💓💞💘❤♥🌹💋")
+_HAPPY_EMOJI = set("😂🤣😄😁😆😊☺😀😃😋😜😝🤪👍🎉✨🙌👏😎🤗")
+_ANGRY_EMOJI = set("😡😠🤬😤💢🙄👿😒")
+_SAD_EMOJI = set("😭😢🥺😞😔😟💔😿😩😫")
+
+
+@dataclass(frozen=True)
+class Rule:
+    """一条本地规则：整行匹配 pattern 时给出的侧写"""
+    name: str
+    pattern: "re.Pattern[str]"
+    emotion_score: int
+    intent: str
+    strategy: str
+    summary: str
+    confidence: float
+
+
+def _rule(name: str, pattern: str, emotion: int, intent: str, strategy: str, summary: str, confidence: float) -> Rule:
+    return Rule(name, re.compile(pattern, re.IGNORECASE), emotion, intent, strategy, summary, confidence)
+
+
+# 只收录语义明确的短句；"哦"、"嗯"、"随便" 这类依赖语境的回复不在此列
+RULES: List[Rule] = [
+    _rule("good_night", r"(晚安|安安|睡了|睡啦|去睡了|我睡了|先睡了|good ?night|gn)(啦|了|哦|喔|呀)?",
+          1, "CASUAL_CHAT", "PLAYFUL", "对方在道晚安，气氛平和，轻松收尾即可", 0.92),
+    _rule("good_morning", r"(早|早安|早呀|早啊|早上好|morning|good ?morning)(呀|啊|哦)?",
+          1, "CASUAL_CHAT", "PLAYFUL", "对方在打招呼问早，气氛轻松", 0.92),
+    _rule("greeting", r"(你好|嗨|哈喽|hello|hi|hey|在吗|在不在|在么|人呢)(呀|啊|哦)?",
+          0, "SEEKING_ATTENTION", "PLAYFUL", "对方在打招呼找你说话，想要你的回应", 0.88),
+    # 笑声必须是明确的重复："h" / "hh" / 单个 "嘿"（多为打招呼）不算
+    _rule("laugh", r"(哈){2,}|(h+a)+h?|h{3,}|(嘻){2,}|(嘿){2,}|2333+|笑死(我了)?|xswl|lol|lmao",
+          2, "CASUAL_CHAT", "PLAYFUL", "对方被逗乐了，情绪轻松愉快", 0.9),
+    _rule("thanks", r"(谢谢|谢啦|谢了|多谢|感谢|thx|thanks|thank you|3q)(你|啦|呀)?",
+          1, "CASUAL_CHAT", "PLAYFUL", "对方在道谢，态度友好", 0.9),
+    _rule("affection", r"(想你|想你了|好想你|爱你|我爱你|喜欢你|么么哒?|mua+|亲亲|抱抱|贴贴)(啦|呀|哦)?",
+          3, "EXPRESSING_AFFECTION", "OFFENSIVE_FLIRT", "对方在直接表达好感，可以大胆回应", 0.9),
+    _rule("acknowledge", r"(好的|好滴|好嘞|收到|ok|okay|知道啦|明白啦|没问题)(呀|哦)?",
+          0, "CASUAL_CHAT", "PLAYFUL", "对方简单确认，态度正常", 0.86),
+    # "滚"、"无语" 在情侣间常是打情骂俏，依赖语境，不在此列
+    _rule("angry", r"(滚开|闭嘴|烦死了|烦死|别烦我|讨厌你|气死我了|神经病)(了|啊)?",
+          -3, "VENTING_EMOTION", "COMFORT", "对方情绪激动正在发火，需要先安抚", 0.88),
+    _rule("sad", r"(呜+|呜呜+|哭了|好难过|难过|委屈|心累|好累)(了|啊|呀)?",
+          -2, "VENTING_EMOTION", "COMFORT", "对方情绪低落，需要情绪价值", 0.88),
+]
+
+_EMOJI_RULES: Dict[str, Rule] = {
+    "love": _rule("emoji_love", "", 3, "EXPRESSING_AFFECTION", "OFFENSIVE_FLIRT", "对方用表情表达好感", 0.88),
+    "happy": _rule("emoji_happy", "", 2, "CASUAL_CHAT", "PLAYFUL", "对方用表情回应，心情不错", 0.88),
+    "angry": _rule("emoji_angry", "", -2, "VENTING_EMOTION", "COMFORT", "对方用表情表达不满", 0.86),
+    "sad": _rule("emoji_sad", "", -2, "SEEKING_ATTENTION", "COMFORT", "对方用表情示弱，想被安慰", 0.86),
+}
+
+
+def detect_burst(text: str) -> Tuple[bool, int]:
+    """
+    检测连发消息模式
+    Returns: (is_burst, pressure_level)
+    """
+    lines = text.strip().split('\n')
+    line_count = len(lines)
+
+    # 计算短消息占比（<=5字符的行）
+    short_lines = sum(1 for line in lines if len(line.strip()) <= 5)
+
+    is_burst = line_count >= 3 or (line_count >= 2 and short_lines >= 2)
+    pressure_level = min(line_count, 5)  # 最高5级
+
+    return is_burst, pressure_level
+
+
+def _match_emoji(line: str) -> Optional[Rule]:
+    """整行只有表情时按表情类别归类（混合类别不判断）"""
+    if _EMOJI_RE.sub("", line):
+        return None
+    kinds = set()
+    for ch in line:
+        if ch in _LOVE_EMOJI:
+            kinds.add("love")
+        elif ch in _HAPPY_EMOJI:
+            kinds.add("happy")
+        elif ch in _ANGRY_EMOJI:
+            kinds.add("angry")
+        elif ch in _SAD_EMOJI:
+            kinds.add("sad")
+        elif ch not in _EMOJI_MODIFIERS:
+            return None  # 未收录的表情
+    if len(kinds) != 1:
+        return None
+    return _EMOJI_RULES[kinds.pop()]
+
+
+def _match_line(line: str) -> Optional[Rule]:
+    text = _TRIM_RE.sub("", line)
+    if not text:
+        return None
+    emoji_rule = _match_emoji(text)
+    if emoji_rule is not None:
+        return emoji_rule
+    # 允许句末附带表情，如 "晚安🌙"
+    text = _TRIM_RE.sub("", _EMOJI_RE.sub("", text))
+    for rule in RULES:
+        if rule.pattern.fullmatch(text):
+            return rule
+    return None
+
+
+class LocalAnalyzer:
+    """
+    规则态势分析器
+
+    - 每一行都必须完整命中某条规则，否则置信度为 0
+    - 多行命中同一规则：沿用该规则；命中不同规则：情绪取平均并打折
+    - 连发特征 (burst / pressure) 与 LLM 路径一致，负面情绪连发时情绪再降一级
+    """
+
+    def __init__(self) -> None:
+        self.enabled = os.getenv("ANALYZE_LOCAL_ENABLED", "true").lower() != "false"
+        self.threshold = float(os.getenv("ANALYZE_LOCAL_THRESHOLD", "0.85"))
+        self.calls = 0
+        self.hits = 0
+        self.intent_hits: Dict[str, int] = {}
+        self.total_time = 0.0
+
+    def analyze(self, text: str, has_history: bool = False) -> Tuple[Optional[Dict[str, Any]], float]:
+        """
+        本地分析
+
+        Returns:
+            (SituationAnalysis 字典, 置信度)；无法判断时返回 (None, 0.0)
+        """
+        stripped = text.strip()
+        if not stripped or len(stripped) > _MAX_INPUT_CHARS:
+            return None, 0.0
+
+        matched: List[Rule] = []
+        for line in stripped.split("\n"):
+            if not line.strip():
+                continue
+            rule = _match_line(line)
+            if rule is None:
+                return None, 0.0
+            matched.append(rule)
+
+        is_burst, pressure_level = detect_burst(stripped)
+        names = {rule.name for rule in matched}
+        if len(names) == 1:
+            primary = matched[0]
+            emotion = primary.emotion_score
+            confidence = primary.confidence
+        else:
+            primary = min(matched, key=lambda r: r.emotion_score)  # 负面信号优先
+            emotion = round(sum(r.emotion_score for r in matched) / len(matched))
+            confidence = min(r.confidence for r in matched) * _MIXED_DISCOUNT
+
+        if is_burst and emotion < 0:
+            emotion = max(-3, emotion - 1)
+        if has_history:
+            confidence *= _HISTORY_DISCOUNT
+
+        summary = primary.summary + ("（连发刷屏，情绪更强烈）" if is_burst else "")
+        analysis = SituationAnalysis(
+            summary=summary,
+            emotion_score=emotion,
+            intent=primary.intent,
+            strategy=primary.strategy,
+            confidence=round(confidence, 3),
+            burst_detected=is_burst,
+            pressure_level=pressure_level,
+        ).model_dump()
+        return analysis, confidence
+
+    def try_answer(self, text: str, has_history: bool = False) -> Optional[Dict[str, Any]]:
+        """置信度达到阈值时返回本地结果，否则返回 None（交给 LLM）"""
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        analysis, confidence = self.analyze(text, has_history)
+        self.total_time += time.perf_counter() - start
+        self.calls += 1
+        if analysis is None or confidence < self.threshold:
+            return None
+
+        self.hits += 1
+        intent = analysis["intent"]
+        self.intent_hits[intent] = self.intent_hits.get(intent, 0) + 1
+        logger.info(f"⚡ [LocalAnalyzer] Hit ({confidence:.2f}): {text[:30]} -> {intent}/{analysis['strategy']}")
+        return analysis
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "calls": self.calls,
+            "hits": self.hits,
+            "hitRate": round(self.hits / self.calls, 3) if self.calls else 0.0,
+            "hitsByIntent": dict(self.intent_hits),
+            "avgMicros": round(self.total_time / self.calls * 1e6, 1) if self.calls else 0.0,
+        }
+
+
+local_analyzer = LocalAnalyzer()
@@ -0,0 +1,171 @@
+"""
+Loop Monitor - 事件循环延迟监控 + 阻塞调用定位
+心跳任务每 interval 醒来一次，实际醒来时间与预期之差即事件循环延迟（lag）；
+看门狗线程发现心跳停止超过阈值时，抓取事件循环线程此刻的调用栈，
+按栈中的路由处理函数归属到接口，并记录阻塞点（栈中最内层的项目代码）。
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from services.metrics import event_loop_lag, event_loop_stalls
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LoopLagMonitor:
+    """
+    事件循环延迟监控
+
+    - LOOP_MONITOR_INTERVAL_MS：心跳间隔（默认 100ms）
+    - LOOP_STALL_THRESHOLD_MS：超过该时长的阻塞记为一次卡顿并抓取调用栈（默认 200ms）
+    - 最近 LOOP_MONITOR_WINDOW 个心跳的延迟用于计算 p50 / p95 / p99
+    """
+
+    def __init__(self) -> None:
+        self.enabled = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+        self.interval = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100")) / 1000
+        self.stall_threshold = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "200")) / 1000
+        self.lags: Deque[float] = deque(maxlen=int(os.getenv("LOOP_MONITOR_WINDOW", "600")))
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.stalls_by_endpoint: Counter = Counter()
+        self.recent_stalls: Deque[Dict[str, Any]] = deque(maxlen=20)
+        self._routes: Dict[Any, str] = {}
+        self._heartbeat = time.monotonic()
+        self._pending: Optional[Dict[str, Any]] = None  # 看门狗已抓到、尚未结束的卡顿
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._stop = threading.Event()
+
+    def register_routes(self, routes: Iterable[Any]) -> None:
+        """路由处理函数的 code 对象 -> 路由模板，用于把卡顿归属到接口"""
+        for route in routes:
+            endpoint = getattr(route, "endpoint", None)
+            code = getattr(endpoint, "__code__", None)
+            if code is not None:
+                self._routes[code] = route.path
+
+    # ==================== 生命周期 ====================
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick())
+        threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+        logger.info(
+            f"🩺 [LoopMonitor] Heartbeat every {self.interval * 1000:.0f}ms, "
+            f"stall threshold {self.stall_threshold * 1000:.0f}ms"
+        )
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # ==================== 测量 ====================
+
+    async def _tick(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            event_loop_lag.observe(lag)
+            if lag >= self.stall_threshold:
+                self._finish_stall(lag)
+
+    def _finish_stall(self, lag: float) -> None:
+        """心跳恢复：补全卡顿时长（看门狗没赶上的短卡顿只记录时长）"""
+        stall, self._pending = self._pending, None
+        if stall is None:
+            stall = {"at": int(time.time() * 1000), "endpoint": "unknown", "site": None, "stack": []}
+        stall["durationMs"] = round(lag * 1000, 1)
+        self.stalls += 1
+        self.stalls_by_endpoint[stall["endpoint"]] += 1
+        event_loop_stalls.inc(stall["endpoint"])
+        self.recent_stalls.append(stall)
+        logger.warning(
+            f"🐢 [LoopMonitor] Event loop blocked {stall['durationMs']}ms | "
+            f"endpoint: {stall['endpoint']} | at: {stall['site']}"
+        )
+
+    def _watchdog(self) -> None:
+        """独立线程：心跳超过阈值未更新时抓取事件循环线程的调用栈（每次卡顿只抓一次）"""
+        captured_for = None
+        while not self._stop.wait(self.interval / 2):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.stall_threshold or captured_for == heartbeat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            captured_for = heartbeat
+            endpoint, site = self._attribute(frame)
+            self._pending = {
+                "at": int(time.time() * 1000),
+                "endpoint": endpoint,
+                "site": site,
+                "stack": traceback.format_list(traceback.extract_stack(frame)[-15:]),
+            }
+
+    def _attribute(self, frame: Any) -> Tuple[str, Optional[str]]:
+        """(接口路由, 阻塞点)：接口取栈中的路由处理函数，阻塞点取最内层的项目代码"""
+        endpoint, site = None, None
+        while frame is not None:
+            code = frame.f_code
+            if site is None and code.co_filename.startswith(_BACKEND_DIR) and code.co_filename != __file__:
+                site = f"{os.path.relpath(code.co_filename, _BACKEND_DIR)}:{frame.f_lineno} ({code.co_name})"
+            if code in self._routes:
+                endpoint = self._routes[code]
+                break
+            frame = frame.f_back
+        # 不在请求处理函数中（后台任务、子任务）时以阻塞点所在函数代替
+        return endpoint or (f"background:{site}" if site else "unknown"), site
+
+    # ==================== 查询 ====================
+
+    def percentiles(self) -> Dict[str, float]:
+        samples = sorted(self.lags)
+        if not samples:
+            return {}
+        return {q: samples[min(len(samples) - 1, int(len(samples) * float(q)))] for q in ("0.5", "0.95", "0.99")}
+
+    def stats(self) -> Dict[str, Any]:
+        quantiles = self.percentiles()
+        return {
+            "enabled": self.enabled,
+            "intervalMs": self.interval * 1000,
+            "stallThresholdMs": self.stall_threshold * 1000,
+            "lagP50Ms": round(quantiles.get("0.5", 0.0) * 1000, 2),
+            "lagP95Ms": round(quantiles.get("0.95", 0.0) * 1000, 2),
+            "lagP99Ms": round(quantiles.get("0.99", 0.0) * 1000, 2),
+            "lagMaxMs": round(self.max_lag * 1000, 2),
+            "stalls": self.stalls,
+            "stallsByEndpoint": dict(self.stalls_by_endpoint),
+        }
+
+    def recent(self) -> List[Dict[str, Any]]:
+        return list(reversed(self.recent_stalls))
+
+
+loop_monitor = LoopLagMonitor()
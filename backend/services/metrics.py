@@ -0,0 +1,249 @@
+"""
+Metrics - Prometheus 文本格式指标（不依赖 prometheus_client）
+热路径上每次记录只有一次 dict 查找 + 数值累加，外加一把无竞争的锁：大部分记录发生在事件循环线程内，
+但 @timed("db_write") 在 DB 工作线程中执行，/metrics 渲染时也不能与写入交错；
+缓存、请求合并、限流器等组件已有的计数在抓取 /metrics 时通过 collector 回调读取，不重复计数。
+阶段耗时同时记入当前请求的追踪（services/request_trace），用于 Server-Timing 响应头。
+"""
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from services.request_trace import record_span, span
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# 秒；覆盖从微秒级的本地处理到分钟级的视觉分析
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[str, ...]
+# collector 回调产出的样本：(指标名, 类型, 帮助文本, [(标签字典, 值), ...])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """固定桶直方图：每个标签组合保存 [各桶计数(非累计), 总和, 总数]，输出时再转为累计值"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Labels, List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            # 复制快照，避免输出过程中被其他线程修改
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表 + 抓取时执行的 collector 回调"""
+
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        metric = Gauge(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# ==================== 内置指标 ====================
+
+http_requests = registry.counter(
+    "sdp_http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+)
+http_duration = registry.histogram(
+    "sdp_http_request_duration_seconds", "HTTP handler latency (until response headers)", ("route",)
+)
+http_in_flight = registry.gauge("sdp_http_requests_in_flight", "HTTP requests currently being handled")
+stage_duration = registry.histogram(
+    "sdp_stage_duration_seconds",
+    "Per-stage latency: prompt_build, upstream_queue, upstream_wait, ttft, upstream_error, parse, validation, db_write",
+    ("stage", "kind"),
+)
+upstream_responses = registry.counter(
+    "sdp_llm_upstream_responses_total", "Upstream LLM responses by backend and status", ("group", "backend", "status")
+)
+llm_retries = registry.counter("sdp_llm_retries_total", "LLM call retries by call label and error class", ("label", "reason"))
+llm_tokens = registry.counter(
+    "sdp_llm_tokens_total", "Upstream tokens by endpoint, model and type (prompt/completion)", ("endpoint", "model", "type")
+)
+token_budget_actions = registry.counter(
+    "sdp_token_budget_actions_total", "Calls downgraded or rejected by token budgets", ("action",)
+)
+event_loop_lag = registry.histogram(
+    "sdp_event_loop_lag_seconds",
+    "Event loop scheduling lag measured by the heartbeat task",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+event_loop_stalls = registry.counter(
+    "sdp_event_loop_stalls_total", "Event loop stalls above the threshold, by endpoint", ("endpoint",)
+)
+
+
+def observe_stage(stage: str, kind: str, seconds: float) -> None:
+    """记录在别处测得的阶段耗时（直方图 + 当前请求的追踪）"""
+    stage_duration.observe(seconds, stage, kind)
+    record_span(stage, seconds, kind)
+
+
+class stage_timer:
+    """
+    with stage_timer("prompt_build", "execute"): ...
+    退出时把耗时记入 sdp_stage_duration_seconds 与当前请求的追踪（异常退出同样记录）
+    """
+    __slots__ = ("labels", "start", "span")
+
+    def __init__(self, stage: str, kind: str = "") -> None:
+        self.labels = (stage, kind)
+        self.start = 0.0
+        self.span = span(stage, kind)
+
+    def __enter__(self) -> "stage_timer":
+        self.span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        stage_duration.observe(time.perf_counter() - self.start, *self.labels)
+        self.span.__exit__(*exc)
+
+
+def timed(stage: str, kind: Optional[str] = None) -> Callable[[F], F]:
+    """同步函数装饰器版本的 stage_timer；kind 缺省为函数名"""
+    def decorator(fn: F) -> F:
+        labels = (stage, kind or fn.__name__)
+
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with stage_timer(*labels):
+                return fn(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return decorator
@@ -0,0 +1,145 @@
+"""
+Pipeline Service - 分析 + 推测执行
+态势分析完成后立即以 AI 建议的策略开始战术执行，
+用户确认（或仅修改了非策略字段）时直接复用推测结果。
+"""
+import asyncio
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+
+from services.ai_service import ai_service
+
+
+@dataclass
+class Speculation:
+    """一次推测执行"""
+    user_input: str
+    history: list
+    analysis: Dict[str, Any]
+    task: "asyncio.Task[Dict[str, Any]]"
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class PipelineService:
+    """
+    推测执行管理器
+
+    - start: 分析 + 后台启动 execute_tactics（使用建议策略）
+    - commit: 策略未变 -> 等待推测结果；策略改变 -> 取消推测并按新分析重新执行
+    - 超过 TTL 未确认的推测会被取消，避免占用上游配额
+    - run_single_call: 不需要人工修改环节时，一次 LLM 调用同时完成分析与执行
+    """
+
+    def __init__(self) -> None:
+        self.ttl = float(os.getenv("PIPELINE_SPECULATION_TTL", "120"))
+        self.max_pending = int(os.getenv("PIPELINE_MAX_PENDING", "256"))
+        # 请求未指定 single_call 时的默认模式
+        self.single_call_default = os.getenv("PIPELINE_SINGLE_CALL", "false").lower() == "true"
+        self._pending: Dict[str, Speculation] = {}
+        self.started = 0
+        self.reused = 0
+        self.discarded = 0
+        self.expired = 0
+        self.single_calls = 0
+
+    def speculate(self, user_input: str, history: list, analysis: Dict[str, Any]) -> "asyncio.Task[Dict[str, Any]]":
+        """以分析建议的策略在后台启动战术执行"""
+        task = asyncio.create_task(ai_service.execute_tactics(user_input, analysis, history))
+        # 无人确认的推测失败时不产生 "exception was never retrieved" 警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self.started += 1
+        return task
+
+    async def start(self, user_input: str, history: list, use_cache: bool = True) -> Tuple[str, Dict[str, Any]]:
+        """
+        执行态势分析并登记推测执行
+
+        Returns:
+            (pipeline_id, analysis)
+        """
+        self.cleanup_expired()
+
+        analysis = await ai_service.analyze_situation(user_input, history, use_cache=use_cache)
+        pipeline_id = str(uuid.uuid4())
+        self._pending[pipeline_id] = Speculation(
+            user_input=user_input,
+            history=history,
+            analysis=analysis,
+            task=self.speculate(user_input, history, analysis),
+        )
+        logger.info(f"🔮 [Pipeline] Speculating {pipeline_id[:8]} with strategy {analysis.get('strategy')}")
+        return pipeline_id, analysis
+
+    async def run_single_call(
+        self,
+        user_input: str,
+        history: list,
+        use_cache: bool = True
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        单次调用模式：分析与回复选项由同一次 LLM 调用产出
+
+        Returns:
+            (analysis, 执行结果)
+        """
+        self.single_calls += 1
+        return await ai_service.analyze_and_execute(user_input, history, use_cache=use_cache)
+
+    async def commit(
+        self,
+        pipeline_id: str,
+        edited_analysis: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Dict[str, Any], Dict[str, Any], bool]:
+        """
+        确认分析结果并取得战术执行结果
+
+        Returns:
+            (执行结果, 最终采用的分析, 是否复用了推测结果)
+
+        Raises:
+            KeyError: pipeline_id 不存在或已过期
+        """
+        spec = self._pending.pop(pipeline_id)
+
+        if edited_analysis is None or edited_analysis.get("strategy") == spec.analysis.get("strategy"):
+            self.reused += 1
+            logger.info(f"✅ [Pipeline] Reusing speculative execution {pipeline_id[:8]}")
+            return await spec.task, edited_analysis or spec.analysis, True
+
+        spec.task.cancel()
+        self.discarded += 1
+        logger.info(
+            f"🔁 [Pipeline] Strategy changed {spec.analysis.get('strategy')} -> "
+            f"{edited_analysis.get('strategy')}, re-executing {pipeline_id[:8]}"
+        )
+        result = await ai_service.execute_tactics(spec.user_input, edited_analysis, spec.history)
+        return result, edited_analysis, False
+
+    def cleanup_expired(self) -> None:
+        """取消过期未确认的推测；超出容量时优先淘汰最早的"""
+        now = time.monotonic()
+        expired = [k for k, spec in self._pending.items() if now - spec.created_at > self.ttl]
+        overflow = len(self._pending) - len(expired) - self.max_pending + 1
+        if overflow > 0:
+            expired += [k for k in self._pending if k not in expired][:overflow]
+        for k in expired:
+            self._pending.pop(k).task.cancel()
+            self.expired += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "started": self.started,
+            "reused": self.reused,
+            "discarded": self.discarded,
+            "expired": self.expired,
+            "singleCalls": self.single_calls,
+        }
+
+
+pipeline_service = PipelineService()
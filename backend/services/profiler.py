@@ -0,0 +1,227 @@
+"""
+Sampling Profiler - 按需采样的进程内 CPU 剖析
+独立线程按固定间隔读取 sys._current_frames()，记录事件循环线程与线程池 / DB 线程的调用栈，
+输出 collapsed stacks（flamegraph.pl / speedscope 均可导入）或 speedscope JSON。
+被测代码不做任何插桩，开销只在采样线程（默认 100Hz），同一时间只允许一个剖析任务。
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# (函数名, 文件, 函数首行号)
+FrameKey = Tuple[str, str, int]
+Stack = Tuple[FrameKey, ...]
+
+# 线程空闲等待时的栈顶：事件循环等待 IO、线程池等待任务
+_IDLE_LEAVES = {
+    ("select", "selectors.py"),
+    ("_worker", "thread.py"),
+    ("wait", "threading.py"),
+    ("get", "queue.py"),
+}
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ProfilerBusy(Exception):
+    """已有剖析任务在运行"""
+
+
+def _short_path(path: str) -> str:
+    """backend 内的文件用相对路径，第三方库从 site-packages 之后截取"""
+    if path.startswith(_BACKEND_DIR):
+        return os.path.relpath(path, _BACKEND_DIR)
+    marker = "site-packages" + os.sep
+    idx = path.rfind(marker)
+    if idx >= 0:
+        return path[idx + len(marker):]
+    return os.path.basename(path)
+
+
+class Profile:
+    """一次剖析的结果：每个线程的 调用栈 -> 采样次数"""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.samples = 0
+        self.threads: Dict[str, Counter] = {}
+
+    def add(self, thread: str, stack: Stack) -> None:
+        counts = self.threads.get(thread)
+        if counts is None:
+            counts = self.threads[thread] = Counter()
+        counts[stack] += 1
+
+    @staticmethod
+    def _label(frame: FrameKey) -> str:
+        name, path, line = frame
+        # collapsed 格式以 ; 分隔栈帧、以最后一个空格分隔计数
+        return f"{name} ({path}:{line})".replace(";", ":")
+
+    def collapsed(self) -> str:
+        """Brendan Gregg collapsed stacks：线程;根帧;...;叶帧 次数"""
+        lines = []
+        for thread, counts in self.threads.items():
+            for stack, count in counts.most_common():
+                frames = ";".join(self._label(frame) for frame in stack)
+                lines.append(f"{thread};{frames} {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self) -> Dict[str, Any]:
+        """speedscope 文件格式：每个线程一个 sampled profile，相同调用栈合并并以耗时作权重"""
+        frame_index: Dict[FrameKey, int] = {}
+        frames: List[Dict[str, Any]] = []
+        profiles = []
+        for thread, counts in self.threads.items():
+            samples, weights = [], []
+            for stack, count in counts.most_common():
+                indexes = []
+                for frame in stack:
+                    idx = frame_index.get(frame)
+                    if idx is None:
+                        idx = frame_index[frame] = len(frames)
+                        frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                    indexes.append(idx)
+                samples.append(indexes)
+                weights.append(round(count * self.interval, 6))
+            profiles.append({
+                "type": "sampled",
+                "name": thread,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 6),
+                "samples": samples,
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"sdp-backend {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at))}",
+            "exporter": "sdp-sampling-profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "durationSeconds": round(self.duration, 3),
+            "intervalMs": round(self.interval * 1000, 3),
+            "samples": self.samples,
+            "threads": {name: sum(counts.values()) for name, counts in self.threads.items()},
+        }
+
+
+class SamplingProfiler:
+    """
+    采样剖析器
+
+    - 由 PROFILER_ENABLED 控制是否允许触发（默认关闭），单次时长不超过 PROFILER_MAX_SECONDS
+    - 采样间隔下限 1ms；默认跳过空闲线程的样本（事件循环在 select 中等待、线程池等待任务）
+    """
+
+    def __init__(self) -> None:
+        self.enabled = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+        self.max_seconds = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+        self.default_interval = float(os.getenv("PROFILER_INTERVAL_MS", "10")) / 1000
+        self.running = False
+        self.runs = 0
+
+    def _thread_names(self, loop_thread_id: Optional[int]) -> Dict[int, str]:
+        names = {}
+        for thread in threading.enumerate():
+            if thread.ident is None:
+                continue
+            names[thread.ident] = "event-loop" if thread.ident == loop_thread_id else thread.name
+        return names
+
+    def _sample_loop(
+        self,
+        profile: Profile,
+        stop: threading.Event,
+        loop_thread_id: Optional[int],
+        include_idle: bool
+    ) -> None:
+        own_id = threading.get_ident()
+        names = self._thread_names(loop_thread_id)
+        next_refresh = time.monotonic() + 1.0
+        while not stop.wait(profile.interval):
+            if time.monotonic() >= next_refresh:
+                # 线程池会按需创建新线程
+                names = self._thread_names(loop_thread_id)
+                next_refresh = time.monotonic() + 1.0
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack: List[FrameKey] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, _short_path(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                leaf = stack[0]
+                if not include_idle and (leaf[0], os.path.basename(leaf[1])) in _IDLE_LEAVES:
+                    continue
+                stack.reverse()
+                profile.add(names.get(thread_id, f"thread-{thread_id}"), tuple(stack))
+            profile.samples += 1
+
+    async def profile(
+        self,
+        seconds: float,
+        interval: Optional[float] = None,
+        include_idle: bool = False
+    ) -> Profile:
+        """
+        在当前事件循环中剖析 seconds 秒（期间不阻塞事件循环）
+
+        Raises:
+            ProfilerBusy: 已有剖析任务在运行
+        """
+        if self.running:
+            raise ProfilerBusy("已有剖析任务在运行")
+        seconds = min(max(seconds, 0.1), self.max_seconds)
+        interval = max(interval or self.default_interval, 0.001)
+
+        profile = Profile(interval)
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample_loop,
+            args=(profile, stop, threading.get_ident(), include_idle),
+            name="sdp-profiler",
+            daemon=True,
+        )
+        self.running = True
+        self.runs += 1
+        logger.info(f"🔬 [Profiler] Sampling for {seconds:.1f}s every {interval * 1000:.1f}ms")
+        start = time.perf_counter()
+        try:
+            sampler.start()
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            sampler.join(timeout=1.0)
+            profile.duration = time.perf_counter() - start
+            self.running = False
+        logger.info(f"🔬 [Profiler] Done | {profile.summary()}")
+        return profile
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            "runs": self.runs,
+            "maxSeconds": self.max_seconds,
+            "defaultIntervalMs": self.default_interval * 1000,
+        }
+
+
+profiler = SamplingProfiler()
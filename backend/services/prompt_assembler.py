@@ -0,0 +1,274 @@
+"""
+Prompt Assembler - 按 token 预算装配对话历史
+估算 token 数，把历史压缩进各接口的预算：合并同一角色的连续消息，
+保留最近的若干轮原文，更早的轮次替换为（缓存的）抽取式摘要。
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from config.styles import STATIC_PREFIXES
+from services.cache import TTLCache, make_cache_key
+
+# CJK 统一表意文字、假名、全角标点：Qwen 等中文模型大约 1 字 ≈ 0.6~1 token
+_CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+
+# 每条消息的格式开销（"- 对方: " 前缀与换行）
+_MESSAGE_OVERHEAD = 4
+
+
+@dataclass
+class PrefixStats:
+    """某类 system prompt 与上一次请求共享的前缀字节数统计"""
+    requests: int = 0
+    shared_bytes: int = 0
+    total_bytes: int = 0
+    last: bytes = b""
+
+
+@dataclass
+class CompactHistory:
+    """压缩后的历史：摘要（可能为空）+ 按时间顺序保留的原文消息"""
+    messages: List[Dict[str, Any]]
+    summary: str = ""
+    tokens: int = 0
+    original_tokens: int = 0
+    dropped: int = 0
+
+
+class PromptAssembler:
+    """
+    Token 预算装配器
+
+    - estimate_tokens: CJK 字符按系数计数，英文单词 / 数字按长度折算，其余字符各计 1；
+      系数会根据上游返回的 usage.prompt_tokens 持续校准
+    - compact: 合并连续同角色消息 -> 从最新往前装入预算 -> 更早的轮次生成摘要
+    - record_prefix: 统计相邻请求 system prompt 的公共前缀字节数
+    """
+
+    # 各接口的历史预算（token），可通过环境变量覆盖
+    DEFAULT_BUDGETS = {
+        "analyze": 600,
+        "execute": 400,
+        "generate": 800,
+        "combined": 600,
+    }
+
+    def __init__(self) -> None:
+        self.cjk_ratio = float(os.getenv("PROMPT_TOKENS_PER_CJK", "0.75"))
+        self.chars_per_word_token = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "4"))
+        self.summary_budget = int(os.getenv("PROMPT_SUMMARY_BUDGET", "120"))
+        self.budgets = {
+            name: int(os.getenv(f"PROMPT_HISTORY_BUDGET_{name.upper()}", str(default)))
+            for name, default in self.DEFAULT_BUDGETS.items()
+        }
+        # 估算值 -> 实际 token 的校准系数（EWMA）
+        self.calibration = 1.0
+        self.summary_cache = TTLCache(
+            "history_summary",
+            max_size=int(os.getenv("PROMPT_SUMMARY_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("PROMPT_SUMMARY_CACHE_TTL", "1800")),
+        )
+        self.compactions = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self._prefix: Dict[str, PrefixStats] = {}
+
+    # ==================== Token 估算 ====================
+
+    def _raw_estimate(self, text: str) -> float:
+        cjk = len(_CJK_RE.findall(text))
+        words = _WORD_RE.findall(text)
+        word_chars = sum(len(w) for w in words)
+        other = len(text) - cjk - word_chars - text.count(" ")
+        word_tokens = sum(max(1.0, len(w) / self.chars_per_word_token) for w in words)
+        return cjk * self.cjk_ratio + word_tokens + max(other, 0)
+
+    def estimate_tokens(self, text: str) -> int:
+        """估算文本的 token 数（已乘以校准系数）"""
+        if not text:
+            return 0
+        return int(self._raw_estimate(text) * self.calibration) + 1
+
+    def estimate_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """估算 chat messages 的 prompt token 数（多模态消息只计文本部分）"""
+        total = 0
+        for msg in messages:
+            content = msg.get("content", "")
+            if isinstance(content, list):
+                content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+            total += self.estimate_tokens(str(content)) + _MESSAGE_OVERHEAD
+        return total
+
+    def calibrate(self, messages: List[Dict[str, Any]], actual_prompt_tokens: int) -> None:
+        """用上游返回的真实 prompt_tokens 校准估算系数"""
+        estimated = sum(
+            self._raw_estimate(str(m.get("content", ""))) + _MESSAGE_OVERHEAD
+            for m in messages if isinstance(m.get("content"), str)
+        )
+        if estimated <= 0 or actual_prompt_tokens <= 0:
+            return
+        ratio = actual_prompt_tokens / estimated
+        self.calibration = min(3.0, max(0.3, 0.9 * self.calibration + 0.1 * ratio))
+
+    # ==================== 历史压缩 ====================
+
+    @staticmethod
+    def merge_consecutive(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """合并同一角色的连续消息（如对方连发的多条），减少重复的角色前缀"""
+        merged: List[Dict[str, Any]] = []
+        for msg in history:
+            content = str(msg.get("content", "")).strip()
+            if not content:
+                continue
+            role = msg.get("role", "user")
+            if merged and merged[-1]["role"] == role:
+                merged[-1] = {"role": role, "content": f"{merged[-1]['content']}\n{content}"}
+            else:
+                merged.append({"role": role, "content": content})
+        return merged
+
+    def _truncate(self, text: str, budget: int, keep_tail: bool) -> str:
+        """按 token 预算截断文本（二分查找字符数）"""
+        if self.estimate_tokens(text) <= budget:
+            return text
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            part = text[-mid:] if keep_tail else text[:mid]
+            if self.estimate_tokens(part) <= budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        part = text[-lo:] if keep_tail else text[:lo]
+        return f"…{part}" if keep_tail else f"{part}…"
+
+    def summarize(self, messages: List[Dict[str, Any]]) -> str:
+        """
+        更早轮次的抽取式摘要：每条取首行的开头部分，整体约在 summary_budget 以内
+        相同的旧轮次在多次请求间反复出现，结果按内容缓存
+        """
+        if not messages:
+            return ""
+        key = make_cache_key("summary", messages, self.summary_budget)
+        cached = self.summary_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # 从最近的旧轮次往前取，放不下的更早轮次直接省略
+        per_message = max(8, self.summary_budget // len(messages))
+        parts: List[str] = []
+        remaining = self.summary_budget
+        for msg in reversed(messages):
+            role = "对方" if msg.get("role") == "user" else "我方"
+            first_line = msg["content"].split("\n", 1)[0]
+            part = f"{role}: {self._truncate(first_line, per_message, keep_tail=False)}"
+            cost = self.estimate_tokens(part)
+            if parts and cost > remaining:
+                break
+            parts.append(part)
+            remaining -= cost
+        summary = ("…；" if len(parts) < len(messages) else "") + "；".join(reversed(parts))
+
+        self.summary_cache.set(key, summary)
+        return summary
+
+    def compact(self, history: Optional[List[Dict[str, Any]]], endpoint: str) -> CompactHistory:
+        """
+        把历史装入 endpoint 对应的 token 预算
+
+        Returns:
+            CompactHistory(messages=保留的最近消息, summary=更早轮次的摘要)
+        """
+        if not history:
+            return CompactHistory(messages=[])
+
+        budget = self.budgets.get(endpoint, self.DEFAULT_BUDGETS["execute"])
+        merged = self.merge_consecutive(history)
+        costs = [self.estimate_tokens(m["content"]) + _MESSAGE_OVERHEAD for m in merged]
+        original = sum(costs)
+
+        if original <= budget:
+            result = CompactHistory(messages=merged, tokens=original, original_tokens=original)
+        else:
+            # 从最新往前装入；摘要占用的预算先预留出来
+            remaining = budget - self.summary_budget
+            keep_from = len(merged)
+            while keep_from > 0 and costs[keep_from - 1] <= remaining:
+                keep_from -= 1
+                remaining -= costs[keep_from]
+
+            kept = merged[keep_from:]
+            if not kept:
+                # 最新一条本身就超出预算：保留其结尾部分
+                latest = merged[-1]
+                content = self._truncate(latest["content"], max(budget - self.summary_budget, 16), keep_tail=True)
+                kept = [{"role": latest["role"], "content": content}]
+                keep_from = len(merged) - 1
+
+            summary = self.summarize(merged[:keep_from])
+            tokens = (
+                sum(self.estimate_tokens(m["content"]) + _MESSAGE_OVERHEAD for m in kept)
+                + self.estimate_tokens(summary)
+            )
+            result = CompactHistory(
+                messages=kept,
+                summary=summary,
+                tokens=tokens,
+                original_tokens=original,
+                dropped=keep_from,
+            )
+            logger.debug(
+                f"✂️ [Prompt:{endpoint}] History {original} -> {tokens} tokens "
+                f"({keep_from} older turns summarized)"
+            )
+
+        self.compactions += 1
+        self.tokens_before += result.original_tokens
+        self.tokens_after += result.tokens
+        return result
+
+    # ==================== 前缀共享统计 ====================
+
+    def record_prefix(self, kind: str, system_prompt: str) -> None:
+        """记录本次 system prompt 与同类上一次请求的公共前缀长度（衡量前缀缓存的可复用程度）"""
+        data = system_prompt.encode("utf-8")
+        stat = self._prefix.setdefault(kind, PrefixStats())
+        if stat.last:
+            stat.requests += 1
+            stat.shared_bytes += len(os.path.commonprefix([stat.last, data]))
+            stat.total_bytes += len(data)
+        stat.last = data
+
+    def prefix_stats(self) -> Dict[str, Any]:
+        result = {}
+        for kind, stat in self._prefix.items():
+            prefix = STATIC_PREFIXES.get(kind, "")
+            result[kind] = {
+                "staticPrefixBytes": len(prefix.encode("utf-8")),
+                "comparedRequests": stat.requests,
+                "avgSharedBytes": stat.shared_bytes // stat.requests if stat.requests else 0,
+                "avgPromptBytes": stat.total_bytes // stat.requests if stat.requests else 0,
+                "sharedRatio": round(stat.shared_bytes / stat.total_bytes, 3) if stat.total_bytes else 0.0,
+            }
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        saved = self.tokens_before - self.tokens_after
+        return {
+            "budgets": self.budgets,
+            "calibration": round(self.calibration, 3),
+            "compactions": self.compactions,
+            "historyTokensBefore": self.tokens_before,
+            "historyTokensAfter": self.tokens_after,
+            "savedRatio": round(saved / self.tokens_before, 3) if self.tokens_before else 0.0,
+            "summaryCache": self.summary_cache.stats(),
+            "prefixSharing": self.prefix_stats(),
+        }
+
+
+prompt_assembler = PromptAssembler()
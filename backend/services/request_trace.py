@@ -0,0 +1,143 @@
+"""
+Request Trace - 请求级阶段耗时追踪
+中间件为每个请求创建 RequestTrace 并放入 contextvar；各服务通过 span()（metrics.stage_timer 已内置）记录阶段，
+响应时汇总为 Server-Timing 头，客户端显式要求时再把完整的 span 树放进 JSON 响应体。
+没有活动追踪时（后台任务、脚本调用）span() 只做一次 contextvar 读取。
+"""
+import contextvars
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+# 客户端传入的 X-Request-Id 只接受常见 ID 字符，避免把任意内容回写进响应头和日志
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:\-]{1,64}$")
+
+
+class Span:
+    __slots__ = ("name", "detail", "start", "end", "children")
+
+    def __init__(self, name: str, detail: str = "", start: Optional[float] = None) -> None:
+        self.name = name
+        self.detail = detail
+        self.start = time.perf_counter() if start is None else start
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        node: Dict[str, Any] = {
+            "name": self.name,
+            "startMs": round((self.start - origin) * 1000, 2),
+            "durationMs": round(self.duration_ms(), 2),
+        }
+        if self.detail:
+            node["detail"] = self.detail
+        if self.end is None:
+            node["unfinished"] = True
+        if self.children:
+            node["children"] = [child.to_dict(origin) for child in self.children]
+        return node
+
+
+class RequestTrace:
+    """
+    单个请求的 span 树
+
+    并发的子任务（fan-out、推测执行）会复制 contextvar，它们的 span 挂在创建任务时所在的 span 下
+    """
+
+    def __init__(self, request_id: str) -> None:
+        self.request_id = request_id
+        self.root = Span("request")
+
+    def walk(self) -> List[Span]:
+        spans: List[Span] = []
+        stack = list(reversed(self.root.children))
+        while stack:
+            node = stack.pop()
+            spans.append(node)
+            stack.extend(reversed(node.children))
+        return spans
+
+    def server_timing(self) -> str:
+        """
+        按阶段名汇总（同名阶段耗时相加，如多次重试的上游等待）
+        例：prompt_build;dur=0.4, upstream_wait;dur=812.3;desc="x2", total;dur=815.0
+        """
+        totals: Dict[str, List[float]] = {}
+        for span in self.walk():
+            entry = totals.setdefault(span.name, [0.0, 0])
+            entry[0] += span.duration_ms()
+            entry[1] += 1
+        parts = [
+            f'{name};dur={total:.1f}' + (f';desc="x{count}"' if count > 1 else "")
+            for name, (total, count) in totals.items()
+        ]
+        parts.append(f"total;dur={self.root.duration_ms():.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"requestId": self.request_id, **self.root.to_dict(self.root.start)}
+
+
+current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def make_request_id(incoming: Optional[str] = None) -> str:
+    """沿用客户端 / 网关传入的 X-Request-Id（格式合法时），否则生成新的"""
+    if incoming and _REQUEST_ID_RE.match(incoming):
+        return incoming
+    return uuid.uuid4().hex
+
+
+def start_trace(request_id: str) -> contextvars.Token:
+    return current_trace.set(RequestTrace(request_id))
+
+
+def _parent(trace: RequestTrace) -> Span:
+    return _current_span.get() or trace.root
+
+
+class span:
+    """
+    with span("retry_sleep", "chat"): ...
+    在当前请求的追踪中记录一个阶段；嵌套的 span 成为子节点
+    """
+    __slots__ = ("name", "detail", "node", "token")
+
+    def __init__(self, name: str, detail: str = "") -> None:
+        self.name = name
+        self.detail = detail
+        self.node: Optional[Span] = None
+        self.token: Optional[contextvars.Token] = None
+
+    def __enter__(self) -> "span":
+        trace = current_trace.get()
+        if trace is not None:
+            self.node = Span(self.name, self.detail)
+            _parent(trace).children.append(self.node)
+            self.token = _current_span.set(self.node)
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        if self.node is not None:
+            self.node.end = time.perf_counter()
+            _current_span.reset(self.token)
+
+
+def record_span(name: str, seconds: float, detail: str = "") -> None:
+    """记录一个刚结束、耗时已知的阶段（如在别处测得的排队时间）"""
+    trace = current_trace.get()
+    if trace is None:
+        return
+    end = time.perf_counter()
+    node = Span(name, detail, start=end - seconds)
+    node.end = end
+    _parent(trace).children.append(node)
@@ -0,0 +1,205 @@
+"""
+Retry Policy - 按错误类型分类的重试 + 请求级截止时间
+替代一刀切的 tenacity 重试：只重试可恢复的错误（超时、429、5xx、JSON/Schema 解析失败），
+退避带随机抖动，429 优先遵循 Retry-After，且绝不在用户已放弃（截止时间已过）后继续重试。
+"""
+import asyncio
+import contextvars
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, TypeVar
+
+import openai
+from loguru import logger
+from pydantic import ValidationError
+
+from services.admission import AdmissionRejected
+from services.metrics import llm_retries
+from services.request_trace import span
+
+T = TypeVar("T")
+
+# 当前请求的截止时间（time.monotonic() 绝对值），由 main.py 在入口处设置
+request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "request_deadline", default=None
+)
+
+
+class DeadlineExceeded(Exception):
+    """请求级截止时间已到，不再发起（或等待）上游调用"""
+
+
+def remaining_time() -> Optional[float]:
+    """距离截止时间的剩余秒数；未设置截止时间时返回 None"""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """在当前上下文设置截止时间（只会收紧，不会放宽外层的截止时间）"""
+    deadline = None if seconds is None else time.monotonic() + seconds
+    outer = request_deadline.get()
+    if outer is not None and (deadline is None or outer < deadline):
+        deadline = outer
+    token = request_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        request_deadline.reset(token)
+
+
+# ==================== 错误分类 ====================
+
+TIMEOUT = "timeout"
+RATE_LIMIT = "rate_limit"
+SERVER = "server"
+PARSE = "parse"
+AUTH = "auth"
+CLIENT = "client"
+OVERLOADED = "overloaded"
+DEADLINE = "deadline"
+UNKNOWN = "unknown"
+
+# 可以通过重试恢复的错误类型
+RETRYABLE = {TIMEOUT, RATE_LIMIT, SERVER, PARSE}
+
+
+def classify_error(exc: BaseException) -> str:
+    """把异常归类为 TIMEOUT / RATE_LIMIT / SERVER / PARSE / AUTH / CLIENT / ..."""
+    if isinstance(exc, DeadlineExceeded):
+        return DEADLINE
+    if isinstance(exc, AdmissionRejected):
+        return OVERLOADED
+    if isinstance(exc, (openai.APITimeoutError, asyncio.TimeoutError)):
+        return TIMEOUT
+    if isinstance(exc, openai.RateLimitError):
+        return RATE_LIMIT
+    if isinstance(exc, (openai.InternalServerError, openai.APIConnectionError)):
+        return SERVER
+    if isinstance(exc, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return AUTH
+    if isinstance(exc, openai.APIStatusError):
+        return SERVER if exc.status_code >= 500 else CLIENT
+    if isinstance(exc, (json.JSONDecodeError, ValidationError)):
+        return PARSE
+    return UNKNOWN
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """读取 429 / 503 响应中的 Retry-After（支持 retry-after-ms 与秒数两种格式）"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # HTTP-date 格式的 Retry-After 不常见，交给指数退避
+        return None
+    return None
+
+
+class RetryPolicy:
+    """
+    分类重试执行器
+
+    - 只重试 RETRYABLE 中的错误；鉴权、参数错误、本地限流拒绝立即失败
+    - 退避：full jitter，random(0, min(max_delay, base × 2^n))；429 优先使用 Retry-After；解析失败立即重试
+    - 每次尝试的超时 = 剩余截止时间；剩余时间不足以完成一次 退避 + 最短尝试 时放弃
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.max_attempts = int(os.getenv("AI_RETRY_MAX_ATTEMPTS", "3"))
+        self.base_delay = float(os.getenv("AI_RETRY_BASE_DELAY", "0.5"))
+        self.max_delay = float(os.getenv("AI_RETRY_MAX_DELAY", "8"))
+        # 剩余时间少于该值时不再发起新的尝试
+        self.min_attempt_time = float(os.getenv("AI_RETRY_MIN_ATTEMPT_TIME", "2"))
+
+        self.calls = 0
+        self.retries: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+        self.deadline_exceeded = 0
+
+    def backoff(self, attempt: int, exc: BaseException) -> float:
+        """第 attempt 次失败后的等待秒数"""
+        if classify_error(exc) == PARSE:
+            # 输出格式错误与上游负载无关，立即重新生成
+            return 0.0
+        retry_after = retry_after_seconds(exc)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay * 4)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def call(self, fn: Callable[[], Awaitable[T]], label: str = "") -> T:
+        """
+        执行 fn，按错误类型决定是否重试
+
+        Raises:
+            DeadlineExceeded: 截止时间已到
+            其他异常: 不可重试的错误，或重试次数用尽后的最后一次错误
+        """
+        self.calls += 1
+        tag = f"{self.name}:{label}" if label else self.name
+        attempt = 0
+        while True:
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                self.deadline_exceeded += 1
+                raise DeadlineExceeded(f"请求已超过截止时间 ({tag})")
+
+            try:
+                with span("llm", tag):
+                    if remaining is None:
+                        return await fn()
+                    return await asyncio.wait_for(fn(), timeout=remaining)
+            except asyncio.TimeoutError as exc:
+                # wait_for 超时即截止时间已到（上游自身的超时是 APITimeoutError）
+                if remaining is not None and remaining_time() <= 0:
+                    self.deadline_exceeded += 1
+                    raise DeadlineExceeded(f"请求已超过截止时间 ({tag})") from exc
+                error = exc
+            except Exception as exc:
+                error = exc
+
+            kind = classify_error(error)
+            attempt += 1
+            if kind not in RETRYABLE or attempt >= self.max_attempts:
+                self.failures[kind] = self.failures.get(kind, 0) + 1
+                raise error
+
+            delay = self.backoff(attempt, error)
+            remaining = remaining_time()
+            if remaining is not None and remaining < delay + self.min_attempt_time:
+                # 剩余时间不够再试一次，直接返回真实错误
+                logger.warning(f"⏱️ [Retry:{tag}] {kind} with {remaining:.1f}s left, giving up")
+                self.failures[kind] = self.failures.get(kind, 0) + 1
+                raise error
+
+            self.retries[kind] = self.retries.get(kind, 0) + 1
+            llm_retries.inc(label or self.name, kind)
+            logger.warning(
+                f"🔁 [Retry:{tag}] Attempt {attempt}/{self.max_attempts} failed ({kind}: {error}), "
+                f"retrying in {delay:.2f}s"
+            )
+            with span("retry_sleep", tag):
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "retries": dict(self.retries),
+            "failures": dict(self.failures),
+            "deadlineExceeded": self.deadline_exceeded,
+        }
+
+
+# 所有 LLM / VLM 调用共用的重试策略
+llm_retry = RetryPolicy("llm")
@@ -0,0 +1,124 @@
+"""
+SingleFlight - 合并相同的进行中请求
+同一个 key 的并发调用只触发一次上游请求，其余调用者等待同一个结果。
+共享任务在独立的上下文中执行，不继承首个调用者的截止时间与请求追踪。
+"""
+import asyncio
+import contextvars
+import copy
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from loguru import logger
+
+from services.admission import request_priority
+from services.request_trace import RequestTrace, current_trace, span
+from services.retry_policy import DeadlineExceeded, remaining_time
+from services.token_usage import usage_endpoint, usage_strategy, usage_user
+
+T = TypeVar("T")
+
+# 共享任务从首个调用者继承的上下文：上游排队优先级 + token 用量归属
+_INHERITED_VARS = (request_priority, usage_endpoint, usage_user, usage_strategy)
+
+
+class _Call:
+    __slots__ = ("task", "trace", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]", trace: RequestTrace) -> None:
+        self.task = task
+        self.trace = trace
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    进行中请求合并器
+
+    - 首个调用者创建共享任务，后续相同 key 的调用者直接等待该任务
+    - 每个调用者通过 asyncio.shield 等待：单个调用者取消（如客户端断开）不影响其他人
+    - 只有当所有等待者都已离开时，才取消共享的上游任务
+    - 后加入的调用者拿到结果的深拷贝，避免共享可变对象
+    - 共享任务运行在新建的 contextvars.Context 中，只带上 _INHERITED_VARS：
+      不设截止时间，每个调用者按自己的截止时间等待（超时抛出 DeadlineExceeded，并按离开处理）；
+      阶段追踪记入共享任务自己的 RequestTrace，完成后挂到每个调用者追踪中的 singleflight 节点下
+    - token 用量与预算：一次共享调用只发起一次上游请求，用量计入首个调用者（发起者）的接口 / 用户 / 策略，
+      预算也只按发起者检查；后加入的调用者不消耗上游 token，不计入其用量与预算
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._inflight: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        call = self._inflight.get(key)
+        leader = call is None
+        if leader:
+            trace = RequestTrace(f"singleflight:{self.name}")
+            task = asyncio.get_running_loop().create_task(fn(), context=self._shared_context(trace))
+            call = _Call(task, trace)
+            self._inflight[key] = call
+            call.task.add_done_callback(lambda _t, k=key, c=call: self._forget(k, c))
+        else:
+            self.coalesced += 1
+            logger.info(f"🔗 [SingleFlight:{self.name}] Coalesced request ({call.waiters} already waiting)")
+
+        call.waiters += 1
+        try:
+            with span("singleflight", self.name) as scope:
+                result = await self._wait(call)
+                if scope.node is not None:
+                    scope.node.children.extend(call.trace.root.children)
+        except (asyncio.CancelledError, DeadlineExceeded):
+            if call.waiters == 1 and not call.task.done():
+                # 最后一个等待者离开，上游结果已无人需要
+                call.task.cancel()
+                self._forget(key, call)
+                self.cancelled += 1
+            raise
+        finally:
+            call.waiters -= 1
+
+        return result if leader else copy.deepcopy(result)
+
+    @staticmethod
+    def _shared_context(trace: RequestTrace) -> contextvars.Context:
+        values = [(var, var.get()) for var in _INHERITED_VARS]
+
+        def init() -> None:
+            for var, value in values:
+                var.set(value)
+            current_trace.set(trace)
+
+        context = contextvars.Context()
+        context.run(init)
+        return context
+
+    async def _wait(self, call: _Call) -> Any:
+        """按当前调用者自己的截止时间等待共享任务（shield：超时或取消都不直接影响共享任务）"""
+        remaining = remaining_time()
+        if remaining is None:
+            return await asyncio.shield(call.task)
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{self.name}: deadline exceeded before joining")
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.task), remaining)
+        except asyncio.TimeoutError:
+            if call.task.done():
+                raise  # 共享任务本身以超时失败
+            raise DeadlineExceeded(f"{self.name}: deadline exceeded while waiting for the shared call") from None
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._inflight.get(key) is call:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+            "inflight": len(self._inflight),
+        }
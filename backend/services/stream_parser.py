@@ -0,0 +1,127 @@
+"""
+Stream Parser - 流式 JSON 增量解析
+边接收 LLM 的 token 边扫描 AdvisorResponse JSON，
+`analysis` 字符串或 `options` 中的某个对象一旦闭合就立即产出。
+选项与最终结果（AIService._coerce_advisor）使用同一个 coerce_option 规整，流式推送的选项与 done 事件保持一致。
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from pydantic import ValidationError
+
+from config.styles import REPLY_STYLES
+from models.schemas import ReplyOption
+from services.json_repair import clamp_int
+
+# (事件类型, 数据)：("analysis", str) / ("option", dict)
+StreamEvent = Tuple[str, Any]
+
+# 每次回复最多保留的选项数
+MAX_OPTIONS = 3
+
+
+def coerce_option(option: Any) -> Optional[Dict[str, Any]]:
+    """规整单个回复选项：空选项返回 None、评分钳制到 [-3, 3]、补全缺失字段"""
+    if not isinstance(option, dict) or not str(option.get("text") or "").strip():
+        return None  # 被截断或为空的选项直接丢弃
+    style = str(option.get("style") or "")
+    return {
+        **option,
+        "style": style,
+        "style_name": option.get("style_name") or REPLY_STYLES.get(style, {}).get("name", style),
+        "kaomoji": option.get("kaomoji") or "",
+        "score": clamp_int(option.get("score"), -3, 3),
+    }
+
+
+class AdvisorStreamParser:
+    """
+    AdvisorResponse 的增量扫描器
+
+    只维护一个括号栈和字符串状态，每个字符只扫描一次；
+    完整的 JSON 仍由调用方在流结束后用 _parse_response 做最终校验。
+    """
+
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.analysis: Optional[str] = None
+        self.options: List[Dict[str, Any]] = []
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._expect_key = False
+        self._top_key: Optional[str] = None
+        self._item_start = -1
+
+    def feed(self, chunk: str) -> List[StreamEvent]:
+        """追加一段文本，返回本次新完成的事件"""
+        self.buffer += chunk
+        events: List[StreamEvent] = []
+        buf = self.buffer
+
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._on_string_end(buf[self._string_start:i + 1], events)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                # 顶层对象 -> options 数组 -> 单个选项对象
+                if ch == "{" and self._stack == ["{", "["] and self._top_key == "options":
+                    self._item_start = i
+                self._stack.append(ch)
+                self._expect_key = ch == "{"
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                self._expect_key = False
+                if ch == "}" and self._item_start >= 0 and self._stack == ["{", "["]:
+                    self._on_option_end(buf[self._item_start:i + 1], events)
+                    self._item_start = -1
+            elif ch == ",":
+                self._expect_key = bool(self._stack) and self._stack[-1] == "{"
+            elif ch == ":":
+                self._expect_key = False
+
+        self._pos = len(buf)
+        return events
+
+    def _on_string_end(self, literal: str, events: List[StreamEvent]) -> None:
+        if self._stack != ["{"]:
+            return
+        try:
+            value = json.loads(literal)
+        except json.JSONDecodeError:
+            return
+        if self._expect_key:
+            self._top_key = value
+        elif self._top_key == "analysis" and self.analysis is None:
+            self.analysis = value
+            events.append(("analysis", value))
+
+    def _on_option_end(self, literal: str, events: List[StreamEvent]) -> None:
+        if len(self.options) >= MAX_OPTIONS:
+            return
+        try:
+            coerced = coerce_option(json.loads(literal))
+            if coerced is None:
+                return
+            option = ReplyOption(**coerced).model_dump()
+        except (json.JSONDecodeError, ValidationError, TypeError) as e:
+            # 单个选项不合法时不中断流，最终校验会给出完整错误
+            logger.warning(f"⚠️ [Stream] Skip invalid option: {e}")
+            return
+        self.options.append(option)
+        events.append(("option", option))
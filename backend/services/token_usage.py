@@ -0,0 +1,198 @@
+"""
+Token Usage - 上游 token 用量统计与预算
+每次 LLM / VLM 调用的 usage（流式取最后一个 chunk 的 usage）按 接口 / 模型 / 策略 / 用户 汇总；
+全局与单用户预算按固定窗口计量：超过软阈值后降级（压低 max_tokens、切换到更便宜的模型），
+用尽后拒绝请求，直到窗口重置。
+"""
+import contextvars
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+from services.admission import AdmissionRejected
+from services.metrics import llm_tokens, token_budget_actions
+
+ANONYMOUS = "anonymous"
+
+# 当前请求的归属，由 main.py 中间件（接口、X-User-Id）与各业务方法（userId、策略）设置
+usage_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("usage_endpoint", default="other")
+usage_user: contextvars.ContextVar[str] = contextvars.ContextVar("usage_user", default=ANONYMOUS)
+usage_strategy: contextvars.ContextVar[str] = contextvars.ContextVar("usage_strategy", default="none")
+
+
+class BudgetExceeded(AdmissionRejected):
+    """token 预算已用尽（沿用 AdmissionRejected 的处理路径：不重试、429 + Retry-After）"""
+
+
+@dataclass
+class UsageTotals:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, prompt_tokens: int, completion_tokens: int) -> None:
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "promptTokens": self.prompt_tokens,
+            "completionTokens": self.completion_tokens,
+            "totalTokens": self.total,
+        }
+
+
+@dataclass
+class BudgetDecision:
+    """本次调用的降级参数（None 表示不调整）"""
+    max_tokens: Optional[int] = None
+    model: Optional[str] = None
+
+
+class TokenUsageTracker:
+    """
+    用量统计 + 预算执行
+
+    - 汇总维度：endpoint / model / strategy / user（进程启动以来）
+    - 预算：TOKEN_BUDGET_GLOBAL / TOKEN_BUDGET_PER_USER（每个窗口的 token 总数，0 为不限），
+      窗口长度 TOKEN_BUDGET_WINDOW 秒；已用比例取全局与该用户中较高者
+    - 已用比例 >= TOKEN_BUDGET_SOFT_RATIO：max_tokens 限制为 TOKEN_BUDGET_DEGRADED_MAX_TOKENS，
+      并在配置了 TOKEN_BUDGET_FALLBACK_MODEL（视觉为 TOKEN_BUDGET_VISION_FALLBACK_MODEL）时切换模型
+    - 已用比例 >= 1：抛出 BudgetExceeded
+    """
+
+    def __init__(self) -> None:
+        self.window = float(os.getenv("TOKEN_BUDGET_WINDOW", "86400"))
+        self.global_budget = int(os.getenv("TOKEN_BUDGET_GLOBAL", "0"))
+        self.user_budget = int(os.getenv("TOKEN_BUDGET_PER_USER", "0"))
+        self.soft_ratio = float(os.getenv("TOKEN_BUDGET_SOFT_RATIO", "0.8"))
+        self.degraded_max_tokens = int(os.getenv("TOKEN_BUDGET_DEGRADED_MAX_TOKENS", "512"))
+        self.fallback_models = {
+            "chat": os.getenv("TOKEN_BUDGET_FALLBACK_MODEL", ""),
+            "vision": os.getenv("TOKEN_BUDGET_VISION_FALLBACK_MODEL", ""),
+        }
+        self.totals = UsageTotals()
+        self.by_endpoint: Dict[str, UsageTotals] = {}
+        self.by_model: Dict[str, UsageTotals] = {}
+        self.by_strategy: Dict[str, UsageTotals] = {}
+        self.by_user: Dict[str, UsageTotals] = {}
+        # 当前预算窗口内的用量
+        self.window_start = time.time()
+        self.window_global = 0
+        self.window_users: Dict[str, int] = {}
+        self.downgraded = 0
+        self.rejected = 0
+
+    # ==================== 统计 ====================
+
+    def record(self, group: str, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        """记录一次上游调用的 usage，归属取自当前请求的 contextvar"""
+        endpoint, user, strategy = usage_endpoint.get(), usage_user.get(), usage_strategy.get()
+        self.totals.add(prompt_tokens, completion_tokens)
+        for table, key in (
+            (self.by_endpoint, endpoint), (self.by_model, model),
+            (self.by_strategy, strategy), (self.by_user, user),
+        ):
+            totals = table.get(key)
+            if totals is None:
+                totals = table[key] = UsageTotals()
+            totals.add(prompt_tokens, completion_tokens)
+
+        self._roll_window()
+        spent = prompt_tokens + completion_tokens
+        self.window_global += spent
+        self.window_users[user] = self.window_users.get(user, 0) + spent
+
+        llm_tokens.inc(endpoint, model, "prompt", amount=prompt_tokens)
+        llm_tokens.inc(endpoint, model, "completion", amount=completion_tokens)
+
+    # ==================== 预算 ====================
+
+    def _roll_window(self) -> None:
+        if time.time() - self.window_start >= self.window:
+            self.window_start = time.time()
+            self.window_global = 0
+            self.window_users = {}
+
+    def _used_ratio(self, user: str) -> float:
+        ratio = 0.0
+        if self.global_budget > 0:
+            ratio = self.window_global / self.global_budget
+        if self.user_budget > 0 and user != ANONYMOUS:
+            ratio = max(ratio, self.window_users.get(user, 0) / self.user_budget)
+        return ratio
+
+    def check(self, group: str) -> BudgetDecision:
+        """
+        调用上游前检查预算
+
+        Raises:
+            BudgetExceeded: 全局或当前用户的预算已用尽
+        """
+        if self.global_budget <= 0 and self.user_budget <= 0:
+            return BudgetDecision()
+        self._roll_window()
+        user = usage_user.get()
+        ratio = self._used_ratio(user)
+        if ratio >= 1:
+            self.rejected += 1
+            token_budget_actions.inc("rejected")
+            retry_after = max(1.0, self.window_start + self.window - time.time())
+            scope = "全局" if self.global_budget > 0 and self.window_global >= self.global_budget else f"用户 {user}"
+            logger.warning(f"💸 [Budget] {scope} token budget exhausted, rejecting {usage_endpoint.get()}")
+            raise BudgetExceeded(f"{scope} token 预算已用尽，请 {round(retry_after)} 秒后重试", retry_after)
+        if ratio >= self.soft_ratio:
+            self.downgraded += 1
+            token_budget_actions.inc("downgraded")
+            return BudgetDecision(
+                max_tokens=self.degraded_max_tokens,
+                model=self.fallback_models.get(group) or None,
+            )
+        return BudgetDecision()
+
+    # ==================== 查询 ====================
+
+    def user_usage(self, user: str) -> Dict[str, Any]:
+        self._roll_window()
+        totals = self.by_user.get(user, UsageTotals())
+        return {
+            "userId": user,
+            **totals.to_dict(),
+            "windowTokens": self.window_users.get(user, 0),
+            "windowBudget": self.user_budget or None,
+        }
+
+    def stats(self, top_users: int = 20) -> Dict[str, Any]:
+        self._roll_window()
+        users = sorted(self.by_user.items(), key=lambda item: item[1].total, reverse=True)[:top_users]
+        return {
+            "totals": self.totals.to_dict(),
+            "byEndpoint": {key: value.to_dict() for key, value in self.by_endpoint.items()},
+            "byModel": {key: value.to_dict() for key, value in self.by_model.items()},
+            "byStrategy": {key: value.to_dict() for key, value in self.by_strategy.items()},
+            "topUsers": {key: value.to_dict() for key, value in users},
+            "budget": {
+                "windowSeconds": self.window,
+                "windowStartedAt": int(self.window_start),
+                "globalBudget": self.global_budget or None,
+                "globalUsed": self.window_global,
+                "perUserBudget": self.user_budget or None,
+                "softRatio": self.soft_ratio,
+                "degradedMaxTokens": self.degraded_max_tokens,
+                "fallbackModels": {k: v for k, v in self.fallback_models.items() if v},
+                "downgraded": self.downgraded,
+                "rejected": self.rejected,
+            },
+        }
+
+
+token_usage = TokenUsageTracker()
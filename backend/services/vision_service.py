@@ -4,16 +4,21 @@ Vision Service - v10.0 视觉智能模块
 """
 import base64
 import json
-import os
 import time
 from typing import Optional
 
-from dotenv import load_dotenv
 from loguru import logger
 from openai import AsyncOpenAI
-from tenacity import retry, stop_after_attempt, wait_fixed
 
 from models.schemas import VisionIntelligence, VisionBubble
+from services.admission import AdmissionRejected
+from services.cache import make_cache_key
+from services.json_repair import clamp_float, clamp_int, parse_llm_json
+from services.llm_client import llm_pool
+from services.llm_router import vision_router
+from services.metrics import stage_timer
+from services.retry_policy import DeadlineExceeded, llm_retry
+from services.singleflight import SingleFlight
 
 
 class VisionService:
@@ -28,27 +33,29 @@ class VisionService:
     
     def __init__(self) -> None:
         logger.info("👁️ [VisionService] Initializing Tactical Vision v10.0...")
-        self._refresh_config()
-    
-    def _refresh_config(self) -> None:
-        """加载视觉模型配置"""
-        load_dotenv(override=True)
-        
-        # 优先使用专门的视觉 API，否则复用主 API
-        self.api_key = os.getenv("VISION_API_KEY") or os.getenv("SILICONFLOW_API_KEY", "")
-        self.base_url = os.getenv("VISION_BASE_URL", "https://api.siliconflow.cn/v1")
-        
-        # 视觉模型配置 - 推荐 Qwen-VL
-        self.model = os.getenv("VISION_MODEL", "Qwen/Qwen2-VL-72B-Instruct")
-        self.max_tokens = int(os.getenv("VISION_MAX_TOKENS", "2048"))
-        self.temperature = float(os.getenv("VISION_TEMPERATURE", "0.7"))
-        
-        self.client = AsyncOpenAI(
-            api_key=self.api_key,
-            base_url=self.base_url
-        )
-        
-        logger.success(f"✅ [VisionConfig] Model: {self.model}")
+        # 同一张截图的并发分析只调用一次 VLM
+        self.vision_flight = SingleFlight("vision")
+
+    # 视觉配置（VISION_API_KEY / VISION_BASE_URL / VISION_MODEL ...）由 llm_pool 统一加载
+    @property
+    def client(self) -> AsyncOpenAI:
+        return llm_pool.client("vision")
+
+    @property
+    def model(self) -> str:
+        return llm_pool.profile("vision").model
+
+    @property
+    def base_url(self) -> str:
+        return llm_pool.profile("vision").base_url
+
+    @property
+    def max_tokens(self) -> int:
+        return llm_pool.profile("vision").max_tokens
+
+    @property
+    def temperature(self) -> float:
+        return llm_pool.profile("vision").temperature
     
     def _build_vision_prompt(self) -> str:
         """构建视觉分析系统提示词"""
@@ -92,7 +99,6 @@ class VisionService:
 - 保持分析客观，不要过度解读
 - 气泡按从上到下的时间顺序排列"""
 
-    @retry(stop=stop_after_attempt(2), wait=wait_fixed(1))
     async def analyze_screenshot(
         self, 
         image_base64: str, 
@@ -108,6 +114,19 @@ class VisionService:
         Returns:
             (VisionIntelligence, raw_text, analysis_time_ms)
         """
+        flight_key = make_cache_key("vision", image_base64, hint, self.model)
+        intelligence, raw_text, analysis_time_ms = await self.vision_flight.do(
+            flight_key,
+            lambda: self._analyze_uncached(image_base64, hint)
+        )
+        return intelligence, raw_text, analysis_time_ms
+
+    async def _analyze_uncached(
+        self, 
+        image_base64: str, 
+        hint: Optional[str] = None
+    ) -> tuple[VisionIntelligence, str, int]:
+        """调用 VLM 分析截图"""
         start_time = time.perf_counter()
         
         # 构建用户消息
@@ -138,14 +157,14 @@ class VisionService:
         try:
             logger.info(f"👁️ [Vision] Analyzing screenshot... (hint: {hint or 'none'})")
             
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self._build_vision_prompt()},
-                    {"role": "user", "content": user_content}
-                ],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature
+            response = await llm_retry.call(
+                lambda: vision_router.create(
+                    messages=[
+                        {"role": "system", "content": self._build_vision_prompt()},
+                        {"role": "user", "content": user_content}
+                    ]
+                ),
+                "vision"
             )
             
             raw_content = response.choices[0].message.content or ""
@@ -158,6 +177,9 @@ class VisionService:
             
             return intelligence, raw_content, analysis_time_ms
             
+        except (AdmissionRejected, DeadlineExceeded):
+            # 交给 main.py 返回 429 / 504，而不是伪装成一次成功的降级分析
+            raise
         except Exception as e:
             logger.error(f"❌ [Vision] Analysis failed: {e}")
             analysis_time_ms = int((time.perf_counter() - start_time) * 1000)
@@ -175,36 +197,30 @@ class VisionService:
     
     def _parse_vision_response(self, raw_content: str) -> VisionIntelligence:
         """解析 VLM 返回的 JSON 响应"""
-        # 清理 Markdown 代码块
-        clean_content = raw_content
-        if "```json" in clean_content:
-            clean_content = clean_content.split("```json")[1].split("```")[0]
-        elif "```" in clean_content:
-            clean_content = clean_content.split("```")[1].split("```")[0]
-        
-        clean_content = clean_content.strip()
-        
         try:
-            data = json.loads(clean_content)
+            data = parse_llm_json(raw_content, "vision")
             
             # 转换 bubbles
             bubbles = []
-            for b in data.get("bubbles", []):
+            for b in data.get("bubbles") or []:
+                if not isinstance(b, dict):
+                    continue
                 bubbles.append(VisionBubble(
                     text=b.get("text", ""),
-                    is_me=b.get("is_me", False),
-                    confidence=b.get("confidence", 0.9)
+                    is_me=bool(b.get("is_me", False)),
+                    confidence=clamp_float(b.get("confidence"), 0.0, 1.0, default=0.9)
                 ))
             
-            return VisionIntelligence(
-                summary=data.get("summary", "无法解析截图内容"),
-                bubbles=bubbles,
-                emotion_detected=data.get("emotion_detected", "未知"),
-                emotion_score=data.get("emotion_score", 0),
-                context_hint=data.get("context_hint", ""),
-                tactical_suggestion=data.get("tactical_suggestion", ""),
-                confidence=data.get("confidence", 0.5)
-            )
+            with stage_timer("validation", "vision"):
+                return VisionIntelligence(
+                    summary=data.get("summary", "无法解析截图内容"),
+                    bubbles=bubbles,
+                    emotion_detected=data.get("emotion_detected", "未知"),
+                    emotion_score=clamp_int(data.get("emotion_score"), -3, 3),
+                    context_hint=data.get("context_hint", ""),
+                    tactical_suggestion=data.get("tactical_suggestion", ""),
+                    confidence=clamp_float(data.get("confidence"), 0.0, 1.0, default=0.5)
+                )
             
         except json.JSONDecodeError as e:
             logger.warning(f"⚠️ [Vision] JSON parse failed, using fallback: {e}")
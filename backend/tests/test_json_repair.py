@@ -0,0 +1,60 @@
+"""repair_json / parse_llm_json：可修复的缺陷与必须交给重试的输出"""
+import pytest
+
+from services.json_repair import JSONRepairError, json_repair_stats, parse_llm_json, repair_json
+
+
+@pytest.mark.parametrize("raw,expected,repaired", [
+    ('{"a": 1, "b": "x"}', {"a": 1, "b": "x"}, False),
+    ('```json\n{"a": 1}\n```', {"a": 1}, False),
+    ('好的，结果如下：{"a": 1} 以上。', {"a": 1}, True),
+    ('{"a": 1, "b": [1, 2,],}', {"a": 1, "b": [1, 2]}, True),
+    ('｛"a"：1，"b"："好"｝', {"a": 1, "b": "好"}, True),
+    ("{'a': 'x', 'b': 2}", {"a": "x", "b": 2}, True),
+    ('{"a": 1, // 注释\n "b": 2}', {"a": 1, "b": 2}, True),
+    ('{"a": "he said "hi", "b": 2}', {"a": 'he said "hi', "b": 2}, True),
+])
+def test_repairable(raw, expected, repaired):
+    assert repair_json(raw) == (expected, repaired)
+
+
+@pytest.mark.parametrize("raw,expected", [
+    # 截断在成员之间：补齐括号
+    ('{"a": 1, "b": [1, 2', {"a": 1, "b": [1, 2]}),
+    ('{"a": 1, "b": {"c": 2', {"a": 1, "b": {"c": 2}}),
+    # 悬空的 key / 冒号
+    ('{"a": 1, "b":', {"a": 1, "b": None}),
+    # 截断在字符串中途：该成员整个丢弃，而不是补上引号
+    ('{"a": 1, "b": "半句', {"a": 1}),
+    ('{"options": [{"text": "完整", "score": 1}, {"style": "X", "text": "我今天真的超级开',
+     {"options": [{"text": "完整", "score": 1}, {"style": "X"}]}),
+])
+def test_truncation(raw, expected):
+    value, repaired = repair_json(raw)
+    assert repaired
+    assert value == expected
+
+
+@pytest.mark.parametrize("raw", [
+    # 字符串内未转义的引号后跟逗号，被误判为结束引号：修复会丢掉 b
+    '{"a": "he said "hi", ok", "b": 2}',
+    # 误判后对象被提前闭合，剩下的成员在对象之外
+    '{"a": "x "y"}, "b": 2}',
+    "没有 JSON",
+    "",
+])
+def test_unrepairable_raises(raw):
+    with pytest.raises(JSONRepairError):
+        repair_json(raw)
+
+
+def test_failed_repair_is_counted():
+    before = json_repair_stats.stats().get("test", {}).get("failed", 0)
+    with pytest.raises(JSONRepairError):
+        parse_llm_json('{"a": "he said "hi", ok", "b": 2}', "test")
+    assert json_repair_stats.stats()["test"]["failed"] == before + 1
+
+
+def test_top_level_must_be_object():
+    with pytest.raises(JSONRepairError):
+        parse_llm_json("[1, 2]", "test")
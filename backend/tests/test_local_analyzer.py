@@ -0,0 +1,74 @@
+"""本地规则表：必须命中 / 必须交给 LLM 的输入"""
+import pytest
+
+from services.local_analyzer import LocalAnalyzer, _match_line
+
+MATCHES = [
+    ("晚安", "good_night"),
+    ("我睡了哦", "good_night"),
+    ("早安呀", "good_morning"),
+    ("在吗", "greeting"),
+    ("hello", "greeting"),
+    ("哈哈", "laugh"),
+    ("哈哈哈哈", "laugh"),
+    ("haha", "laugh"),
+    ("hahaha", "laugh"),
+    ("hhh", "laugh"),
+    ("嘻嘻", "laugh"),
+    ("23333", "laugh"),
+    ("笑死我了", "laugh"),
+    ("xswl", "laugh"),
+    ("LOL", "laugh"),
+    ("谢谢你", "thanks"),
+    ("想你了", "affection"),
+    ("好的", "acknowledge"),
+    ("闭嘴", "angry"),
+    ("烦死了", "angry"),
+    ("别烦我", "angry"),
+    ("呜呜呜", "sad"),
+    ("好难过啊", "sad"),
+    ("😍", "emoji_love"),
+    ("😂😂", "emoji_happy"),
+    ("😡", "emoji_angry"),
+    ("😭", "emoji_sad"),
+    ("晚安🌙", "good_night"),
+]
+
+NO_MATCH = [
+    "h",
+    "hh",
+    "嘿",
+    "哈",
+    "233",
+    "滚",
+    "滚啦",
+    "无语",
+    "无语了",
+    "哦",
+    "嗯",
+    "随便",
+    "你昨天为什么一整晚都不回我消息",
+    "😍😡",
+]
+
+
+@pytest.mark.parametrize("text,rule", MATCHES)
+def test_rule_matches(text, rule):
+    matched = _match_line(text)
+    assert matched is not None and matched.name == rule
+
+
+@pytest.mark.parametrize("text", NO_MATCH)
+def test_rule_does_not_match(text):
+    assert _match_line(text) is None
+
+
+@pytest.mark.parametrize("text", NO_MATCH)
+def test_unmatched_input_falls_through_to_llm(text):
+    assert LocalAnalyzer().try_answer(text) is None
+
+
+def test_multiline_needs_every_line_matched():
+    analyzer = LocalAnalyzer()
+    assert analyzer.try_answer("晚安\n晚安") is not None
+    assert analyzer.try_answer("晚安\n你明天几点起") is None
@@ -0,0 +1,111 @@
+"""
+离线训练态势分析分类器（CPU，数秒内完成）
+
+数据来源：
+  data/analyze_labels.jsonl —— ANALYZE_LABEL_LOG=true 时每次 LLM 态势分析成功后追加的 {text, intent, strategy, emotion_score}
+  （超过 ANALYZE_LABEL_MAX_MB 后轮转为 analyze_labels.jsonl.1，两个文件都会读取）
+  （data/lora_train*.jsonl 与 feedback 只有回复文本，没有意图 / 策略标注，不参与训练）
+
+Usage (from backend/):
+  python train_classifier.py [--labels data/analyze_labels.jsonl] [--output data/intent_classifier.npz]
+
+训练完成后重启后端（或调用 intent_classifier.load()）即可生效。
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+from typing import Dict, List
+
+from services.intent_classifier import (
+    DEFAULT_MODEL_PATH,
+    HEADS,
+    LABELS_PATH,
+    IntentClassifier,
+    NaiveBayesHead,
+    extract_features,
+)
+
+
+def load_samples(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Dataset not found: {path}")
+    latest: Dict[str, Dict] = {}
+    # 先读轮转出的旧文件（path.1），再读当前文件
+    for source in (path + ".1", path):
+        if not os.path.exists(source):
+            continue
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    sample = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                text = str(sample.get("text", "")).strip()
+                if text and all(sample.get(head) is not None for head in HEADS):
+                    # 相同文本以最近一次标注为准
+                    latest[text] = sample
+    return list(latest.values())
+
+
+def fit(samples: List[Dict], alpha: float) -> IntentClassifier:
+    docs = [extract_features(s["text"]) for s in samples]
+    classifier = IntentClassifier(autoload=False)
+    classifier.heads = {
+        head: NaiveBayesHead.fit(docs, [str(s[head]) for s in samples], alpha=alpha)
+        for head in HEADS
+    }
+    return classifier
+
+
+def evaluate(classifier: IntentClassifier, samples: List[Dict]) -> Dict[str, float]:
+    correct = {head: 0 for head in HEADS}
+    for sample in samples:
+        doc = extract_features(sample["text"])
+        for head, model in classifier.heads.items():
+            probs = model.predict_proba(doc)
+            if model.classes[int(probs.argmax())] == str(sample[head]):
+                correct[head] += 1
+    return {head: round(count / len(samples), 3) for head, count in correct.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the analyze intent/strategy/emotion classifier")
+    parser.add_argument("--labels", default=LABELS_PATH)
+    parser.add_argument("--output", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--alpha", type=float, default=0.5, help="Laplace smoothing")
+    parser.add_argument("--holdout", type=float, default=0.1, help="fraction held out for evaluation")
+    parser.add_argument("--min-samples", type=int, default=50)
+    args = parser.parse_args()
+
+    samples = load_samples(args.labels)
+    print(f"Loaded {len(samples)} labelled samples from {args.labels}")
+    if len(samples) < args.min_samples:
+        raise SystemExit(f"Need at least {args.min_samples} samples, got {len(samples)}")
+
+    random.Random(42).shuffle(samples)
+    split = max(1, int(len(samples) * args.holdout))
+    holdout, train = samples[:split], samples[split:]
+
+    accuracy = evaluate(fit(train, args.alpha), holdout)
+    print(f"Holdout accuracy ({len(holdout)} samples): {accuracy}")
+
+    # 评估后用全部数据重新训练
+    classifier = fit(samples, args.alpha)
+    classifier.save(args.output, {
+        "samples": len(samples),
+        "alpha": args.alpha,
+        "holdout_accuracy": accuracy,
+        "trained_at": int(time.time() * 1000),
+    })
+    size_kb = os.path.getsize(args.output) / 1024
+    print(f"Saved model to {args.output} ({size_kb:.0f} KB)")
+
+
+if __name__ == "__main__":
+    main()